@@ -1,49 +1,549 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
-from pydantic import BaseModel
-from typing import List, Optional, Any
-import requests
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from langchain_core.outputs import Generation
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional, Any, Tuple
+import asyncio
+import httpx
+import json
 import os
+import time
 
-from src.core.chains import analysis_chain, test_generation_chain, explanation_chain, chat_chain
-from src.memory.memory import get_user_history
-
-app = FastAPI(title="LangChain Assistant API")
+from src.core.cache import MISSING, ResultCache, TTLCache, digest
+from src.core.fingerprint import fingerprint_code
+from src.core.splitting import chunk_code, estimate_tokens, merge_analyses, reduce_analyses, split_code_units
+from src.core.llm import MODEL_NAME
+from src.core.metrics import CONTENT_TYPE, MetricsMiddleware, metrics
+from src.core.parsers import CodeAnalysis, TestGeneration, TestExplanation, explanation_parser
+from src.core.repair import repair_stats
+from src.core.singleflight import SingleFlight
+from src.core.tracing import TRACE_PATH, TRACING, BatchExporter, JsonlSink, TracingMiddleware, mark_failed, tracing_stats
+from src.prompts.prompts import PROMPT_VERSION
+from src.core.tokens import InvalidToken, SECRET_KEY, decode_token
+from src.core.chains import (
+    OUTPUT_MODE, build_seconds, chain_stats, chunk_text, get_chain, parse_output, summarize_history, warm_up
+)
+from src.memory.memory import get_history_page, history_stats, iter_history, update_summary
+from src.memory.retrieval import retrieval_stats
 
 # Configuration
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth:8000")
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", "5"))
+AUTH_MAX_CONNECTIONS = int(os.getenv("AUTH_MAX_CONNECTIONS", "50"))
+# Tokens verified by the auth service are remembered for AUTH_CACHE_TTL seconds (not with
+# AUTH_REVOCATION_CHECK), rejected ones for AUTH_CACHE_NEGATIVE_TTL
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_NEGATIVE_TTL = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", "5"))
+# With a shared AUTH_SECRET_KEY tokens are checked locally, so a logout only takes effect
+# on this service when it asks /me about revocation on every request (uncached, see fetch_username)
+AUTH_REVOCATION_CHECK = os.getenv("AUTH_REVOCATION_CHECK", "false").lower() == "true"
+# Maximum number of chain runs in flight per worker process
+MAX_CONCURRENT_CHAINS = int(os.getenv("MAX_CONCURRENT_CHAINS", "8"))
+# Results of the deterministic chains; the disk tier is enabled by setting RESULT_CACHE_PATH
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "86400"))
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "")
+RESULT_CACHE_DISK_SIZE = int(os.getenv("RESULT_CACHE_DISK_SIZE", "100000"))
+# Chains to build at startup rather than on first use: comma-separated names, or "all"
+WARM_CHAINS = os.getenv("WARM_CHAINS", "")
+# /batch: items per request, and chain runs in flight per batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(MAX_CONCURRENT_CHAINS)))
+# /history page size: default and maximum
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "500"))
+# Code estimated above this many tokens is analyzed chunk by chunk (map-reduce)
+MAX_CHUNK_TOKENS = int(os.getenv("MAX_CHUNK_TOKENS", "4000"))
+# Identical chain runs already in flight are joined rather than repeated (see run_cached_chain)
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+
+chain_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHAINS)
+
+async def run_chain(chain, inputs: dict, config: Optional[dict] = None):
+    """
+    Runs a chain through its async path so the event loop stays free
+    while waiting on the LLM. Bounded by MAX_CONCURRENT_CHAINS.
+    """
+    async with chain_semaphore:
+        return await chain.ainvoke(inputs, config=config)
+
+# --- Result cache ---
+result_cache = ResultCache(
+    max_size=RESULT_CACHE_SIZE,
+    ttl=RESULT_CACHE_TTL,
+    path=RESULT_CACHE_PATH or None,
+    disk_max_size=RESULT_CACHE_DISK_SIZE,
+)
+
+def lookup_result(name: str, inputs: dict, output_model, bypass: bool = False,
+                  key_inputs: Optional[dict] = None):
+    """
+    Returns (cache key, cached result or None).
+    key_inputs, when given, replaces inputs as the cache key (e.g. a code fingerprint).
+    """
+    # Results of differently worded prompts are kept apart
+    key = ResultCache.make_key(name, MODEL_NAME, f"{PROMPT_VERSION}:{OUTPUT_MODE}", key_inputs or inputs)
+    if bypass:
+        result_cache.record_bypass()
+        return key, None
+    cached = result_cache.get(key)
+    if cached is MISSING:
+        return key, None
+    if cached["source"] != digest(inputs):
+        fingerprint_stats["normalization_only_hits"] += 1
+    return key, output_model(**cached["result"])
+
+def store_result(key: str, inputs: dict, result: BaseModel):
+    result_cache.set(key, {"result": result.model_dump(), "source": digest(inputs)})
+
+# Chain runs in flight, by result cache key
+in_flight = SingleFlight()
+
+async def run_cached_chain(name: str, chain, inputs: dict, output_model, bypass: bool = False,
+                           key_inputs: Optional[dict] = None):
+    """
+    Runs a parser-terminated chain, serving repeated inputs from the result cache
+    and sharing one run among concurrent identical requests.
+    With bypass the cache is not read, but the fresh result still replaces the entry.
+    """
+    key, cached = lookup_result(name, inputs, output_model, bypass, key_inputs)
+    if cached is not None:
+        return cached
+    return await run_uncached_chain(name, key, chain, inputs, output_model)
+
+async def run_uncached_chain(name: str, key: str, chain, inputs: dict, output_model):
+    """
+    The cache-miss half of run_cached_chain: runs the chain (or joins the same
+    run already in flight) and stores the result under key.
+    """
+    async def call():
+        result = output_model.model_validate(await run_chain(chain, inputs), from_attributes=True)
+        store_result(key, inputs, result)
+        return result
+
+    if not COALESCE_REQUESTS:
+        return await call()
+    # The cache key covers chain name, model, prompt version and input, so a
+    # request arriving while the same run is in flight waits for its result
+    return await in_flight.do(key, call, name)
+
+# --- Code fingerprints ---
+fingerprint_stats = {"parsed": 0, "raw_fallback": 0, "normalization_only_hits": 0}
+
+def code_key(code: str) -> dict:
+    """
+    Cache key inputs for submitted code, so that cosmetic edits share an entry.
+    """
+    fingerprint, parsed = fingerprint_code(code)
+    fingerprint_stats["parsed" if parsed else "raw_fallback"] += 1
+    return {"code_fingerprint": fingerprint}
+
+async def analyze_one(code: str, bypass: bool) -> CodeAnalysis:
+    return await run_cached_chain(
+        "analysis", get_chain("analysis"), {"code": code}, CodeAnalysis, bypass, key_inputs=code_key(code)
+    )
+
+async def analyze_chunked(code: str, bypass: bool, max_chunk_tokens: int) -> Tuple[CodeAnalysis, int]:
+    """
+    Analyzes code in one go if it fits in max_chunk_tokens, chunk by chunk
+    (reduced locally) otherwise. Returns the analysis and the number of chunks.
+    """
+    if estimate_tokens(code) <= max_chunk_tokens:
+        return await analyze_one(code, bypass), 1
+    chunks = chunk_code(code, max_chunk_tokens)
+    results = await asyncio.gather(*[analyze_one(chunk, bypass) for chunk in chunks])
+    return reduce_analyses(results), len(chunks)
+
+async def analyze(code: str, bypass: bool = False, incremental: bool = False,
+                  max_chunk_tokens: Optional[int] = None):
+    """
+    Analyzes code as a whole, or unit by unit (top-level functions and classes)
+    when incremental is set; code or units larger than max_chunk_tokens are
+    analyzed chunk by chunk. Units and chunks are analyzed concurrently and
+    cached on their own, so resubmitting a module only pays for the parts that
+    changed. Returns the merged analysis, the per-unit results (None unless
+    incremental) and the number of chunks analyzed.
+    """
+    max_chunk_tokens = max_chunk_tokens or MAX_CHUNK_TOKENS
+    units = split_code_units(code) if incremental else []
+    if len(units) > 1:
+        analyzed = await asyncio.gather(*[analyze_chunked(source, bypass, max_chunk_tokens) for _, source in units])
+        named = [(name, result) for (name, _), (result, _) in zip(units, analyzed)]
+        unit_outputs = [UnitAnalysis(name=name, **result.model_dump()) for name, result in named]
+        return merge_analyses(named), unit_outputs, sum(chunks for _, chunks in analyzed)
+
+    result, chunks = await analyze_chunked(code, bypass, max_chunk_tokens)
+    return result, None, chunks
+
+async def generate_tests(code: str, bypass: bool = False) -> TestGeneration:
+    return await run_cached_chain(
+        "test_generation", get_chain("test_generation"), {"code": code}, TestGeneration, bypass,
+        key_inputs=code_key(code)
+    )
+
+async def timed(awaitable):
+    """
+    Awaits and returns (result, seconds taken).
+    """
+    start = time.perf_counter()
+    result = await awaitable
+    return result, time.perf_counter() - start
+
+async def cancel(task: asyncio.Task):
+    if not task.done():
+        task.cancel()
+    # Collect the outcome so a failed speculative run is not reported as unretrieved
+    await asyncio.gather(task, return_exceptions=True)
+
+# --- Full pipeline ---
+pipeline_stats = {"runs": 0, "speculative_runs": 0, "speculative_cancelled": 0}
+
+async def pipeline_stages(input: "CodeInput", bypass: bool = False):
+    """
+    Runs analysis -> test generation -> explanation, yielding
+    (stage, response fields, seconds) as each stage completes.
+    In speculative mode test generation starts alongside the analysis and is
+    cancelled if the code turns out not to be optimal.
+    """
+    pipeline_stats["runs"] += 1
+    test_task = None
+    if input.speculative:
+        pipeline_stats["speculative_runs"] += 1
+        test_task = asyncio.create_task(timed(generate_tests(input.code, bypass)))
+    try:
+        # Step 1: Analyze
+        (analysis, units, chunks), seconds = await timed(
+            analyze(input.code, bypass, input.incremental, input.max_chunk_tokens)
+        )
+        fields = {
+            "analysis": {
+                "is_optimal": analysis.is_optimal,
+                "issues": analysis.issues,
+                "suggestions": analysis.suggestions,
+                "chunks": chunks
+            }
+        }
+        if units is not None:
+            fields["analysis"]["units"] = [unit.model_dump() for unit in units]
+        yield "analysis", fields, seconds
+
+        if not analysis.is_optimal:
+            if test_task is not None:
+                pipeline_stats["speculative_cancelled"] += 1
+            return
+
+        # Step 2: Generate Test
+        if test_task is None:
+            test_task = asyncio.create_task(timed(generate_tests(input.code, bypass)))
+        test_gen, seconds = await test_task
+        yield "test_generation", {"test_code": test_gen.test_code}, seconds
+
+        # Step 3: Explain Test
+        explanation, seconds = await timed(run_cached_chain(
+            "explanation", get_chain("explanation"), {"test_code": test_gen.test_code}, TestExplanation, bypass
+        ))
+        yield "explanation", {"explanation": explanation.explanation}, seconds
+    finally:
+        # Also reached when analysis fails or a streaming client goes away
+        if test_task is not None:
+            await cancel(test_task)
+
+# --- Chat history summaries ---
+summary_stats = {"scheduled": 0, "errors": 0}
+# Keeps references so running summaries are not garbage collected
+background_tasks = set()
+
+async def _update_summary(session_id: str):
+    try:
+        await update_summary(session_id, summarize_history)
+    except Exception:
+        summary_stats["errors"] += 1
+
+def schedule_summary(session_id: str):
+    """
+    Updates the session's running summary off the request path.
+    """
+    summary_stats["scheduled"] += 1
+    task = asyncio.create_task(_update_summary(session_id))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# --- Streaming ---
+stream_stats = {}  # endpoint -> {"streams", "errors", "ttft_total_seconds", "ttft_max_seconds"}
+
+async def sse_events(name: str, tokens):
+    """
+    Wraps an async iterator of text tokens as server-sent events, recording
+    time-to-first-token. Ends with a `done` event, or an `error` event on failure.
+    """
+    stats = stream_stats.setdefault(
+        name, {"streams": 0, "errors": 0, "ttft_total_seconds": 0.0, "ttft_max_seconds": 0.0}
+    )
+    stats["streams"] += 1
+    start = time.perf_counter()
+    first = True
+    try:
+        async for token in tokens:
+            if first:
+                ttft = time.perf_counter() - start
+                stats["ttft_total_seconds"] += ttft
+                stats["ttft_max_seconds"] = max(stats["ttft_max_seconds"], ttft)
+                first = False
+            yield f"data: {json.dumps({'token': token})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    except Exception as e:
+        stats["errors"] += 1
+        mark_failed()
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+async def chat_tokens(message: str, session_id: str):
+    """
+    Streams the chat reply. RunnableWithMessageHistory saves the exchange
+    once, when the stream completes.
+    """
+    config = {"configurable": {"session_id": session_id}}
+    async with chain_semaphore:
+        async for chunk in get_chain("chat").astream({"input": message}, config=config):
+            if chunk.content:
+                yield chunk.content
+    schedule_summary(session_id)
+
+async def explanation_tokens(test_code: str, bypass: bool = False):
+    """
+    Streams the explanation text as the model writes it, then parses the
+    complete output and caches the result only if it is valid and not empty.
+    """
+    inputs = {"test_code": test_code}
+    key, cached = lookup_result("explanation", inputs, TestExplanation, bypass)
+    if cached is not None:
+        yield cached.explanation
+        return
+
+    raw = ""
+    text = ""
+    async with chain_semaphore:
+        async for chunk in get_chain("explanation_stream").astream(inputs):
+            raw += chunk_text(chunk)
+            # The explanation so far, if the output has grown into parseable JSON
+            partial = explanation_parser.parse_result([Generation(text=raw)], partial=True)
+            explanation = partial.explanation if partial is not None else ""
+            if len(explanation) > len(text) and explanation.startswith(text):
+                yield explanation[len(text):]
+                text = explanation
+        # Parsed once complete, with the same repairs (and LLM retry) as /explain_test
+        result = await parse_output("explanation", raw)
+
+    if not result.explanation:
+        raise ValueError("The model returned an empty explanation")
+    store_result(key, inputs, result)
+    if not result.explanation.startswith(text):
+        # Already sent text cannot be taken back; the corrected result is cached for /explain_test
+        raise ValueError("The streamed explanation was revised; fetch it again from /explain_test")
+    if len(result.explanation) > len(text):
+        yield result.explanation[len(text):]
+
+# --- Batch ---
+def batch_target(mode: str):
+    """
+    Returns (cache name, chain, output model, chain input key) for a batch mode.
+    """
+    if mode == "generate":
+        return "test_generation", get_chain("test_generation"), TestGeneration, "code"
+    if mode == "explain":
+        return "explanation", get_chain("explanation"), TestExplanation, "test_code"
+    return "analysis", get_chain("analysis"), CodeAnalysis, "code"
+
+async def batch_results(input: "BatchInput", bypass: bool = False):
+    """
+    Yields one result dict per item, in completion order. Cached items come
+    first; the rest run like single requests (chain_semaphore, coalescing),
+    at most max_concurrency of them at a time.
+    """
+    name, chain, output_model, input_key = batch_target(input.mode)
+    pending = []  # (index, inputs, cache key)
+    for index, item in enumerate(input.items):
+        inputs = {input_key: item.code}
+        key_inputs = code_key(item.code) if input_key == "code" else None
+        key, cached = lookup_result(name, inputs, output_model, bypass, key_inputs)
+        if cached is not None:
+            yield {"index": index, "id": item.id, "cached": True, "result": cached.model_dump()}
+        else:
+            pending.append((index, inputs, key))
+    if not pending:
+        return
+
+    limit = asyncio.Semaphore(min(input.max_concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+
+    async def run_item(index: int, inputs: dict, key: str):
+        async with limit:
+            try:
+                return index, await run_uncached_chain(name, key, chain, inputs, output_model)
+            except Exception as e:
+                return index, e
+
+    tasks = [asyncio.ensure_future(run_item(*item)) for item in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, result = await next_done
+            item_id = input.items[index].id
+            if isinstance(result, Exception):
+                mark_failed()
+                yield {"index": index, "id": item_id, "error": str(result)}
+            else:
+                yield {"index": index, "id": item_id, "cached": False, "result": result.model_dump()}
+    finally:
+        # The client may stop reading before every item is done
+        for task in tasks:
+            task.cancel()
+
+# --- Auth client & token cache ---
+auth_client: Optional[httpx.AsyncClient] = None
+# token -> username, or None for a token the auth service rejected
+token_cache = TTLCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+auth_hop_stats = {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+local_auth_stats = {"verified": 0, "rejected": 0}
+
+def get_auth_client() -> httpx.AsyncClient:
+    """
+    Returns the shared auth service client, creating it on first use.
+    """
+    global auth_client
+    if auth_client is None:
+        auth_client = httpx.AsyncClient(
+            timeout=AUTH_TIMEOUT,
+            limits=httpx.Limits(max_connections=AUTH_MAX_CONNECTIONS, max_keepalive_connections=AUTH_MAX_CONNECTIONS),
+        )
+    return auth_client
+
+async def fetch_username(token: str) -> Optional[str]:
+    """
+    Asks the auth service who owns the token.
+    Returns None if the token is rejected; raises 503 if the service fails.
+    """
+    start = time.perf_counter()
+    failed = False
+    try:
+        response = await get_auth_client().get(f"{AUTH_SERVICE_URL}/me", params={"token": token})
+        # Only a 401 rejects the token; anything else (5xx, 429...) is the auth
+        # service failing, which must neither fail the user's token nor be cached
+        failed = response.status_code not in (200, 401)
+    except httpx.HTTPError:
+        failed = True
+    finally:
+        elapsed = time.perf_counter() - start
+        auth_hop_stats["calls"] += 1
+        if failed:
+            auth_hop_stats["errors"] += 1
+        auth_hop_stats["total_seconds"] += elapsed
+        auth_hop_stats["max_seconds"] = max(auth_hop_stats["max_seconds"], elapsed)
+        metrics.observe_stage("auth_hop", elapsed, error=failed)
+
+    if failed:
+        raise HTTPException(status_code=503, detail="Auth service unavailable")
+    if response.status_code == 401:
+        token_cache.set(token, None, ttl=AUTH_CACHE_NEGATIVE_TTL)
+        return None
+    username = response.json()["username"]
+    # A cached answer would keep a logged-out token valid for AUTH_CACHE_TTL
+    if not AUTH_REVOCATION_CHECK:
+        token_cache.set(token, username)
+    return username
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARM_CHAINS:
+        warm_up(None if WARM_CHAINS == "all" else [name.strip() for name in WARM_CHAINS.split(",")])
+    yield
+    if trace_exporter is not None:
+        trace_exporter.flush()
+    global auth_client
+    if auth_client is not None:
+        await auth_client.aclose()
+        auth_client = None
+
+app = FastAPI(title="LangChain Assistant API", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+# Sampled in-process tracing (see tracing.py); LangSmith's LANGCHAIN_TRACING_V2 traces every run instead
+trace_exporter = BatchExporter(JsonlSink(TRACE_PATH)) if TRACING else None
+if TRACING:
+    app.add_middleware(TracingMiddleware, exporter=trace_exporter)
 
 # --- Dependencies ---
 async def verify_token(authorization: str = Header(...)):
     """
-    Verifies the token with the auth service.
+    Verifies the token signature locally, falling back to the auth service
+    when no secret is configured or revocation checks are enabled.
     Returns the username if valid.
     """
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid token format")
-        
-    token = authorization.split(" ")[1]
-    
-    # Call auth service to verify
-    try:
-        response = requests.get(f"{AUTH_SERVICE_URL}/me", params={"token": token})
-        if response.status_code != 200:
-             raise HTTPException(status_code=401, detail="Invalid token")
-        return response.json()["username"]
-    except requests.RequestException:
-        raise HTTPException(status_code=503, detail="Auth service unavailable")
+    with metrics.stage("auth"):
+        if not authorization.startswith("Bearer "):
+            raise HTTPException(status_code=401, detail="Invalid token format")
+
+        token = authorization.split(" ")[1]
+
+        if SECRET_KEY:
+            try:
+                claims = decode_token(token)
+            except InvalidToken:
+                local_auth_stats["rejected"] += 1
+                raise HTTPException(status_code=401, detail="Invalid token")
+            local_auth_stats["verified"] += 1
+            if not AUTH_REVOCATION_CHECK:
+                return claims["sub"]
+
+        username = token_cache.get(token)
+        if username is MISSING:
+            username = await fetch_username(token)
+        if username is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return username
+
+def cache_bypass(cache_control: Optional[str] = Header(None)) -> bool:
+    """
+    True when the client sent `Cache-Control: no-cache` to force a fresh LLM call.
+    """
+    return cache_control is not None and "no-cache" in cache_control.lower()
 
 # --- Models ---
 class CodeInput(BaseModel):
     code: str
+    # Analyze top-level functions and classes separately (see analyze)
+    incremental: bool = False
+    # Overrides MAX_CHUNK_TOKENS for this request
+    max_chunk_tokens: Optional[int] = Field(None, gt=0)
+    # Pipeline only: start test generation before the analysis is known
+    speculative: bool = False
 
 class TestExecutionOutput(BaseModel):
     test_code: str
     explanation: Optional[str] = None
 
+class UnitAnalysis(BaseModel):
+    name: str
+    is_optimal: bool
+    issues: List[str]
+    suggestions: List[str]
+
 class AnalysisOutput(BaseModel):
     is_optimal: bool
     issues: List[str]
     suggestions: List[str]
+    units: Optional[List[UnitAnalysis]] = None
+    chunks: int = 1
+
+class BatchItem(BaseModel):
+    code: str
+    # Echoed back so clients can match results, e.g. a file path
+    id: Optional[str] = None
+
+class BatchInput(BaseModel):
+    mode: Literal["analyze", "generate", "explain"] = "analyze"
+    items: List[BatchItem] = Field(..., max_length=BATCH_MAX_ITEMS)
+    # Capped at BATCH_CONCURRENCY
+    max_concurrency: Optional[int] = Field(None, gt=0)
 
 class ChatInput(BaseModel):
     message: str
@@ -54,78 +554,223 @@ class ChatResponse(BaseModel):
 # --- Endpoints ---
 
 @app.post("/analyze", response_model=AnalysisOutput)
-async def analyze_code(input: CodeInput, username: str = Depends(verify_token)):
+async def analyze_code(input: CodeInput, username: str = Depends(verify_token), bypass: bool = Depends(cache_bypass)):
     try:
-        result = analysis_chain.invoke({"code": input.code})
+        result, units, chunks = await analyze(input.code, bypass, input.incremental, input.max_chunk_tokens)
         # Format for response
         return AnalysisOutput(
             is_optimal=result.is_optimal,
             issues=result.issues,
-            suggestions=result.suggestions
+            suggestions=result.suggestions,
+            units=units,
+            chunks=chunks
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate_test")
-async def generate_test(input: CodeInput, username: str = Depends(verify_token)):
+async def generate_test(input: CodeInput, username: str = Depends(verify_token), bypass: bool = Depends(cache_bypass)):
     try:
-        result = test_generation_chain.invoke({"code": input.code})
+        result = await run_cached_chain(
+            "test_generation", get_chain("test_generation"), {"code": input.code}, TestGeneration, bypass,
+            key_inputs=code_key(input.code)
+        )
         return {"test_code": result.test_code}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/explain_test")
-async def explain_test(input: TestExecutionOutput, username: str = Depends(verify_token)):
+async def explain_test(input: TestExecutionOutput, username: str = Depends(verify_token), bypass: bool = Depends(cache_bypass)):
     try:
-        result = explanation_chain.invoke({"test_code": input.test_code})
+        result = await run_cached_chain("explanation", get_chain("explanation"), {"test_code": input.test_code}, TestExplanation, bypass)
         return {"explanation": result.explanation}
     except Exception as e:
          raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/full_pipeline")
-async def full_pipeline(input: CodeInput, username: str = Depends(verify_token)):
+async def full_pipeline(input: CodeInput, username: str = Depends(verify_token), bypass: bool = Depends(cache_bypass)):
     try:
-        # Step 1: Analyze
-        analysis = analysis_chain.invoke({"code": input.code})
-        
-        response = {
-            "analysis": {
-                "is_optimal": analysis.is_optimal,
-                "issues": analysis.issues,
-                "suggestions": analysis.suggestions
-            }
-        }
-        
-        if not analysis.is_optimal:
-            return response
-            
-        # Step 2: Generate Test
-        test_gen = test_generation_chain.invoke({"code": input.code})
-        response["test_code"] = test_gen.test_code
-        
-        # Step 3: Explain Test
-        explanation = explanation_chain.invoke({"test_code": test_gen.test_code})
-        response["explanation"] = explanation.explanation
-        
+        start = time.perf_counter()
+        response = {}
+        timings = {}
+        async for stage, fields, seconds in pipeline_stages(input, bypass):
+            response.update(fields)
+            timings[stage] = seconds
+        timings["total"] = time.perf_counter() - start
+        response["timings"] = timings
         return response
         
     except Exception as e:
          raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/full_pipeline/stream")
+async def full_pipeline_stream(input: CodeInput, username: str = Depends(verify_token), bypass: bool = Depends(cache_bypass)):
+    """
+    Same as /full_pipeline, but sends each stage as an NDJSON line as soon as it is ready.
+    """
+    async def lines():
+        try:
+            async for stage, fields, seconds in pipeline_stages(input, bypass):
+                yield json.dumps({"stage": stage, "seconds": seconds, **fields}) + "\n"
+        except Exception as e:
+            # Headers are already sent, so errors travel in-band
+            mark_failed()
+            yield json.dumps({"stage": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/explain_test/stream")
+async def explain_test_stream(input: TestExecutionOutput, username: str = Depends(verify_token), bypass: bool = Depends(cache_bypass)):
+    return StreamingResponse(
+        sse_events("explain_test", explanation_tokens(input.test_code, bypass)),
+        media_type="text/event-stream"
+    )
+
+@app.post("/batch")
+async def batch(input: BatchInput, username: str = Depends(verify_token), bypass: bool = Depends(cache_bypass)):
+    """
+    Runs many code units through one chain and streams an NDJSON line per item
+    as soon as it is done. Failed items carry an error instead of a result.
+    """
+    async def lines():
+        try:
+            async for line in batch_results(input, bypass):
+                yield json.dumps(line) + "\n"
+        except Exception as e:
+            mark_failed()
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(input: ChatInput, username: str = Depends(verify_token)):
     try:
         # Using session_id = username for this exam
         config = {"configurable": {"session_id": username}}
         
-        response = chat_chain.invoke(
+        response = await run_chain(
+            get_chain("chat"),
             {"input": input.message},
             config=config
         )
+        schedule_summary(username)
         return ChatResponse(response=response.content)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(input: ChatInput, username: str = Depends(verify_token)):
+    # Using session_id = username for this exam
+    return StreamingResponse(
+        sse_events("chat", chat_tokens(input.message, username)),
+        media_type="text/event-stream"
+    )
+
 @app.get("/history")
-async def get_history(username: str = Depends(verify_token)):
-    return get_user_history(username)
+async def get_history(
+    username: str = Depends(verify_token),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    before: Optional[int] = Query(None, description="Only return messages older than this message id")
+):
+    """
+    One page of history, oldest first. Pass next_before back as `before` to get
+    the previous page; it is null once the start of the history is reached.
+    """
+    messages, next_before = get_history_page(username, limit, before)
+    return {"messages": messages, "next_before": next_before}
+
+@app.get("/history/stream")
+async def get_history_stream(username: str = Depends(verify_token)):
+    """
+    The whole history as NDJSON, one message per line, oldest first.
+    """
+    # Taken here, on the event loop: StreamingResponse consumes a sync
+    # generator on the threadpool, and the in-memory session store is not thread-safe
+    messages = iter_history(username)
+
+    def lines():
+        for message in messages:
+            yield json.dumps(message) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+# --- Metrics ---
+def counter_samples():
+    """
+    Cache lookups, output repairs and coalesced runs for /metrics, read from
+    the counters kept for /stats.
+    """
+    counters = result_cache.counters
+    lookups = "cache_lookups_total"
+    yield lookups, "counter", {"cache": "result", "result": "hit", "tier": "memory"}, counters["memory_hits"]
+    yield lookups, "counter", {"cache": "result", "result": "hit", "tier": "disk"}, counters["disk_hits"]
+    yield lookups, "counter", {"cache": "result", "result": "miss"}, counters["misses"]
+    yield lookups, "counter", {"cache": "result", "result": "bypass"}, counters["bypassed"]
+    yield lookups, "counter", {"cache": "token", "result": "hit"}, token_cache.hits
+    yield lookups, "counter", {"cache": "token", "result": "miss"}, token_cache.misses
+    for outcome, count in repair_stats.items():
+        yield "output_repairs_total", "counter", {"outcome": outcome}, count
+    for name, stats in in_flight.stats.items():
+        for outcome, count in stats.items():
+            yield "singleflight_total", "counter", {"chain": name, "outcome": outcome}, count
+
+metrics.describe("cache_lookups_total", "counter", "Cache lookups by cache and outcome")
+metrics.describe("singleflight_total", "counter", "Chain runs started, and requests that joined one instead (coalesced)")
+metrics.describe("output_repairs_total", "counter", "Structured outputs by how they were parsed (see repair.py)")
+metrics.collect(counter_samples)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Per-stage latency histograms, token counts, cache lookups and errors in
+    the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+@app.get("/stats")
+async def get_stats():
+    calls = auth_hop_stats["calls"]
+    searches = retrieval_stats["searches"]
+    return {
+        "results": result_cache.stats(),
+        "fingerprint": fingerprint_stats,
+        "pipeline": pipeline_stats,
+        "coalescing": {
+            "enabled": COALESCE_REQUESTS,
+            "in_flight": in_flight.in_flight(),
+            "chains": in_flight.stats,
+            "upstream_calls_saved": sum(stats["coalesced"] for stats in in_flight.stats.values()),
+        },
+        "summaries": summary_stats,
+        "repair": repair_stats,
+        "tracing": {"enabled": TRACING, **tracing_stats},
+        "chains": {
+            "output_mode": OUTPUT_MODE,
+            "build_seconds": build_seconds,
+            "runs": {
+                name: {
+                    **stats,
+                    "avg_prompt_tokens": stats["prompt_tokens"] / stats["runs"] if stats["runs"] else 0.0,
+                    "avg_seconds": stats["total_seconds"] / stats["runs"] if stats["runs"] else 0.0,
+                }
+                for name, stats in chain_stats.items()
+            },
+        },
+        "memory": history_stats(),
+        "retrieval": {
+            **retrieval_stats,
+            "avg_seconds": retrieval_stats["total_seconds"] / searches if searches else 0.0,
+        },
+        "streaming": {
+            name: {**stats, "ttft_avg_seconds": stats["ttft_total_seconds"] / stats["streams"] if stats["streams"] else 0.0}
+            for name, stats in stream_stats.items()
+        },
+        "auth": {
+            "local": local_auth_stats,
+            "cache": token_cache.stats(),
+            "hop": {
+                **auth_hop_stats,
+                "avg_seconds": auth_hop_stats["total_seconds"] / calls if calls else 0.0,
+            },
+        }
+    }
@@ -1,15 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, status, Depends
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
+import asyncio
+import os
 
-app = FastAPI(title="Authentication Service")
+from src.api.authentication.user_store import UserStore
+from src.core.metrics import CONTENT_TYPE, MetricsMiddleware, metrics
+from src.core.tokens import SECRET_KEY, InvalidToken, create_token, decode_token
+
+# Configuration
+# bcrypt cost factor: each +1 doubles the time spent per hash
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads available for hashing; bcrypt releases the GIL while it works
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# SQLite file shared by every auth worker; survives restarts
+USERS_DB_PATH = os.getenv("USERS_DB_PATH", "users.sqlite")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+# Threads for UserStore calls, which may wait on other workers' writes (SQLite busy timeout)
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="users-db")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Without a secret every /login would fail; refuse to start instead
+    if not SECRET_KEY:
+        raise RuntimeError("AUTH_SECRET_KEY is not set")
+    yield
+    hash_executor.shutdown(wait=False)
+    db_executor.shutdown(wait=False)
+
+app = FastAPI(title="Authentication Service", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 # --- Security & Utils ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
-fake_users_db = {}  # In-memory user store: username -> hashed_password
+users = UserStore(USERS_DB_PATH, cache_size=USER_CACHE_SIZE, cache_ttl=USER_CACHE_TTL)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -17,6 +51,57 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def hash_password(password):
+    """
+    Hashes a password on the worker pool so the event loop keeps serving requests.
+    """
+    loop = asyncio.get_running_loop()
+    with metrics.stage("hash"):
+        return await loop.run_in_executor(hash_executor, get_password_hash, password)
+
+async def check_password(plain_password, hashed_password):
+    """
+    Verifies a password on the worker pool so the event loop keeps serving requests.
+    """
+    loop = asyncio.get_running_loop()
+    with metrics.stage("check_password"):
+        return await loop.run_in_executor(hash_executor, verify_password, plain_password, hashed_password)
+
+async def run_db(fn, *args):
+    """
+    Runs a UserStore call on the database pool so that waiting on a lock held
+    by another worker never stalls the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, fn, *args)
+
+async def get_token_claims(token: str) -> dict:
+    credentials_exception = HTTPException(
+        status_code=401,
+        detail="Invalid authentication credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    with metrics.stage("verify_token"):
+        try:
+            claims = decode_token(token)
+        except InvalidToken:
+            raise credentials_exception
+        if await run_db(users.get, claims["sub"]) is None:
+            raise credentials_exception
+        if "jti" in claims and await run_db(users.is_revoked, claims["jti"]):
+            raise credentials_exception
+        return claims
+
+def user_cache_samples():
+    """
+    User cache lookups for /metrics, read from the cache's own counters.
+    """
+    yield "cache_lookups_total", "counter", {"cache": "user", "result": "hit"}, users.cache.hits
+    yield "cache_lookups_total", "counter", {"cache": "user", "result": "miss"}, users.cache.misses
+
+metrics.describe("cache_lookups_total", "counter", "Cache lookups by cache and outcome")
+metrics.collect(user_cache_samples)
+
 # --- Models ---
 class UserAuth(BaseModel):
     username: str
@@ -29,34 +114,47 @@ class UserResponse(BaseModel):
 # --- Endpoints ---
 @app.post("/signup", response_model=UserResponse)
 async def signup(user: UserAuth):
-    if user.username in fake_users_db:
+    if await run_db(users.get, user.username) is not None:
+        raise HTTPException(
+            status_code=400, 
+            detail="Username already registered"
+        )
+    hashed_password = await hash_password(user.password)
+    # Another signup for the same name, on any worker, may have finished while we were hashing
+    if not await run_db(users.create, user.username, hashed_password):
         raise HTTPException(
             status_code=400, 
             detail="Username already registered"
         )
-    fake_users_db[user.username] = get_password_hash(user.password)
     return UserResponse(username=user.username, message="User created successfully")
 
 @app.post("/login")
 async def login(user: UserAuth):
-    hashed_password = fake_users_db.get(user.username)
-    if not hashed_password or not verify_password(user.password, hashed_password):
+    hashed_password = await run_db(users.get, user.username)
+    if not hashed_password or not await check_password(user.password, hashed_password):
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    # For simplicity in this exam, we return the username as a 'token' 
-    # In a real app, this would be a JWT
-    return {"access_token": user.username, "token_type": "bearer"}
+    # Signed and expiring, so other services can verify it without calling /me
+    return {"access_token": create_token(user.username), "token_type": "bearer"}
 
 @app.get("/me")
 async def me(token: str):
-    # Determine user from token (username in this simple case)
-    if token not in fake_users_db:
-         raise HTTPException(
-            status_code=401,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    return {"username": token}
+    claims = await get_token_claims(token)
+    return {"username": claims["sub"]}
+
+@app.post("/logout")
+async def logout(token: str):
+    claims = await get_token_claims(token)
+    await run_db(users.revoke, claims["jti"], claims["exp"])
+    return {"username": claims["sub"], "message": "Token revoked"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Latency histograms for hashing and token checks, user cache lookups and
+    errors in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from src.core.cache import MISSING, TTLCache
+
+class UserStore:
+    """
+    Users in a SQLite (WAL) file that every auth worker opens. The UNIQUE
+    username column is the index lookups use and what makes concurrent signups
+    for the same name safe. Found users are cached in memory; misses always
+    reach the database so that signups on other workers are seen at once.
+    """
+
+    def __init__(self, path: str, cache_size: int = 10000, cache_ttl: float = 300.0, busy_timeout: float = 10.0):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE, "
+            "hashed_password TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        # Logged-out tokens, kept until they expire (after which their signature check fails anyway)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS revoked_tokens (jti TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+        # Accounts are never updated in place, so cached entries cannot go stale
+        self.cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+
+    def get(self, username: str) -> Optional[str]:
+        """
+        The user's password hash, or None if there is no such user.
+        """
+        hashed_password = self.cache.get(username)
+        if hashed_password is not MISSING:
+            return hashed_password
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hashed_password FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None:
+            return None
+        self.cache.set(username, row[0])
+        return row[0]
+
+    def __contains__(self, username: str) -> bool:
+        return self.get(username) is not None
+
+    def create(self, username: str, hashed_password: str) -> bool:
+        """
+        Adds a user. Returns False if the username is taken, by this or any other worker.
+        """
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO users (username, hashed_password, created_at) VALUES (?, ?, ?)",
+                    (username, hashed_password, time.time()),
+                )
+        except sqlite3.IntegrityError:
+            return False
+        self.cache.set(username, hashed_password)
+        return True
+
+    def revoke(self, jti: str, expires_at: float):
+        """
+        Revokes a token id for every worker, forgetting the revocations that have expired.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (time.time(),))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)", (jti, expires_at)
+            )
+
+    def is_revoked(self, jti: str) -> bool:
+        # Not cached: a logout on another worker has to take effect at once
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM revoked_tokens WHERE jti = ?", (jti,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM users").fetchone()
+        return count
+
+    def stats(self) -> dict:
+        return {"users": len(self), "cache": self.cache.stats()}
@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import json
 import os
 
 # --- Configuration ---
@@ -16,6 +17,22 @@ if "username" not in st.session_state:
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
+# --- Streaming ---
+def iter_sse_tokens(resp):
+    """Yields text tokens from a server-sent event stream; raises on an error event."""
+    event = "message"
+    for line in resp.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: "):])
+            if event == "error":
+                raise RuntimeError(data.get("detail", "Stream failed"))
+            if event == "message":
+                yield data["token"]
+        elif not line:
+            event = "message"
+
 # --- Authentication ---
 def login():
     st.header("Login")
@@ -26,7 +43,7 @@ def login():
             resp = requests.post(f"{AUTH_SERVICE_URL}/login", json={"username": username, "password": password})
             if resp.status_code == 200:
                 data = resp.json()
-                st.session_state.token = data["access_token"]  # In this exam, token IS the username effectively
+                st.session_state.token = data["access_token"]
                 st.session_state.username = username
                 st.success("Logged in successfully!")
                 st.rerun()
@@ -53,6 +70,7 @@ def logout():
     st.session_state.token = None
     st.session_state.username = None
     st.session_state.chat_history = []
+    st.session_state.pop("history_pages", None)
     st.rerun()
 
 # --- Main App ---
@@ -114,16 +132,21 @@ def main_app():
         test_code = st.text_area("Enter Test Code", height=200)
         if st.button("Explain"):
             if test_code:
-                with st.spinner("Explaining..."):
-                    try:
-                        resp = requests.post(f"{MAIN_SERVICE_URL}/explain_test", json={"test_code": test_code}, headers=headers)
+                placeholder = st.empty()
+                explanation = ""
+                try:
+                    with requests.post(f"{MAIN_SERVICE_URL}/explain_test/stream", json={"test_code": test_code}, headers=headers, stream=True) as resp:
                         if resp.status_code == 200:
-                            result = resp.json()
-                            st.markdown(result['explanation'])
+                            for token in iter_sse_tokens(resp):
+                                explanation += token
+                                placeholder.markdown(explanation + "▌")
+                            placeholder.markdown(explanation)
                         else:
                             st.error(f"Error: {resp.text}")
-                    except requests.RequestException as e:
-                        st.error(f"Connection error: {e}")
+                except requests.RequestException as e:
+                    st.error(f"Connection error: {e}")
+                except RuntimeError as e:
+                    st.error(f"Error: {e}")
             else:
                 st.warning("Please enter test code.")
 
@@ -190,31 +213,56 @@ def main_app():
                 message_placeholder = st.empty()
                 full_response = ""
                 try:
-                    resp = requests.post(f"{MAIN_SERVICE_URL}/chat", json={"message": prompt}, headers=headers)
-                    if resp.status_code == 200:
-                         full_response = resp.json()["response"]
-                         message_placeholder.markdown(full_response)
-                         st.session_state.messages.append({"role": "assistant", "content": full_response})
-                    else:
-                        st.error(f"Error: {resp.text}")
+                    with requests.post(f"{MAIN_SERVICE_URL}/chat/stream", json={"message": prompt}, headers=headers, stream=True) as resp:
+                        if resp.status_code == 200:
+                            for token in iter_sse_tokens(resp):
+                                full_response += token
+                                message_placeholder.markdown(full_response + "▌")
+                            message_placeholder.markdown(full_response)
+                            st.session_state.messages.append({"role": "assistant", "content": full_response})
+                        else:
+                            st.error(f"Error: {resp.text}")
                 except requests.RequestException as e:
                      st.error(f"Connection error: {e}")
+                except RuntimeError as e:
+                     st.error(f"Error: {e}")
 
     elif page == "History":
         st.header("Session History (from Server)")
-        if st.button("Refresh History"):
+        # Pages are fetched newest first and kept in session state; older ones load on demand
+        # Rendered before the check, so the button shows on the first visit too
+        refresh = st.button("Refresh History")
+        if refresh or "history_pages" not in st.session_state:
+            st.session_state.history_pages = []
+            st.session_state.history_before = None
+            st.session_state.history_done = False
+
+        def load_page():
+            params = {"limit": 50}
+            if st.session_state.history_before is not None:
+                params["before"] = st.session_state.history_before
             try:
-                resp = requests.get(f"{MAIN_SERVICE_URL}/history", headers=headers)
+                resp = requests.get(f"{MAIN_SERVICE_URL}/history", params=params, headers=headers)
                 if resp.status_code == 200:
-                    history = resp.json()
-                    for msg in history:
-                        st.text(f"{msg['role'].upper()}: {msg['content']}")
-                        st.markdown("---")
+                    data = resp.json()
+                    st.session_state.history_pages.insert(0, data["messages"])
+                    st.session_state.history_before = data["next_before"]
+                    st.session_state.history_done = data["next_before"] is None
                 else:
                     st.error(f"Error: {resp.text}")
             except requests.RequestException as e:
                 st.error(f"Connection error: {e}")
 
+        if not st.session_state.history_pages:
+            load_page()
+        if not st.session_state.history_done and st.button("Load older messages"):
+            load_page()
+
+        for history_page in st.session_state.history_pages:
+            for msg in history_page:
+                st.text(f"{msg['role'].upper()}: {msg['content']}")
+                st.markdown("---")
+
 
 # --- Entry Point ---
 if not st.session_state.token:
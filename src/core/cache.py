@@ -0,0 +1,183 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# Returned by TTLCache.get on a miss, so that None can be cached as a value
+MISSING = object()
+
+def digest(value: Any) -> str:
+    """
+    Stable SHA-256 of a JSON-serializable value.
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+class TTLCache:
+    """
+    Bounded LRU mapping whose entries expire after a time-to-live.
+    Keeps hit/miss counters so callers can report a hit rate.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class DiskCache:
+    """
+    SQLite-backed key/value store for JSON values, with per-entry expiry
+    and a bound on the number of entries kept.
+    """
+
+    # Expired and surplus rows are pruned once every PRUNE_EVERY writes
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, max_size: int = 100000):
+        self.max_size = max_size
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_created_at ON entries (created_at)")
+
+    def get(self, key: str) -> Any:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return MISSING
+        value, expires_at = row
+        if expires_at <= time.time():
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return MISSING
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: float):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + ttl, now),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        self._conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        if count > self.max_size:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY created_at LIMIT ?)",
+                (count - self.max_size,),
+            )
+
+    def clear(self):
+        self._conn.execute("DELETE FROM entries")
+
+    def __len__(self) -> int:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        return count
+
+class ResultCache:
+    """
+    Two-tier cache for chain results: an in-memory LRU in front of an
+    optional on-disk tier. Values must be JSON-serializable.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 86400.0,
+                 path: Optional[str] = None, disk_max_size: int = 100000):
+        self.ttl = ttl
+        self.memory = TTLCache(max_size=max_size, ttl=ttl)
+        self.disk = DiskCache(path, max_size=disk_max_size) if path else None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0}
+
+    @staticmethod
+    def make_key(chain_name: str, model_name: str, prompt_version: str, inputs: Any) -> str:
+        """
+        Builds a content-addressed key: the input is hashed, the rest kept readable.
+        """
+        return f"{chain_name}:{model_name}:{prompt_version}:{digest(inputs)}"
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not MISSING:
+            self.counters["memory_hits"] += 1
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not MISSING:
+                self.counters["disk_hits"] += 1
+                self.memory.set(key, value)
+                return value
+        self.counters["misses"] += 1
+        return MISSING
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value, self.ttl)
+
+    def record_bypass(self):
+        self.counters["bypassed"] += 1
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "memory_size": len(self.memory),
+            "disk_size": len(self.disk) if self.disk is not None else 0,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
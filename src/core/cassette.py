@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from src.core.splitting import CHARS_PER_TOKEN
+
+class CassetteMiss(KeyError):
+    """
+    Replay found no recording for a prompt.
+    """
+
+def prompt_key(messages: List[BaseMessage], tools: Optional[list] = None) -> str:
+    """
+    SHA-256 of the messages (role and content) and of any tools bound to the call.
+    """
+    payload = {"messages": [[message.type, message.content] for message in messages], "tools": tools or []}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Records the responses of `model` to a directory, one JSON file per prompt
+    hash, or with no model replays them and raises CassetteMiss for unknown
+    prompts. Replays wait `speed` times the recorded duration (0: no wait).
+    """
+
+    path: str
+    model: Optional[Any] = None
+    speed: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], tool_choice=tool_choice, **kwargs)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def _load(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._file(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, key: str, message: BaseMessage, seconds: float):
+        os.makedirs(self.path, exist_ok=True)
+        # Written under a temporary name so concurrent readers never see half a file
+        temporary = f"{self._file(key)}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"message": message_to_dict(message), "seconds": seconds}, f)
+        os.replace(temporary, self._file(key))
+
+    def _model_for(self, tools, tool_choice):
+        return self.model.bind_tools(tools, tool_choice=tool_choice) if tools else self.model
+
+    def _replay(self, key: str) -> Optional[Tuple[BaseMessage, float]]:
+        """
+        The recorded message and how long to wait before returning it, or None
+        if there is no recording and one is to be made.
+        """
+        recording = self._load(key)
+        if recording is None:
+            if self.model is None:
+                raise CassetteMiss(f"no recording for prompt {key} in {self.path}")
+            return None
+        (message,) = messages_from_dict([recording["message"]])
+        return message, recording["seconds"] * self.speed
+
+    def _generate(self, messages, stop=None, run_manager=None, tools=None, tool_choice=None, **kwargs) -> ChatResult:
+        key = prompt_key(messages, tools)
+        replayed = self._replay(key)
+        if replayed is None:
+            start = time.perf_counter()
+            message = self._model_for(tools, tool_choice).invoke(messages, stop=stop)
+            self._save(key, message, time.perf_counter() - start)
+        else:
+            message, delay = replayed
+            time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, tool_choice=None, **kwargs) -> ChatResult:
+        key = prompt_key(messages, tools)
+        replayed = self._replay(key)
+        if replayed is None:
+            start = time.perf_counter()
+            message = await self._model_for(tools, tool_choice).ainvoke(messages, stop=stop)
+            self._save(key, message, time.perf_counter() - start)
+        else:
+            message, delay = replayed
+            await asyncio.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, tools=None, tool_choice=None, **kwargs):
+        # Recording streams are gathered into one response; replays stream it back a token at a time
+        result = await self._agenerate(messages, stop=stop, tools=tools, tool_choice=tool_choice)
+        message = result.generations[0].message
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}
+            ]))
+            return
+        text = str(message.content)
+        for i in range(0, len(text), CHARS_PER_TOKEN):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + CHARS_PER_TOKEN]))
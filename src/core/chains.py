@@ -1,46 +1,273 @@
-from langchain_core.runnables import RunnableParallel, RunnablePassthrough
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda, RunnableParallel, RunnablePassthrough
 from src.core.llm import get_llm
-from src.prompts.prompts import analysis_prompt, test_generation_prompt, explanation_prompt, chat_prompt
-from src.core.parsers import analysis_parser, test_generation_parser, explanation_parser
-from src.memory.memory import get_session_history
+from src.core.metrics import metrics
+from src.core.splitting import estimate_tokens
+from src.prompts.prompts import analysis_prompt, test_generation_prompt, explanation_prompt, chat_prompt, summary_prompt, repair_prompt
+from src.core.parsers import FORMAT_INSTRUCTIONS, PARSERS
+from src.core.repair import repair_stats
+from src.memory.memory import build_history, get_session_history
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
-llm = get_llm()
+# How the structured chains ask for JSON: "full" embeds the parser's JSON schema in
+# the prompt, "compact" a line per field, "native" uses the model's structured
+# output (tool calling) so the schema is not part of the prompt text at all
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "full")
+# Ask the LLM to fix output that local repair (see RepairingOutputParser) could not
+OUTPUT_REPAIR_RETRY = os.getenv("OUTPUT_REPAIR_RETRY", "true").lower() == "true"
+
+# Chains are built on first use (see get_chain), so importing this module
+# neither loads the LLM client nor needs GROQ_API_KEY
+_llm = None
+
+def get_shared_llm():
+    """
+    The LLM shared by every chain, created on first use.
+    """
+    global _llm
+    if _llm is None:
+        _llm = get_llm()
+    return _llm
+
+# Per chain: completed runs, estimated prompt tokens sent and seconds spent
+chain_stats: Dict[str, dict] = {}
+
+def _stats(name: str) -> dict:
+    return chain_stats.setdefault(name, {"runs": 0, "prompt_tokens": 0, "total_seconds": 0.0})
+
+def _record_run(name: str):
+    def on_end(run):
+        seconds = (run.end_time - run.start_time).total_seconds()
+        stats = _stats(name)
+        stats["runs"] += 1
+        stats["total_seconds"] += seconds
+        metrics.observe_stage("chain", seconds, {"chain": name})
+    return on_end
+
+def _record_error(name: str):
+    def on_error(run):
+        seconds = (run.end_time - run.start_time).total_seconds()
+        metrics.observe_stage("chain", seconds, {"chain": name}, error=True)
+    return on_error
+
+def _count_prompt_tokens(name: str) -> RunnableLambda:
+    """
+    Passes the formatted prompt through, adding its estimated tokens to chain_stats.
+    """
+    def count(prompt_value):
+        tokens = sum(estimate_tokens(str(message.content)) for message in prompt_value.to_messages())
+        _stats(name)["prompt_tokens"] += tokens
+        return prompt_value
+    return RunnableLambda(count)
+
+metrics.describe("llm_prompt_tokens_total", "counter", "Tokens sent to the LLM, as reported by it or estimated")
+metrics.describe("llm_completion_tokens_total", "counter", "Tokens received from the LLM, as reported by it or estimated")
+
+# Child runs timed as their own stage, by LangChain run type
+_STAGES = {"prompt": "prompt", "parser": "parse"}
+
+class StageMetrics(BaseCallbackHandler):
+    """
+    Times the prompt, LLM and parser steps of a chain into stage_seconds
+    (the chain as a whole is timed by _record_run), counts their failures in
+    stage_errors_total and the LLM's prompt and completion tokens. Token counts
+    come from the model's usage metadata when it reports them, and are
+    estimated otherwise.
+    """
+
+    # Called on the event loop instead of being handed to a thread
+    run_inline = True
+
+    def __init__(self, name: str):
+        self.name = name
+        self.runs = {}  # run_id -> (stage or None, start, estimated prompt tokens)
+
+    def _start(self, run_id, stage, prompt_tokens: int = 0):
+        self.runs[run_id] = (stage, time.perf_counter(), prompt_tokens)
+
+    def _end(self, run_id, error: bool = False) -> int:
+        stage, start, prompt_tokens = self.runs.pop(run_id, (None, 0.0, 0))
+        if stage is not None:
+            metrics.observe_stage(stage, time.perf_counter() - start, {"chain": self.name}, error)
+        return prompt_tokens
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, run_type=None, **kwargs):
+        self._start(run_id, _STAGES.get(run_type))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        tokens = sum(estimate_tokens(str(message.content)) for message in messages[0])
+        self._start(run_id, "llm", tokens)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_tokens = self._end(run_id)
+        generation = response.generations[0][0]
+        message = getattr(generation, "message", None)
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            prompt_tokens, completion_tokens = usage["input_tokens"], usage["output_tokens"]
+        else:
+            tool_calls = getattr(message, "tool_calls", None)
+            text = generation.text or (json.dumps([call["args"] for call in tool_calls]) if tool_calls else "")
+            completion_tokens = estimate_tokens(text)
+        labels = {"chain": self.name}
+        metrics.inc("llm_prompt_tokens_total", labels, prompt_tokens)
+        metrics.inc("llm_completion_tokens_total", labels, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+def _retry_inputs(name: str):
+    def inputs(values: dict) -> dict:
+        # Called by the fallback with the parser's exception under "error"
+        repair_stats["llm_retry"] += 1
+        error = values["error"]
+        return {
+            "output": error.llm_output or "",
+            "error": str(error).splitlines()[0],
+            "format_instructions": FORMAT_INSTRUCTIONS[OUTPUT_MODE][name],
+        }
+    return inputs
+
+def _retry_chain(name: str, llm) -> Runnable:
+    # Takes {"error": OutputParserException} and asks the LLM to fix its output
+    return RunnableLambda(_retry_inputs(name)) | repair_prompt | _count_prompt_tokens(name) | llm | PARSERS[name]
+
+def _structured_chain(name: str, prompt, llm) -> Runnable:
+    # The format instructions are fixed per mode, so they are bound into the prompt once
+    prompt = prompt.partial(format_instructions=FORMAT_INSTRUCTIONS[OUTPUT_MODE][name])
+    parser = PARSERS[name]
+    if OUTPUT_MODE == "native":
+        return prompt | _count_prompt_tokens(name) | llm.with_structured_output(parser.pydantic_object)
+
+    chain = prompt | _count_prompt_tokens(name) | llm | parser
+    if not OUTPUT_REPAIR_RETRY:
+        return chain
+    # Only reached when the parser's local repairs failed too
+    return chain.with_fallbacks([_retry_chain(name, llm)], exceptions_to_handle=(OutputParserException,),
+                                exception_key="error")
+
+def _structured_stream_chain(name: str, prompt, llm) -> Runnable:
+    """
+    The structured chain without its parser, streaming the raw output (see
+    chunk_text); parse_output then parses it once, complete.
+    """
+    prompt = prompt.partial(format_instructions=FORMAT_INSTRUCTIONS[OUTPUT_MODE][name])
+    if OUTPUT_MODE == "native":
+        model = PARSERS[name].pydantic_object
+        llm = llm.bind_tools([model], tool_choice=model.__name__)
+    return prompt | _count_prompt_tokens(name) | llm
+
+def chunk_text(chunk) -> str:
+    """
+    Text of a streamed message chunk: its content, or the arguments of a tool call in native mode.
+    """
+    if chunk.content:
+        return str(chunk.content)
+    return "".join(call.get("args") or "" for call in getattr(chunk, "tool_call_chunks", []))
+
+async def parse_output(name: str, text: str):
+    """
+    Parses the complete raw output of a structured chain as the chain's own
+    parser would, including the local repairs and, with OUTPUT_REPAIR_RETRY,
+    asking the LLM to fix what they could not. Raises OutputParserException.
+    """
+    try:
+        return PARSERS[name].parse(text)
+    except OutputParserException as error:
+        if not OUTPUT_REPAIR_RETRY:
+            raise
+        return await _retry_chain(name, get_shared_llm()).ainvoke({"error": error})
 
 # 1. Code Analysis Chain
-analysis_chain = (
-    RunnablePassthrough.assign(
-        format_instructions=lambda _: analysis_parser.get_format_instructions()
-    )
-    | analysis_prompt 
-    | llm 
-    | analysis_parser
-)
+def build_analysis_chain(llm):
+    return _structured_chain("analysis", analysis_prompt, llm)
 
 # 2. Test Generation Chain
-test_generation_chain = (
-    RunnablePassthrough.assign(
-        format_instructions=lambda _: test_generation_parser.get_format_instructions()
-    )
-    | test_generation_prompt 
-    | llm 
-    | test_generation_parser
-)
+def build_test_generation_chain(llm):
+    return _structured_chain("test_generation", test_generation_prompt, llm)
 
 # 3. Test Explanation Chain
-explanation_chain = (
-    RunnablePassthrough.assign(
-        format_instructions=lambda _: explanation_parser.get_format_instructions()
-    )
-    | explanation_prompt 
-    | llm 
-    | explanation_parser
-)
+def build_explanation_chain(llm):
+    return _structured_chain("explanation", explanation_prompt, llm)
+
+def build_explanation_stream_chain(llm):
+    return _structured_stream_chain("explanation", explanation_prompt, llm)
 
 # 4. Chat Chain with History
-chat_chain = RunnableWithMessageHistory(
-    chat_prompt | llm,
-    get_session_history,
-    input_messages_key="input",
-    history_messages_key="history"
-)
+def _budgeted_history(inputs: dict, config: RunnableConfig) -> list:
+    # Summary or retrieved turns + recent turns instead of the whole session
+    return build_history(inputs["history"], config["configurable"]["session_id"], inputs["input"])
+
+async def _abudgeted_history(inputs: dict, config: RunnableConfig) -> list:
+    # Under ainvoke/astream a sync lambda runs on an executor thread; building
+    # the history touches the session store and indexes, which are not thread-safe
+    return _budgeted_history(inputs, config)
+
+def build_chat_chain(llm):
+    budgeted_history = RunnableLambda(_budgeted_history, afunc=_abudgeted_history)
+    return RunnableWithMessageHistory(
+        RunnablePassthrough.assign(history=budgeted_history) | chat_prompt | _count_prompt_tokens("chat") | llm,
+        get_session_history,
+        input_messages_key="input",
+        history_messages_key="history"
+    )
+
+# 5. History Summary Chain
+def build_summary_chain(llm):
+    return summary_prompt | _count_prompt_tokens("summary") | llm | StrOutputParser()
+
+CHAIN_BUILDERS: Dict[str, Callable[[Any], Runnable]] = {
+    "analysis": build_analysis_chain,
+    "test_generation": build_test_generation_chain,
+    "explanation": build_explanation_chain,
+    "explanation_stream": build_explanation_stream_chain,
+    "chat": build_chat_chain,
+    "summary": build_summary_chain,
+}
+
+# Chains built so far, by name
+registry: Dict[str, Runnable] = {}
+# Seconds spent building each chain (the first one includes creating the LLM)
+build_seconds: Dict[str, float] = {}
+
+def get_chain(name: str) -> Runnable:
+    """
+    Returns the named chain, building it on first use.
+    """
+    chain = registry.get(name)
+    if chain is None:
+        start = time.perf_counter()
+        chain = CHAIN_BUILDERS[name](get_shared_llm())
+        chain = chain.with_config(callbacks=[StageMetrics(name)]).with_listeners(
+            on_end=_record_run(name), on_error=_record_error(name)
+        )
+        registry[name] = chain
+        build_seconds[name] = time.perf_counter() - start
+    return chain
+
+def warm_up(names: Iterable[str] = None):
+    """
+    Builds the named chains (all of them by default) ahead of the first request.
+    """
+    for name in names or CHAIN_BUILDERS:
+        get_chain(name)
+
+async def summarize_history(summary: str, messages: List[BaseMessage]) -> str:
+    """
+    Folds messages into a running summary (see memory.update_summary).
+    """
+    transcript = "\n".join(f"{message.type}: {message.content}" for message in messages)
+    return await get_chain("summary").ainvoke({"summary": summary or "(empty)", "messages": transcript})
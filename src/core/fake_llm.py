@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from src.core.parsers import FORMAT_INSTRUCTIONS, PARSERS
+from src.core.splitting import CHARS_PER_TOKEN
+
+# Settings used by LLM_PROVIDER=fake (see llm.get_llm)
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.2"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "200"))
+FAKE_LLM_RESPONSE_WORDS = int(os.getenv("FAKE_LLM_RESPONSE_WORDS", "40"))
+
+_WORDS = "the function returns a value for each input and handles empty lists edge cases and errors".split()
+
+def _filler(seed: int, words: int) -> str:
+    return " ".join(_WORDS[(seed + i) % len(_WORDS)] for i in range(words))
+
+def sample_value(schema: dict, seed: int, words: int) -> Any:
+    """
+    A deterministic value matching a JSON schema, with strings of about `words` words.
+    """
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            name: sample_value(field, seed + index, words)
+            for index, (name, field) in enumerate(schema.get("properties", {}).items())
+        }
+    if kind == "array":
+        return [sample_value(schema.get("items", {}), seed + i, max(1, words // 2)) for i in range(2)]
+    if kind == "boolean":
+        return seed % 2 == 0
+    if kind in ("integer", "number"):
+        return seed % 10
+    return _filler(seed, words)
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline stand-in for the chat model. Answers are derived from the prompt, so
+    the same prompt always gets the same answer: JSON for the structured chains
+    (recognized by their format instructions, or through tool calling in native
+    mode) and plain text otherwise. Waits `latency` seconds before the first
+    token and then streams `tokens_per_second` (0 means no delay).
+    """
+
+    latency: float = FAKE_LLM_LATENCY
+    tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND
+    response_words: int = FAKE_LLM_RESPONSE_WORDS
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def respond(self, messages: List[BaseMessage], tools: Optional[list] = None) -> AIMessage:
+        prompt = "\n".join(str(message.content) for message in messages)
+        seed = int(hashlib.sha256(prompt.encode()).hexdigest()[:8], 16)
+        if tools:
+            function = tools[0]["function"]
+            args = sample_value(function["parameters"], seed, self.response_words)
+            return AIMessage(content="", tool_calls=[{"name": function["name"], "args": args, "id": f"call_{seed:x}"}])
+        for name, parser in PARSERS.items():
+            if any(instructions[name] in prompt for instructions in FORMAT_INSTRUCTIONS.values()):
+                schema = parser.pydantic_object.model_json_schema()
+                return AIMessage(content=json.dumps(sample_value(schema, seed, self.response_words)))
+        return AIMessage(content=_filler(seed, self.response_words))
+
+    def _pieces(self, message: AIMessage) -> List[str]:
+        # Streamed a token (CHARS_PER_TOKEN characters) at a time
+        text = message.content or json.dumps(message.tool_calls[0]["args"])
+        return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+    def _token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _chunk(self, message: AIMessage, piece: str, index: int) -> ChatGenerationChunk:
+        if not message.tool_calls:
+            return ChatGenerationChunk(message=AIMessageChunk(content=piece))
+        call = message.tool_calls[0]
+        tool_call_chunk = {"name": call["name"] if index == 0 else None, "args": piece,
+                           "id": call["id"] if index == 0 else None, "index": 0}
+        return ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[tool_call_chunk]))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self.respond(messages, kwargs.get("tools"))
+        time.sleep(self.latency + len(self._pieces(message)) * self._token_delay())
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self.respond(messages, kwargs.get("tools"))
+        await asyncio.sleep(self.latency + len(self._pieces(message)) * self._token_delay())
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        message = self.respond(messages, kwargs.get("tools"))
+        time.sleep(self.latency)
+        for index, piece in enumerate(self._pieces(message)):
+            if index:
+                time.sleep(self._token_delay())
+            yield self._chunk(message, piece, index)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        message = self.respond(messages, kwargs.get("tools"))
+        await asyncio.sleep(self.latency)
+        for index, piece in enumerate(self._pieces(message)):
+            if index:
+                await asyncio.sleep(self._token_delay())
+            yield self._chunk(message, piece, index)
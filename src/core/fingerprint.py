@@ -0,0 +1,26 @@
+import ast
+from typing import Tuple
+
+_DOCSTRING_OWNERS = (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+
+def _strip_docstrings(tree: ast.AST):
+    for node in ast.walk(tree):
+        if not isinstance(node, _DOCSTRING_OWNERS) or not node.body:
+            continue
+        first = node.body[0]
+        if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+            node.body = node.body[1:] or [ast.Pass()]
+
+def fingerprint_code(code: str) -> Tuple[str, bool]:
+    """
+    Returns a canonical form of Python source that ignores whitespace, comments,
+    docstrings and quote style, and whether the code could be parsed.
+    Code that does not parse is returned unchanged.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return code, False
+    _strip_docstrings(tree)
+    # Positions are left out so that layout changes do not change the dump
+    return ast.dump(tree, annotate_fields=False, include_attributes=False), True
@@ -1,19 +1,42 @@
 import os
-from langchain_groq import ChatGroq
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# "groq", "fake" (FakeChatModel, no network), "record" (Groq, saving every
+# response to LLM_CASSETTE_DIR) or "replay" (responses from LLM_CASSETTE_DIR only)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
+LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "cassettes")
+# Replays wait this many times the recorded response time (0: answer at once)
+LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "0"))
+
+GROQ_MODEL_NAME = "llama-3.3-70b-versatile"
+# Part of the result-cache keys, so fake answers are never served as real ones
+MODEL_NAME = "fake" if LLM_PROVIDER == "fake" else GROQ_MODEL_NAME
+
 def get_llm():
     """
-    Initializes and returns the Groq LLM model.
+    Initializes and returns the chat model selected by LLM_PROVIDER.
     """
+    if LLM_PROVIDER == "fake":
+        from src.core.fake_llm import FakeChatModel
+        return FakeChatModel()
+    if LLM_PROVIDER == "replay":
+        from src.core.cassette import CassetteChatModel
+        return CassetteChatModel(path=LLM_CASSETTE_DIR, speed=LLM_REPLAY_SPEED)
+
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise ValueError("GROQ_API_KEY environment variable not set")
-    
-    return ChatGroq(
+
+    # Imported here: the Groq client is slow to import and only needed once a chain runs
+    from langchain_groq import ChatGroq
+    llm = ChatGroq(
         temperature=0,
-        model_name="llama-3.3-70b-versatile",
+        model_name=GROQ_MODEL_NAME,
         api_key=api_key
     )
+    if LLM_PROVIDER == "record":
+        from src.core.cassette import CassetteChatModel
+        return CassetteChatModel(path=LLM_CASSETTE_DIR, model=llm, speed=LLM_REPLAY_SPEED)
+    return llm
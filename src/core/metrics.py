@@ -0,0 +1,216 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# Standard library only: the auth service image copies this file on its own
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Optional[dict]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in (labels or {}).items()))
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """
+    Cumulative-bucket histogram, as Prometheus expects it.
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        (upper bound, observations at or below it) for every bucket, ending with +Inf.
+        """
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+class Registry:
+    """
+    Counters and histograms keyed by name and labels, rendered in the
+    Prometheus text format. Collectors are called at scrape time for values
+    that are already counted elsewhere (e.g. cache hit counters), so they
+    cost nothing on the request path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._collectors = []
+        # Called as hook(stage, seconds, labels, error) after every observe_stage
+        self.stage_hooks = []
+
+    def describe(self, name: str, kind: str, help: str):
+        self._help[name] = (kind, help)
+
+    def inc(self, name: str, labels: Optional[dict] = None, value: float = 1):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[dict] = None):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def observe_stage(self, stage: str, seconds: float, labels: Optional[dict] = None, error: bool = False):
+        """
+        Records one run of a stage in stage_seconds (and stage_errors_total if
+        it failed), then hands it to every stage hook, e.g. the tracer.
+        """
+        labels = {**(labels or {}), "stage": stage}
+        self.observe("stage_seconds", seconds, labels)
+        if error:
+            self.inc("stage_errors_total", labels)
+        for hook in self.stage_hooks:
+            hook(stage, seconds, labels, error)
+
+    @contextmanager
+    def stage(self, stage: str, **labels):
+        """
+        Times the block as a stage; an exception counts as an error.
+        """
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start, labels, error)
+
+    def collect(self, collector: Callable[[], Iterable[Tuple[str, str, dict, float]]]):
+        """
+        Registers a function returning (name, type, labels, value) samples.
+        """
+        self._collectors.append(collector)
+
+    def get(self, name: str, labels: Optional[dict] = None) -> float:
+        """
+        Current value of a counter, or the observation count of a histogram.
+        """
+        key = _labels(labels)
+        if name in self._histograms:
+            histogram = self._histograms[name].get(key)
+            return histogram.count if histogram else 0
+        return self._counters.get(name, {}).get(key, 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        lines = []
+
+        def header(name, kind):
+            help = self._help.get(name, (kind, ""))[1]
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+
+        collected: Dict[str, Tuple[str, list]] = {}
+        for collector in self._collectors:
+            for name, kind, labels, value in collector():
+                collected.setdefault(name, (kind, []))[1].append((_labels(labels), value))
+
+        for name in sorted(counters):
+            header(name, "counter")
+            for labels, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name in sorted(collected):
+            kind, samples = collected[name]
+            header(name, kind)
+            for labels, value in sorted(samples):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name in sorted(histograms):
+            header(name, "histogram")
+            for labels, histogram in sorted(histograms[name].items()):
+                for bound, count in histogram.cumulative():
+                    le = 'le="%s"' % _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels, le)} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+# One registry per process; each service serves it at /metrics
+metrics = Registry()
+metrics.describe("stage_seconds", "histogram", "Seconds spent per request stage")
+metrics.describe("stage_errors_total", "counter", "Failures per request stage")
+metrics.describe("http_request_seconds", "histogram", "Seconds from request to last response byte, by route")
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every request into http_request_seconds, labelled
+    by route template (not the raw path, to keep the label set small),
+    method and status. Streaming responses are timed until their last chunk.
+    """
+
+    def __init__(self, app, registry: Registry = metrics):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            route = scope.get("route")
+            self.registry.observe("http_request_seconds", time.perf_counter() - start, {
+                "route": getattr(route, "path", "unmatched"),
+                "method": scope["method"],
+                "status": status,
+            })
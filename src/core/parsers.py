@@ -1,23 +1,82 @@
 from typing import List
 from pydantic import BaseModel, Field
+from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import PydanticOutputParser
 
+from src.core.repair import repair_output, repair_stats
+
+class RepairingOutputParser(PydanticOutputParser):
+    """
+    PydanticOutputParser that, when the output does not parse as it is, tries
+    the local repairs of repair_output before giving up.
+    """
+
+    def parse_result(self, result, *, partial: bool = False):
+        if partial:
+            return super().parse_result(result, partial=True)
+        try:
+            parsed = super().parse_result(result)
+        except OutputParserException as e:
+            try:
+                return repair_output(result[0].text, self.pydantic_object)
+            except ValueError:
+                repair_stats["failed"] += 1
+                raise e
+        repair_stats["clean"] += 1
+        return parsed
+
 # 1. Code Analysis Parser
 class CodeAnalysis(BaseModel):
     is_optimal: bool = Field(description="Whether the code is optimal or not")
     issues: List[str] = Field(description="List of issues found in the code")
     suggestions: List[str] = Field(description="List of suggestions for improvement")
 
-analysis_parser = PydanticOutputParser(pydantic_object=CodeAnalysis)
+analysis_parser = RepairingOutputParser(pydantic_object=CodeAnalysis)
 
 # 2. Test Generation Parser
 class TestGeneration(BaseModel):
     test_code: str = Field(description="The complete python code for the pytest unit test")
 
-test_generation_parser = PydanticOutputParser(pydantic_object=TestGeneration)
+test_generation_parser = RepairingOutputParser(pydantic_object=TestGeneration)
 
 # 3. Test Explanation Parser
 class TestExplanation(BaseModel):
     explanation: str = Field(description="The detailed educational explanation of the test")
 
-explanation_parser = PydanticOutputParser(pydantic_object=TestExplanation)
+explanation_parser = RepairingOutputParser(pydantic_object=TestExplanation)
+
+# --- Format instructions ---
+# JSON-schema types spelled out for the compact instructions
+_TYPE_NAMES = {"boolean": "true/false", "string": "string", "integer": "integer", "number": "number"}
+
+def _type_name(schema: dict) -> str:
+    if schema.get("type") == "array":
+        return f"list of {_type_name(schema.get('items', {}))}s"
+    return _TYPE_NAMES.get(schema.get("type"), "value")
+
+def compact_format_instructions(parser: PydanticOutputParser) -> str:
+    """
+    A few lines naming each field, its type and description, instead of the
+    full JSON schema and worked example of get_format_instructions().
+    """
+    schema = parser.pydantic_object.model_json_schema()
+    fields = "\n".join(
+        f"- {name} ({_type_name(field)}): {field.get('description', '')}"
+        for name, field in schema["properties"].items()
+    )
+    return f"Reply with a JSON object with these keys:\n{fields}"
+
+# Parsers of the structured chains, by chain name
+PARSERS = {
+    "analysis": analysis_parser,
+    "test_generation": test_generation_parser,
+    "explanation": explanation_parser,
+}
+
+# Computed once per chain and output mode (see chains.OUTPUT_MODE); in native
+# mode the schema travels as a tool definition instead of in the prompt
+FORMAT_INSTRUCTIONS = {
+    "full": {name: parser.get_format_instructions() for name, parser in PARSERS.items()},
+    "compact": {name: compact_format_instructions(parser) for name, parser in PARSERS.items()},
+    "native": {name: "Reply by calling the provided function." for name in PARSERS},
+}
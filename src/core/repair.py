@@ -0,0 +1,173 @@
+import ast
+import json
+import re
+import typing
+from typing import Any, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+# How often each repair step was needed. "clean" outputs parsed as they were;
+# "failed" ones could not be repaired locally.
+repair_stats = {
+    "clean": 0, "fences": 0, "extracted": 0, "newlines": 0, "trailing_commas": 0,
+    "quotes": 0, "coerced": 0, "llm_retry": 0, "failed": 0,
+}
+
+_FENCED = re.compile(r"```[\w+-]*[ \t]*\n?(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+def strip_fences(text: str) -> Optional[str]:
+    """
+    The content of the first markdown code block holding a JSON object, if any.
+    """
+    for match in _FENCED.finditer(text):
+        content = match.group(1).strip()
+        if content.startswith("{"):
+            return content
+    return None
+
+def _balanced_end(text: str, start: int) -> Optional[int]:
+    # Index just past the brace closing the one at start, skipping braces inside strings
+    depth = 0
+    quote = None
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return None
+
+def balanced_objects(text: str) -> List[str]:
+    """
+    Every balanced {...} span of the text that starts outside another one, in order.
+    """
+    spans = []
+    start = text.find("{")
+    while start != -1:
+        end = _balanced_end(text, start)
+        if end is None:
+            break
+        spans.append(text[start:end])
+        start = text.find("{", end)
+    return spans
+
+class _JsonNames(ast.NodeTransformer):
+    # Lets literal_eval read JSON's true/false/null next to Python literals
+    NAMES = {"true": True, "false": False, "null": None}
+
+    def visit_Name(self, node):
+        if node.id in self.NAMES:
+            return ast.copy_location(ast.Constant(self.NAMES[node.id]), node)
+        return node
+
+def loads_tolerant(candidate: str, steps: List[str]) -> Any:
+    """
+    json.loads, then the same with raw newlines allowed in strings, without
+    trailing commas, and finally read as a Python literal (single quotes,
+    True/False/None). Appends the fixes that were needed to steps.
+    """
+    try:
+        return json.loads(candidate)
+    except ValueError:
+        pass
+    try:
+        value = json.loads(candidate, strict=False)
+        steps.append("newlines")
+        return value
+    except ValueError:
+        pass
+    without_commas = _TRAILING_COMMA.sub(r"\1", candidate)
+    try:
+        value = json.loads(without_commas, strict=False)
+        steps.append("trailing_commas")
+        return value
+    except ValueError:
+        pass
+    try:
+        tree = _JsonNames().visit(ast.parse(candidate.strip(), mode="eval"))
+        value = ast.literal_eval(tree)
+    except (SyntaxError, ValueError, TypeError, MemoryError, RecursionError):
+        raise ValueError("not a JSON object")
+    steps.append("quotes")
+    return value
+
+_BOOLEANS = {"true": True, "yes": True, "y": True, "1": True, "false": False, "no": False, "n": False, "0": False}
+_EMPTY = {"", "none", "n/a", "null", "[]"}
+
+def coerce_fields(data: dict, model: Type[BaseModel]) -> Tuple[dict, bool]:
+    """
+    Converts values that have an obvious reading as their field's type:
+    "yes" to a bool, a bulleted string or null to a list of strings, a list to
+    a newline-joined string. Returns the data and whether anything changed.
+    """
+    data = dict(data)
+    changed = False
+    for name, field in model.model_fields.items():
+        if name not in data:
+            continue
+        value = data[name]
+        annotation = field.annotation
+        if annotation is bool and isinstance(value, str) and value.strip().lower() in _BOOLEANS:
+            data[name] = _BOOLEANS[value.strip().lower()]
+        elif typing.get_origin(annotation) is list and (value is None or isinstance(value, str)):
+            if value is None or value.strip().lower() in _EMPTY:
+                data[name] = []
+            else:
+                lines = [re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line) for line in value.splitlines()]
+                data[name] = [line.strip() for line in lines if line.strip()]
+        elif annotation is str and isinstance(value, list):
+            data[name] = "\n".join(str(item) for item in value)
+        else:
+            continue
+        changed = True
+    return data, changed
+
+def repair_output(text: str, model: Type[BaseModel]) -> BaseModel:
+    """
+    Parses a model from LLM output that is not clean JSON: fenced, wrapped in
+    prose, loosely quoted or with values of the wrong type. Raises ValueError
+    if no reading of it validates. Counts the steps used in repair_stats.
+    """
+    steps = []
+    fenced = strip_fences(text)
+    if fenced is not None:
+        steps.append("fences")
+        text = fenced
+    candidates = balanced_objects(text)
+    if not candidates:
+        raise ValueError("no JSON object in the output")
+    if candidates[0] != text.strip():
+        steps.append("extracted")
+
+    # The first object that parses and validates wins; prose may contain {placeholders}
+    error = ValueError("no JSON object in the output")
+    for candidate in candidates:
+        attempt = list(steps)
+        try:
+            data = loads_tolerant(candidate, attempt)
+            if not isinstance(data, dict):
+                raise ValueError("not a JSON object")
+            data, coerced = coerce_fields(data, model)
+            if coerced:
+                attempt.append("coerced")
+            result = model.model_validate(data)
+        except ValueError as e:
+            error = e
+            continue
+        for step in attempt:
+            repair_stats[step] += 1
+        return result
+    raise error
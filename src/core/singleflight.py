@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts
+    the call as its own task, later ones wait on that task and share its
+    result or exception. A waiter that is cancelled only stops waiting; the
+    call itself is cancelled once nobody is left waiting for it. Finished
+    calls are forgotten, so a later caller with the same key starts afresh.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        # Per name: calls started, callers that joined one (upstream calls
+        # saved), waiters cancelled, and calls cancelled with no waiters left
+        self.stats: Dict[str, dict] = {}
+
+    def _stats(self, name: str) -> dict:
+        return self.stats.setdefault(name, {"calls": 0, "coalesced": 0, "cancelled": 0, "abandoned": 0})
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], name: str = "default") -> Any:
+        """
+        Returns fn()'s result, running fn only if no call with this key is in flight.
+        """
+        stats = self._stats(name)
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            stats["calls"] += 1
+        else:
+            stats["coalesced"] += 1
+
+        call.waiters += 1
+        try:
+            # Shielded so that cancelling this waiter leaves the shared call running
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done():
+                stats["cancelled"] += 1
+            raise
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody wants the result any more; new callers start a fresh call
+                self._forget(key, call)
+                call.task.cancel()
+                stats["abandoned"] += 1
+
+    def in_flight(self) -> int:
+        return len(self._calls)
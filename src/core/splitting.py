@@ -0,0 +1,150 @@
+import ast
+import re
+from typing import List, Tuple
+
+from src.core.parsers import CodeAnalysis
+
+# Name given to the top-level statements that are not functions or classes
+MODULE_UNIT = "<module>"
+
+_UNIT_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+# Rough characters-per-token ratio for source code with Llama-family tokenizers
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate; good enough to size chunks without loading a tokenizer.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _start_line(node: ast.AST) -> int:
+    # Decorators sit above the def line but belong to the node
+    return min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+
+def split_code_units(code: str) -> List[Tuple[str, str]]:
+    """
+    Splits a module into (name, source) units: one per top-level function or
+    class, plus one for the remaining top-level statements (imports, constants...).
+    Code that does not parse is returned as a single module unit.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return [(MODULE_UNIT, code)]
+
+    lines = code.splitlines(keepends=True)
+    units = []
+    rest = []
+    for node in tree.body:
+        source = "".join(lines[_start_line(node) - 1:node.end_lineno])
+        if isinstance(node, _UNIT_NODES):
+            units.append((node.name, source))
+        else:
+            rest.append(source)
+    if rest:
+        units.insert(0, (MODULE_UNIT, "".join(rest)))
+    return units
+
+def _split_lines(lines: List[str], max_tokens: int) -> List[str]:
+    pieces, current, size = [], [], 0
+    for line in lines:
+        tokens = estimate_tokens(line)
+        if current and size + tokens > max_tokens:
+            pieces.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += tokens
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+def _blocks(node: ast.stmt) -> List[list]:
+    # Statement lists of a compound statement, in source order
+    blocks = [getattr(node, field, None) for field in ("body", "handlers", "orelse", "finalbody")]
+    blocks += [case.body for case in getattr(node, "cases", [])]
+    return [block for block in blocks if isinstance(block, list) and block]
+
+def _atoms(lines: List[str], nodes: List[ast.AST], cursor: int, max_tokens: int, atoms: List[str]) -> int:
+    """
+    Appends the source of each statement to atoms, descending into the body,
+    else/except/finally clauses and match cases of statements too large to fit
+    in one chunk. Returns the line index reached.
+    """
+    for node in nodes:
+        text = "".join(lines[cursor:node.end_lineno])
+        blocks = _blocks(node)
+        if estimate_tokens(text) <= max_tokens:
+            atoms.append(text)
+        elif blocks:
+            reached = cursor
+            for block in blocks:
+                block_start = max(reached, _start_line(block[0]) - 1)
+                # The lines introducing the block: decorators and signature, "else:", "case ...:"
+                atoms.extend(_split_lines(lines[reached:block_start], max_tokens))
+                reached = _atoms(lines, block, block_start, max_tokens, atoms)
+            atoms.extend(_split_lines(lines[reached:node.end_lineno], max_tokens))
+        else:
+            atoms.extend(_split_lines(lines[cursor:node.end_lineno], max_tokens))
+        cursor = node.end_lineno
+    return cursor
+
+def chunk_code(code: str, max_tokens: int) -> List[str]:
+    """
+    Splits code into chunks of at most max_tokens (estimated), cutting along
+    statement boundaries and only falling back to line boundaries for single
+    statements that are too large. Code that does not parse is split by lines.
+    """
+    lines = code.splitlines(keepends=True)
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return _split_lines(lines, max_tokens)
+
+    atoms = []
+    reached = _atoms(lines, tree.body, 0, max_tokens, atoms)
+    # Comments and blank lines after the last statement
+    atoms.extend(_split_lines(lines[reached:], max_tokens))
+
+    chunks, current, size = [], [], 0
+    for atom in atoms:
+        if not atom:
+            continue
+        tokens = estimate_tokens(atom)
+        if current and size + tokens > max_tokens:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(atom)
+        size += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def _unique(items: List[str]) -> List[str]:
+    # Case and whitespace differences do not make a finding new
+    seen = {}
+    for item in items:
+        seen.setdefault(re.sub(r"\s+", " ", item).strip().casefold(), item)
+    return list(seen.values())
+
+def merge_analyses(results: List[Tuple[str, CodeAnalysis]]) -> CodeAnalysis:
+    """
+    Merges per-unit analyses into one: the code is optimal only if every unit is,
+    and issues/suggestions are prefixed with the unit they came from.
+    """
+    return CodeAnalysis(
+        is_optimal=all(analysis.is_optimal for _, analysis in results),
+        issues=_unique([f"{name}: {issue}" for name, analysis in results for issue in analysis.issues]),
+        suggestions=_unique([f"{name}: {s}" for name, analysis in results for s in analysis.suggestions]),
+    )
+
+def reduce_analyses(results: List[CodeAnalysis]) -> CodeAnalysis:
+    """
+    Reduce step for chunked analysis: combines the chunk results and drops
+    duplicate issues and suggestions, without another LLM call.
+    """
+    return CodeAnalysis(
+        is_optimal=all(analysis.is_optimal for analysis in results),
+        issues=_unique([issue for analysis in results for issue in analysis.issues]),
+        suggestions=_unique([s for analysis in results for s in analysis.suggestions]),
+    )
@@ -0,0 +1,77 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+from typing import Optional
+
+# Shared by the auth service (which signs) and the assistant (which verifies)
+SECRET_KEY = os.getenv("AUTH_SECRET_KEY", "")
+TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", "3600"))
+
+_HEADER = {"alg": "HS256", "typ": "JWT"}
+
+class InvalidToken(Exception):
+    """Raised when a token is malformed, badly signed or expired."""
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(signing_input: str, secret: str) -> str:
+    digest = hmac.new(secret.encode(), signing_input.encode("ascii"), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+def create_token(username: str, secret: Optional[str] = None, ttl: Optional[int] = None) -> str:
+    """
+    Issues an HMAC-SHA256 signed, JWT-style token for a user.
+    """
+    secret = secret or SECRET_KEY
+    if not secret:
+        raise ValueError("AUTH_SECRET_KEY environment variable not set")
+    now = int(time.time())
+    payload = {
+        "sub": username,
+        "iat": now,
+        "exp": now + (TOKEN_TTL if ttl is None else ttl),
+        "jti": uuid.uuid4().hex,
+    }
+    signing_input = ".".join(
+        _b64encode(json.dumps(part, separators=(",", ":")).encode())
+        for part in (_HEADER, payload)
+    )
+    return f"{signing_input}.{_sign(signing_input, secret)}"
+
+def decode_token(token: str, secret: Optional[str] = None) -> dict:
+    """
+    Checks the signature and expiry of a token and returns its claims.
+    """
+    secret = secret or SECRET_KEY
+    if not secret:
+        raise InvalidToken("No secret configured")
+    # Tokens are base64url; anything else would fail in hmac instead
+    if not token.isascii():
+        raise InvalidToken("Malformed token")
+    try:
+        header_b64, payload_b64, signature = token.split(".")
+    except ValueError:
+        raise InvalidToken("Malformed token")
+
+    expected = _sign(f"{header_b64}.{payload_b64}", secret)
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidToken("Bad signature")
+
+    try:
+        header = json.loads(_b64decode(header_b64))
+        payload = json.loads(_b64decode(payload_b64))
+    except ValueError:
+        raise InvalidToken("Malformed token")
+    if header.get("alg") != "HS256" or "sub" not in payload:
+        raise InvalidToken("Malformed token")
+    if payload.get("exp", 0) <= time.time():
+        raise InvalidToken("Token expired")
+    return payload
@@ -0,0 +1,252 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+from src.core.metrics import Registry, metrics
+
+# Request tracing without LangSmith: spans stay in process and only the kept
+# traces are written out, in batches, off the request path
+TRACING = os.getenv("TRACING", "false").lower() == "true"
+# Share of requests traced in full, decided when they start; per path with
+# TRACE_SAMPLE_RATES, e.g. "/chat=0.05,/analyze=0.2"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SAMPLE_RATES = os.getenv("TRACE_SAMPLE_RATES", "")
+# Failed requests and requests slower than this are kept whatever the sample said
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "5"))
+TRACE_PATH = os.getenv("TRACE_PATH", "traces.jsonl")
+# Spans are written once TRACE_BATCH_SIZE traces are waiting, or every TRACE_FLUSH_SECONDS
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "100"))
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", "5"))
+# Traces waiting beyond this are dropped rather than held in memory
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+
+tracing_stats = {
+    "requests": 0, "sampled": 0, "kept_errors": 0, "kept_slow": 0,
+    "exported": 0, "dropped": 0, "batches": 0, "export_errors": 0,
+}
+
+def parse_rates(rates: str) -> Dict[str, float]:
+    """
+    "/chat=0.05,/analyze=0.2" -> {"/chat": 0.05, "/analyze": 0.2}
+    """
+    parsed = {}
+    for part in rates.split(","):
+        if part.strip():
+            path, rate = part.split("=")
+            parsed[path.strip()] = float(rate)
+    return parsed
+
+class Sampler:
+    """
+    Head-based sampling by request path, plus the rule that errors and slow
+    requests are always kept.
+    """
+
+    def __init__(self, rate: float = TRACE_SAMPLE_RATE, rates: Optional[Dict[str, float]] = None,
+                 slow_seconds: float = TRACE_SLOW_SECONDS, seed: Optional[int] = None):
+        self.rate = rate
+        self.rates = rates if rates is not None else parse_rates(TRACE_SAMPLE_RATES)
+        self.slow_seconds = slow_seconds
+        self._random = random.Random(seed)
+
+    def sample(self, path: str) -> bool:
+        return self._random.random() < self.rates.get(path, self.rate)
+
+    def keep(self, sampled: bool, error: bool, seconds: float) -> Optional[str]:
+        """
+        Why the trace is kept ("sampled", "error" or "slow"), or None to drop it.
+        """
+        if error:
+            return "error"
+        if seconds >= self.slow_seconds:
+            return "slow"
+        return "sampled" if sampled else None
+
+class Trace:
+    """
+    Spans of one request. Stage spans are only collected for sampled traces;
+    for the rest the root span (and its outcome) is enough to keep errors and
+    slow requests visible. `failed` covers errors a 200 response cannot show:
+    failed stages and errors reported in a streamed body.
+    """
+
+    __slots__ = ("trace_id", "path", "method", "sampled", "failed", "start", "started_at", "spans")
+
+    def __init__(self, path: str, method: str, sampled: bool):
+        self.trace_id = uuid.uuid4().hex
+        self.path = path
+        self.method = method
+        self.sampled = sampled
+        self.failed = False
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[dict] = []
+
+    def add_span(self, stage: str, seconds: float, labels: dict, error: bool):
+        offset = time.perf_counter() - seconds - self.start
+        self.spans.append({"name": stage, "offset": offset, "seconds": seconds, "error": error, "labels": labels})
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+def record_stage(stage: str, seconds: float, labels: dict, error: bool):
+    """
+    Stage hook (see Registry.observe_stage): adds the stage as a span of the
+    current sampled trace, and marks the trace failed if the stage failed.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        return
+    if error:
+        trace.failed = True
+    if trace.sampled:
+        trace.add_span(stage, seconds, labels, error)
+
+def mark_failed():
+    """
+    Marks the current request's trace as failed, so that it is kept like a 5xx.
+    For errors sent in-band, after a streaming response has started with 200.
+    """
+    trace = current_trace.get()
+    if trace is not None:
+        trace.failed = True
+
+class JsonlSink:
+    """
+    Appends each trace as one JSON line.
+    """
+
+    def __init__(self, path: str = TRACE_PATH):
+        self.path = path
+
+    def __call__(self, batch: List[dict]):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in batch))
+
+class BatchExporter:
+    """
+    Queues finished traces and hands them to `sink` in batches from a
+    background thread, so requests never wait on I/O. Any callable taking a
+    list of trace dicts can be a sink.
+    """
+
+    def __init__(self, sink: Callable[[List[dict]], None], batch_size: int = TRACE_BATCH_SIZE,
+                 flush_seconds: float = TRACE_FLUSH_SECONDS, queue_size: int = TRACE_QUEUE_SIZE):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue_size = queue_size
+        self._queue: List[dict] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: dict):
+        with self._lock:
+            if len(self._queue) >= self.queue_size:
+                tracing_stats["dropped"] += 1
+                return
+            self._queue.append(record)
+            if len(self._queue) >= self.batch_size:
+                self._wake.notify()
+
+    def _take(self) -> List[dict]:
+        batch, self._queue = self._queue, []
+        return batch
+
+    def _export(self, batch: List[dict]):
+        if not batch:
+            return
+        try:
+            self.sink(batch)
+        except Exception:
+            tracing_stats["export_errors"] += 1
+            return
+        tracing_stats["batches"] += 1
+        tracing_stats["exported"] += len(batch)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed and len(self._queue) < self.batch_size:
+                    self._wake.wait(self.flush_seconds)
+                batch = self._take()
+                closed = self._closed
+            self._export(batch)
+            if closed:
+                return
+
+    def flush(self):
+        """
+        Exports whatever is queued, on the calling thread.
+        """
+        with self._lock:
+            batch = self._take()
+        self._export(batch)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+        self._thread.join()
+
+_KEPT_COUNTERS = {"sampled": "sampled", "error": "kept_errors", "slow": "kept_slow"}
+
+class TracingMiddleware:
+    """
+    ASGI middleware that opens a trace per request, collects the stages
+    reported through `registry` while it runs and, if the sampler keeps it,
+    queues it on the exporter once the last response byte is sent.
+    """
+
+    def __init__(self, app, exporter: BatchExporter, sampler: Optional[Sampler] = None,
+                 registry: Registry = metrics):
+        self.app = app
+        self.exporter = exporter
+        self.sampler = sampler or Sampler()
+        if record_stage not in registry.stage_hooks:
+            registry.stage_hooks.append(record_stage)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tracing_stats["requests"] += 1
+        trace = Trace(scope["path"], scope["method"], self.sampler.sample(scope["path"]))
+        token = current_trace.set(trace)
+        status = 500
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            current_trace.reset(token)
+            self.finish(trace, status)
+
+    def finish(self, trace: Trace, status: int):
+        seconds = time.perf_counter() - trace.start
+        reason = self.sampler.keep(trace.sampled, status >= 500 or trace.failed, seconds)
+        if reason is None:
+            return
+        tracing_stats[_KEPT_COUNTERS[reason]] += 1
+        self.exporter.submit({
+            "trace_id": trace.trace_id,
+            "method": trace.method,
+            "path": trace.path,
+            "status": status,
+            "started_at": trace.started_at,
+            "seconds": seconds,
+            "kept": reason,
+            "spans": trace.spans,
+        })
@@ -1,18 +1,190 @@
-from langchain_core.chat_history import InMemoryChatMessageHistory
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from langchain_core.messages import BaseMessage, SystemMessage
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
+from src.core.splitting import estimate_tokens
+from src.memory.retrieval import SessionIndex
+from src.memory.sqlite_history import get_history_database, SQLiteChatMessageHistory
+
+# Estimated tokens of history sent with each chat turn (summary included)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+# When summarizing, older turns are folded in until the verbatim tail fits in this
+# share of the budget, so that the next turns can accumulate before the next fold
+HISTORY_RECENT_FRACTION = 0.5
+# Bounds on the session store (see SessionStore)
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "86400"))
+MAX_MESSAGES_PER_SESSION = int(os.getenv("MAX_MESSAGES_PER_SESSION", "500"))
+MAX_HISTORY_BYTES = int(os.getenv("MAX_HISTORY_BYTES", str(256 * 1024 * 1024)))
+# "memory" keeps histories in this process; "sqlite" shares them between workers through HISTORY_DB_PATH
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "memory")
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "chat_history.sqlite")
+# "summary" sends a rolling summary plus the newest turns; "retrieval" sends the
+# earlier exchanges most relevant to the new message plus the last few messages
+CHAT_MEMORY_MODE = os.getenv("CHAT_MEMORY_MODE", "summary")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_RECENT_MESSAGES = int(os.getenv("RETRIEVAL_RECENT_MESSAGES", "4"))
+# Messages kept in each session's retrieval index, older ones are forgotten
+RETRIEVAL_MAX_MESSAGES = int(os.getenv("RETRIEVAL_MAX_MESSAGES", "5000"))
+
+def message_bytes(message: BaseMessage) -> int:
+    """
+    Approximate memory held by a message: its encoded content.
+    """
+    return len(str(message.content).encode())
+
+class BoundedChatMessageHistory(InMemoryChatMessageHistory):
+    """
+    In-memory history that keeps at most max_messages, dropping the oldest,
+    and tracks how many bytes of content it holds.
+    """
+
+    max_messages: int = MAX_MESSAGES_PER_SESSION
+    # Messages dropped so far, so that indexes into the full conversation stay valid
+    dropped: int = 0
+    size_bytes: int = 0
+    # SessionIndex kept up to date on every append when retrieval is on
+    index: Any = None
+
+    def add_message(self, message: BaseMessage) -> None:
+        # add_messages and the add_*_message helpers all go through here
+        super().add_message(message)
+        if self.index is not None:
+            self.index.add_messages([message])
+        self.size_bytes += message_bytes(message)
+        excess = len(self.messages) - self.max_messages
+        if excess > 0:
+            self.size_bytes -= sum(message_bytes(m) for m in self.messages[:excess])
+            del self.messages[:excess]
+            self.dropped += excess
+
+    def clear(self) -> None:
+        self.dropped += len(self.messages)
+        self.size_bytes = 0
+        super().clear()
+        if self.index is not None:
+            self.index = SessionIndex(start=self.dropped, max_messages=self.index.max_messages)
+
+    def held_bytes(self) -> int:
+        # The index shares the history's messages and keeps older ones
+        return max(self.size_bytes, self.index.size_bytes) if self.index is not None else self.size_bytes
+
+class SessionStore:
+    """
+    Session histories with a predictable memory ceiling: at most max_sessions,
+    evicted least-recently-used first, idle sessions expire after idle_ttl seconds,
+    and sessions are also evicted while the content held exceeds max_bytes.
+    Bounds are enforced whenever a session is accessed.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_ttl: float = SESSION_IDLE_TTL,
+                 max_messages: int = MAX_MESSAGES_PER_SESSION, max_bytes: int = MAX_HISTORY_BYTES):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()  # session_id -> (last_access, history)
+        # Byte accounting is kept incrementally: histories only change after being
+        # handed out, so only those handed out since the last check are re-counted
+        self._bytes = 0
+        self._counted = {}  # session_id -> held_bytes() when last counted
+        self._handed_out = set()
+        self.evictions = 0
+
+    def get(self, session_id: str) -> BoundedChatMessageHistory:
+        now = time.monotonic()
+        self._recount()
+        self._expire(now)
+        entry = self._sessions.get(session_id)
+        if entry:
+            history = entry[1]
+        else:
+            history = BoundedChatMessageHistory(max_messages=self.max_messages)
+            if CHAT_MEMORY_MODE == "retrieval":
+                history.index = SessionIndex(max_messages=RETRIEVAL_MAX_MESSAGES)
+        self._sessions[session_id] = (now, history)
+        self._sessions.move_to_end(session_id)
+        self._enforce_bounds()
+        self._handed_out.add(session_id)
+        return history
+
+    def _recount(self):
+        for session_id in self._handed_out:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                size = entry[1].held_bytes()
+                self._bytes += size - self._counted.get(session_id, 0)
+                self._counted[session_id] = size
+        self._handed_out.clear()
+
+    def _evict_oldest(self):
+        session_id, _ = self._sessions.popitem(last=False)
+        self._bytes -= self._counted.pop(session_id, 0)
+        summaries.pop(session_id, None)
+        self.evictions += 1
+
+    def _expire(self, now: float):
+        while self._sessions:
+            last_access, _ = next(iter(self._sessions.values()))
+            if now - last_access < self.idle_ttl:
+                break
+            self._evict_oldest()
+
+    def _enforce_bounds(self):
+        # The most recent session is kept even if it alone exceeds max_bytes
+        while len(self._sessions) > self.max_sessions:
+            self._evict_oldest()
+        while len(self._sessions) > 1 and self._bytes > self.max_bytes:
+            self._evict_oldest()
+
+    def size_bytes(self) -> int:
+        self._recount()
+        return self._bytes
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def clear(self):
+        self._sessions.clear()
+        self._counted.clear()
+        self._handed_out.clear()
+        self._bytes = 0
+        summaries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "messages": sum(len(history.messages) for _, history in self._sessions.values()),
+            "bytes": self.size_bytes(),
+            "evictions": self.evictions,
+        }
+
 # Global store for session histories
-# Key: session_id, Value: InMemoryChatMessageHistory
-store = {}
+store = SessionStore()
 
-def get_session_history(session_id: str) -> InMemoryChatMessageHistory:
+def get_session_history(session_id: str) -> BaseChatMessageHistory:
     """
     Returns the chat history object for a given session ID.
-    If it doesn't exist, a new one is created.
+    If it doesn't exist (or was evicted), a new one is created.
     """
-    if session_id not in store:
-        store[session_id] = InMemoryChatMessageHistory()
-    return store[session_id]
+    if HISTORY_BACKEND == "sqlite":
+        # Only the newest messages are loaded; older ones stay on disk
+        return SQLiteChatMessageHistory(session_id, get_history_database(HISTORY_DB_PATH), MAX_MESSAGES_PER_SESSION)
+    return store.get(session_id)
+
+def history_stats() -> dict:
+    if HISTORY_BACKEND == "sqlite":
+        return get_history_database(HISTORY_DB_PATH).stats()
+    return {"backend": "memory", **store.stats()}
 
 def get_user_history(session_id: str) -> list:
     """
@@ -23,3 +195,204 @@ def get_user_history(session_id: str) -> list:
         {"role": msg.type, "content": msg.content} 
         for msg in history.messages
     ]
+
+def _message_dict(message_id: int, message: BaseMessage) -> dict:
+    return {"id": message_id, "role": message.type, "content": message.content}
+
+def _memory_window(session_id: str) -> Tuple[List[BaseMessage], int]:
+    history = store.get(session_id)
+    # Ids are positions in the whole conversation, so they survive dropped messages
+    return list(history.messages), history.dropped
+
+def get_history_page(session_id: str, limit: int, before: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+    """
+    Returns up to limit messages older than the message id `before` (the newest
+    ones if it is None), oldest first, and the cursor for the previous page
+    (None when there are no older messages).
+    """
+    if HISTORY_BACKEND == "sqlite":
+        rows = get_history_database(HISTORY_DB_PATH).page(session_id, limit + 1, before)
+        more = len(rows) > limit
+        rows = rows[-limit:] if more else rows
+        page = [_message_dict(message_id, message) for message_id, message in rows]
+        return page, (page[0]["id"] if more and page else None)
+
+    messages, offset = _memory_window(session_id)
+    end = len(messages) if before is None else max(0, min(len(messages), before - offset))
+    start = max(0, end - limit)
+    page = [_message_dict(offset + index, messages[index]) for index in range(start, end)]
+    return page, (offset + start if start > 0 else None)
+
+def iter_history(session_id: str, batch_size: int = 200) -> Iterator[dict]:
+    """
+    Every stored message of a session, oldest first. Database rows are read
+    batch_size at a time as the iterator is consumed; an in-memory history is
+    copied by this call, so the iterator itself can be consumed on any thread.
+    """
+    if HISTORY_BACKEND == "sqlite":
+        return _iter_database(session_id, batch_size)
+    messages, offset = _memory_window(session_id)
+    return (_message_dict(offset + index, message) for index, message in enumerate(messages))
+
+def _iter_database(session_id: str, batch_size: int) -> Iterator[dict]:
+    database = get_history_database(HISTORY_DB_PATH)
+    after = 0
+    while True:
+        rows = database.after(session_id, after, batch_size)
+        for message_id, message in rows:
+            yield _message_dict(message_id, message)
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][0]
+
+# --- Rolling summaries ---
+@dataclass
+class Summary:
+    text: str
+    # Number of leading messages of the conversation folded into the text,
+    # counting messages the history has since dropped
+    covered: int
+
+# Key: session_id, Value: Summary. In-memory sessions only, dropped along with
+# the session (see SessionStore); the sqlite backend stores them in the database
+summaries = {}
+# Sessions with a summary update in progress
+_summarizing = set()
+
+def get_summary(session_id: str) -> Optional[Summary]:
+    if HISTORY_BACKEND == "sqlite":
+        row = get_history_database(HISTORY_DB_PATH).summary(session_id)
+        return Summary(text=row[0], covered=row[1]) if row else None
+    return summaries.get(session_id)
+
+def _set_summary(session_id: str, summary: Summary):
+    if HISTORY_BACKEND == "sqlite":
+        get_history_database(HISTORY_DB_PATH).set_summary(session_id, summary.text, summary.covered)
+    else:
+        summaries[session_id] = summary
+
+def _dropped(session_id: str, messages: List[BaseMessage]) -> int:
+    # Messages of the conversation older than `messages`, the session's loaded
+    # history; on sqlite counted without loading the tail a second time
+    if HISTORY_BACKEND == "sqlite":
+        return max(0, get_history_database(HISTORY_DB_PATH).count(session_id) - len(messages))
+    return store.get(session_id).dropped
+
+def _message_tokens(message: BaseMessage) -> int:
+    return estimate_tokens(str(message.content))
+
+def _recent_start(messages: List[BaseMessage], start: int, budget: int) -> int:
+    """
+    Index of the oldest message from start onwards such that the messages
+    after it fit in budget. The newest message is always kept.
+    """
+    used = 0
+    index = len(messages)
+    while index > start:
+        tokens = _message_tokens(messages[index - 1])
+        if index < len(messages) and used + tokens > budget:
+            break
+        used += tokens
+        index -= 1
+    return index
+
+def trim_history(messages: List[BaseMessage], session_id: str, budget: int = None) -> List[BaseMessage]:
+    """
+    Messages for the prompt: the running summary followed by the newest
+    messages that fit in the token budget. Messages older than those that are
+    not summarized yet are dropped until the background summary catches up.
+    """
+    budget = budget or HISTORY_TOKEN_BUDGET
+    summary = get_summary(session_id)
+    prefix = []
+    covered = 0
+    if summary is not None:
+        prefix = [SystemMessage(content=f"Summary of the earlier conversation: {summary.text}")]
+        covered = max(0, summary.covered - _dropped(session_id, messages))
+        budget = max(0, budget - _message_tokens(prefix[0]))
+    return prefix + messages[_recent_start(messages, covered, budget):]
+
+async def update_summary(session_id: str,
+                         summarize: Callable[[str, List[BaseMessage]], Awaitable[str]],
+                         budget: int = None):
+    """
+    Folds the messages that no longer fit in the budget into the session's
+    running summary. Meant to run in the background after a chat turn.
+    """
+    budget = budget or HISTORY_TOKEN_BUDGET
+    if session_id in _summarizing:
+        return
+    history = get_session_history(session_id)
+    messages = list(history.messages)
+    dropped = history.dropped
+    summary = get_summary(session_id) or Summary(text="", covered=0)
+    # Messages dropped by the history before being summarized are lost
+    covered = max(0, summary.covered - dropped)
+    if CHAT_MEMORY_MODE != "summary" or _recent_start(messages, covered, budget) <= covered:
+        return  # Everything still fits verbatim
+
+    fold_until = _recent_start(messages, covered, int(budget * HISTORY_RECENT_FRACTION))
+    _summarizing.add(session_id)
+    try:
+        text = await summarize(summary.text, messages[covered:fold_until])
+        _set_summary(session_id, Summary(text=text, covered=dropped + fold_until))
+    finally:
+        _summarizing.discard(session_id)
+
+# --- Retrieval ---
+# Indexes of sqlite-backed sessions (in-memory histories carry their own).
+# Key: session_id, Value: SessionIndex, least recently used first
+indexes = OrderedDict()
+
+def _session_index(session_id: str) -> SessionIndex:
+    """
+    The session's retrieval index. Database-backed indexes are first brought up
+    to date with the messages appended since the last call, by any worker.
+    Only called on the event loop (see chains._abudgeted_history): neither the
+    session store nor `indexes` is locked.
+    """
+    if HISTORY_BACKEND != "sqlite":
+        history = store.get(session_id)
+        if history.index is None:
+            # Session started before retrieval was turned on
+            history.index = SessionIndex(start=history.dropped, max_messages=RETRIEVAL_MAX_MESSAGES)
+            history.index.add_messages(history.messages)
+        return history.index
+
+    index = indexes.get(session_id)
+    if index is None:
+        index = indexes[session_id] = SessionIndex(max_messages=RETRIEVAL_MAX_MESSAGES)
+        while len(indexes) > MAX_SESSIONS:
+            indexes.popitem(last=False)
+    indexes.move_to_end(session_id)
+    database = get_history_database(HISTORY_DB_PATH)
+    while True:
+        rows = database.after(session_id, index.last_id, 200)
+        if rows:
+            index.add_messages([message for _, message in rows])
+            index.last_id = rows[-1][0]
+        if len(rows) < 200:
+            return index
+
+def retrieve_history(messages: List[BaseMessage], session_id: str, query: str, k: int = None) -> List[BaseMessage]:
+    """
+    Messages for the prompt: the k earlier exchanges that best match the query
+    (BM25 over the whole session, including messages the history has dropped)
+    followed by the newest RETRIEVAL_RECENT_MESSAGES messages.
+    """
+    k = k or RETRIEVAL_TOP_K
+    index = _session_index(session_id)
+    recent = messages[-RETRIEVAL_RECENT_MESSAGES:] if RETRIEVAL_RECENT_MESSAGES > 0 else []
+    retrieved = index.search(query, k, before=index.next_position - len(recent))
+    if not retrieved:
+        return recent
+    prefix = [SystemMessage(content="Earlier exchanges relevant to the new message:")]
+    return prefix + retrieved + recent
+
+def build_history(messages: List[BaseMessage], session_id: str, query: str) -> List[BaseMessage]:
+    """
+    The history sent with a chat turn, according to CHAT_MEMORY_MODE.
+    """
+    if CHAT_MEMORY_MODE == "retrieval":
+        return retrieve_history(messages, session_id, query)
+    return trim_history(messages, session_id)
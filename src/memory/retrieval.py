@@ -0,0 +1,131 @@
+import math
+import re
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage
+
+# Too common in chat to say anything about relevance
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i if in is it its "
+    "me my of on or so that the this to was what when where which why will with you your".split()
+)
+
+retrieval_stats = {"searches": 0, "indexed": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased words and identifiers; snake_case identifiers also yield their parts.
+    """
+    tokens = []
+    for word in re.findall(r"[a-z0-9_]+", text.lower()):
+        if word in STOPWORDS:
+            continue
+        tokens.append(word)
+        if "_" in word:
+            tokens.extend(part for part in word.split("_") if part and part not in STOPWORDS)
+    return tokens
+
+class BM25Index:
+    """
+    Incremental in-memory inverted index with Okapi BM25 scoring.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self.lengths: Dict[int, int] = {}  # doc_id -> number of terms
+        self._terms: Dict[int, Counter] = {}
+        self.total_length = 0
+
+    def add(self, doc_id: int, text: str):
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self.postings[term][doc_id] = frequency
+        self._terms[doc_id] = terms
+        length = sum(terms.values())
+        self.lengths[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id: int):
+        for term in self._terms.pop(doc_id, ()):
+            docs = self.postings[term]
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(doc_id, 0)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """
+        The k best (doc_id, score) pairs for the query, best first.
+        """
+        if not self.lengths:
+            return []
+        count = len(self.lengths)
+        average_length = self.total_length / count or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, frequency in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+class SessionIndex:
+    """
+    BM25 index over one session's messages, addressed by their position in the
+    conversation. Keeps the newest max_messages even after the history drops them.
+    """
+
+    def __init__(self, start: int = 0, max_messages: int = 5000):
+        self.index = BM25Index()
+        self.messages: "OrderedDict[int, BaseMessage]" = OrderedDict()
+        self.next_position = start
+        self.max_messages = max_messages
+        # Newest row indexed, for histories read back from a database
+        self.last_id = 0
+        self.size_bytes = 0
+
+    def add_messages(self, messages: Sequence[BaseMessage]):
+        for message in messages:
+            position = self.next_position
+            self.next_position += 1
+            self.messages[position] = message
+            self.index.add(position, str(message.content))
+            self.size_bytes += len(str(message.content).encode())
+            retrieval_stats["indexed"] += 1
+        while len(self.messages) > self.max_messages:
+            position, message = self.messages.popitem(last=False)
+            self.index.remove(position)
+            self.size_bytes -= len(str(message.content).encode())
+
+    def search(self, query: str, k: int, before: int) -> List[BaseMessage]:
+        """
+        The k most relevant exchanges older than position `before`, each expanded
+        to its question and answer, in conversation order.
+        """
+        start = time.perf_counter()
+        # Over-fetch: hits in the recent window are skipped
+        hits = [position for position, _ in self.index.search(query, k * 3) if position < before][:k]
+        positions = set()
+        for position in hits:
+            message = self.messages[position]
+            partner = position + 1 if message.type == "human" else position - 1
+            positions.add(position)
+            if partner in self.messages and partner < before:
+                positions.add(partner)
+        result = [self.messages[position] for position in sorted(positions)]
+
+        elapsed = time.perf_counter() - start
+        retrieval_stats["searches"] += 1
+        retrieval_stats["total_seconds"] += elapsed
+        retrieval_stats["max_seconds"] = max(retrieval_stats["max_seconds"], elapsed)
+        return result
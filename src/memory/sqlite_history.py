@@ -0,0 +1,163 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+class HistoryDatabase:
+    """
+    SQLite (WAL) file shared by every worker process. Messages are only ever
+    appended; a session's history is the rows with its id, in insertion order.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 10.0):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL only fsyncs at checkpoints; a crash may lose the last turns, never corrupt the file
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "message TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        # One rolling summary per session (see memory.update_summary), overwritten in place
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "session_id TEXT PRIMARY KEY, text TEXT NOT NULL, covered INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]):
+        """
+        Appends messages in a single transaction (one commit per chat turn).
+        """
+        now = time.time()
+        rows = [(session_id, json.dumps(message_to_dict(m)), now) for m in messages]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO messages (session_id, message, created_at) VALUES (?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def tail(self, session_id: str, limit: int) -> List[BaseMessage]:
+        """
+        The newest limit messages of a session, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in reversed(rows)])
+
+    def page(self, session_id: str, limit: int, before: Optional[int] = None) -> List[Tuple[int, BaseMessage]]:
+        """
+        Up to limit (row id, message) pairs older than the before id, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, message FROM messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (session_id, before if before is not None else 2 ** 63 - 1, limit),
+            ).fetchall()
+        rows.reverse()
+        messages = messages_from_dict([json.loads(row[1]) for row in rows])
+        return [(row[0], message) for row, message in zip(rows, messages)]
+
+    def after(self, session_id: str, after: int, limit: int) -> List[Tuple[int, BaseMessage]]:
+        """
+        Up to limit (row id, message) pairs newer than the after id, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, message FROM messages WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (session_id, after, limit),
+            ).fetchall()
+        messages = messages_from_dict([json.loads(row[1]) for row in rows])
+        return [(row[0], message) for row, message in zip(rows, messages)]
+
+    def count(self, session_id: str) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return count
+
+    def summary(self, session_id: str) -> Optional[Tuple[str, int]]:
+        """
+        The session's (summary text, messages covered), or None.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT text, covered FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+
+    def set_summary(self, session_id: str, text: str, covered: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (session_id, text, covered, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, text, covered, time.time()),
+            )
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions, messages = self._conn.execute(
+                "SELECT COUNT(DISTINCT session_id), COUNT(*) FROM messages"
+            ).fetchone()
+        return {"backend": "sqlite", "sessions": sessions, "messages": messages}
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat history stored in a HistoryDatabase. Only the newest tail_size
+    messages are loaded, and only when first read.
+    """
+
+    def __init__(self, session_id: str, database: HistoryDatabase, tail_size: int):
+        self.session_id = session_id
+        self.database = database
+        self.tail_size = tail_size
+        self._messages = None
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        if self._messages is None:
+            self._messages = self.database.tail(self.session_id, self.tail_size)
+        return self._messages
+
+    @property
+    def dropped(self) -> int:
+        # Messages older than the loaded tail, like BoundedChatMessageHistory.dropped
+        return max(0, self.database.count(self.session_id) - len(self.messages))
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.database.append(self.session_id, messages)
+        if self._messages is not None:
+            self._messages = (self._messages + list(messages))[-self.tail_size:]
+
+    def clear(self) -> None:
+        self.database.delete(self.session_id)
+        self._messages = []
+
+_databases: Dict[str, HistoryDatabase] = {}
+
+def get_history_database(path: str) -> HistoryDatabase:
+    """
+    One connection per database file per process.
+    """
+    if path not in _databases:
+        _databases[path] = HistoryDatabase(path)
+    return _databases[path]
@@ -1,6 +1,8 @@
 from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
 
-# 1. Code Analysis Prompt
+# Bump whenever a prompt below changes so cached results from the old wording are not reused
+PROMPT_VERSION = "1"
+
 # 1. Code Analysis Prompt
 analysis_prompt = PromptTemplate(
     input_variables=["code", "format_instructions"],
@@ -50,3 +52,23 @@ chat_prompt = ChatPromptTemplate.from_messages([
     MessagesPlaceholder(variable_name="history"),
     ("human", "{input}")
 ])
+
+# 5. Chat History Summary Prompt
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You maintain a running summary of a conversation between a Python developer and an AI assistant. "
+               "Keep facts, names, code identifiers and decisions. Stay under 150 words."),
+    ("human", "Current summary:\n{summary}\n\nNew messages:\n{messages}\n\nReturn only the updated summary.")
+])
+
+# 6. Output Repair Prompt (last resort when the output cannot be repaired locally)
+repair_prompt = PromptTemplate(
+    input_variables=["output", "error", "format_instructions"],
+    template="""The following answer was supposed to be a single JSON object, but it could not be parsed: {error}
+
+{output}
+
+{format_instructions}
+
+IMPORTANT: Output ONLY the corrected JSON object, keeping its content. Do not output any markdown code blocks, no headers, and no conversational text.
+"""
+)
@@ -1,6 +1,9 @@
+import asyncio
+import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 from src.api.authentication.auth import app
+import src.api.authentication.auth as auth_module
 
 client = TestClient(app)
 
@@ -46,3 +49,57 @@ def test_login_flow(mock_hash, mock_verify):
 def test_verify_token_invalid():
     response = client.get("/me", params={"token": "invalid_token"})
     assert response.status_code == 401
+
+@patch("src.api.authentication.auth.verify_password", return_value=True)
+@patch("src.api.authentication.auth.get_password_hash", side_effect=lambda p: f"hashed_{p}")
+def test_logout_revokes_token(mock_hash, mock_verify):
+    client.post("/signup", json={"username": "logoutuser", "password": "pw"})
+    token = client.post("/login", json={"username": "logoutuser", "password": "pw"}).json()["access_token"]
+    assert token != "logoutuser"
+
+    assert client.post("/logout", params={"token": token}).status_code == 200
+    assert client.get("/me", params={"token": token}).status_code == 401
+
+@patch("src.api.authentication.auth.verify_password", return_value=True)
+@patch("src.api.authentication.auth.get_password_hash", side_effect=lambda p: f"hashed_{p}")
+def test_user_store_is_used_off_the_event_loop(mock_hash, mock_verify, monkeypatch):
+    on_loop = []
+    for name in ("get", "create", "is_revoked", "revoke"):
+        original = getattr(auth_module.users, name)
+
+        def checked(*args, original=original, name=name):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(name)
+            except RuntimeError:
+                pass
+            return original(*args)
+
+        monkeypatch.setattr(auth_module.users, name, checked)
+
+    client.post("/signup", json={"username": "offloopuser", "password": "pw"})
+    token = client.post("/login", json={"username": "offloopuser", "password": "pw"}).json()["access_token"]
+    assert client.get("/me", params={"token": token}).status_code == 200
+    assert client.post("/logout", params={"token": token}).status_code == 200
+    assert on_loop == []
+
+def test_metrics_endpoint():
+    client.post("/signup", json={"username": "metricsuser", "password": "pw"})
+    client.get("/me", params={"token": "not-a-token"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    text = response.text
+    assert 'stage_seconds_count{stage="hash"}' in text
+    assert 'stage_errors_total{stage="verify_token"}' in text
+    assert 'cache_lookups_total{cache="user",result="miss"}' in text
+
+def test_me_rejects_non_ascii_token():
+    response = client.get("/me", params={"token": "é.é.é"})
+    assert response.status_code == 401
+
+def test_startup_fails_without_secret(monkeypatch):
+    monkeypatch.setattr(auth_module, "SECRET_KEY", "")
+    with pytest.raises(RuntimeError, match="AUTH_SECRET_KEY"):
+        with TestClient(app):
+            pass
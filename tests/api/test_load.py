@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+
+import src.api.assistant.main as main_module
+from src.core.chains import registry
+from src.api.assistant.main import app, verify_token
+from src.core.parsers import analysis_parser
+from src.prompts.prompts import analysis_prompt
+
+LLM_LATENCY = 0.05
+N_REQUESTS = 16
+
+async def slow_llm(prompt_value):
+    # Stands in for a Groq round-trip: pure wait, no CPU
+    await asyncio.sleep(LLM_LATENCY)
+    return AIMessage(content='{"is_optimal": true, "issues": [], "suggestions": []}')
+
+slow_analysis_chain = (
+    RunnablePassthrough.assign(
+        format_instructions=lambda _: analysis_parser.get_format_instructions()
+    )
+    | analysis_prompt
+    | RunnableLambda(slow_llm)
+    | analysis_parser
+)
+
+async def mock_verify_token():
+    return "loaduser"
+
+@pytest.fixture
+def slow_app(monkeypatch):
+    monkeypatch.setitem(registry, "analysis", slow_analysis_chain)
+    monkeypatch.setitem(app.dependency_overrides, verify_token, mock_verify_token)
+    return app
+
+async def measure_throughput(concurrency: int) -> float:
+    # The semaphore must be created inside the loop that uses it
+    main_module.chain_semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            # Every run must reach the fake LLM, not the result cache
+            client.post("/analyze", json={"code": f"x = {i}"}, headers={"Cache-Control": "no-cache"})
+            for i in range(N_REQUESTS)
+        ])
+        elapsed = time.perf_counter() - start
+    assert all(r.status_code == 200 for r in responses)
+    return N_REQUESTS / elapsed
+
+def test_throughput_scales_with_concurrency(slow_app, monkeypatch):
+    monkeypatch.setattr(main_module, "chain_semaphore", main_module.chain_semaphore)
+
+    sequential = asyncio.run(measure_throughput(1))
+    concurrent = asyncio.run(measure_throughput(8))
+
+    # A blocking endpoint would keep both numbers around 1 / LLM_LATENCY
+    assert concurrent > 3 * sequential
@@ -1,6 +1,21 @@
+import asyncio
+import httpx
+import json
+from contextlib import contextmanager
 from fastapi.testclient import TestClient
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from src.api.assistant.main import app, verify_token, AnalysisOutput
+import src.api.assistant.main as main_module
+from langchain_core.language_models.fake_chat_models import FakeListChatModel, GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from src.memory.memory import get_session_history, get_user_history
+import src.memory.memory as memory_module
+from src.prompts.prompts import chat_prompt
+from src.core import parsers
+from src.core.chains import registry
+import src.core.chains as chains_module
+from src.core.tokens import create_token
 import pytest
 
 client = TestClient(app)
@@ -11,11 +26,18 @@ async def mock_verify_token():
 
 app.dependency_overrides[verify_token] = mock_verify_token
 
+@contextmanager
+def patch_chain(name, chain=None):
+    # Puts a stand-in for the named chain in the registry, as if it had been built
+    chain = chain if chain is not None else MagicMock()
+    with patch.dict(registry, {name: chain}):
+        yield chain
+
 def test_analyze_endpoint():
     mock_result = AnalysisOutput(is_optimal=True, issues=[], suggestions=[])
     
-    with patch("src.api.assistant.main.analysis_chain") as mock_chain:
-        mock_chain.invoke.return_value = mock_result
+    with patch_chain("analysis") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(return_value=mock_result)
         response = client.post("/analyze", json={"code": "print('hello')"})
         assert response.status_code == 200
         assert response.json()["is_optimal"] is True
@@ -24,8 +46,8 @@ def test_generate_test_endpoint():
     mock_result = MagicMock()
     mock_result.test_code = "def test_x(): pass"
     
-    with patch("src.api.assistant.main.test_generation_chain") as mock_chain:
-        mock_chain.invoke.return_value = mock_result
+    with patch_chain("test_generation") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(return_value=mock_result)
         response = client.post("/generate_test", json={"code": "def x(): pass"})
         assert response.status_code == 200
         assert response.json()["test_code"] == "def test_x(): pass"
@@ -34,8 +56,442 @@ def test_chat_endpoint():
     mock_response = MagicMock()
     mock_response.content = "Hello there!"
     
-    with patch("src.api.assistant.main.chat_chain") as mock_chain:
-        mock_chain.invoke.return_value = mock_response
+    with patch_chain("chat") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(return_value=mock_response)
         response = client.post("/chat", json={"message": "Hi"})
         assert response.status_code == 200
         assert response.json()["response"] == "Hello there!"
+
+def test_verify_token_uses_cache(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.params["token"])
+        if request.url.params["token"] == "good":
+            return httpx.Response(200, json={"username": "alice"})
+        return httpx.Response(401, json={"detail": "Invalid"})
+
+    # Without a shared secret every token is checked remotely
+    monkeypatch.setattr(main_module, "SECRET_KEY", "")
+
+    async def run():
+        monkeypatch.setattr(main_module, "auth_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        main_module.token_cache.clear()
+
+        assert await verify_token("Bearer good") == "alice"
+        assert await verify_token("Bearer good") == "alice"
+        for _ in range(2):
+            with pytest.raises(Exception) as exc:
+                await verify_token("Bearer bad")
+            assert exc.value.status_code == 401
+
+        # Only the first lookup of each token reaches the auth service
+        assert calls == ["good", "bad"]
+
+        main_module.token_cache.invalidate("good")
+        await verify_token("Bearer good")
+        assert calls == ["good", "bad", "good"]
+
+    asyncio.run(run())
+
+def test_verify_token_auth_service_errors_are_not_cached(monkeypatch):
+    statuses = [503, 429, 200]
+
+    def handler(request):
+        status = statuses.pop(0)
+        return httpx.Response(status, json={"username": "carol"} if status == 200 else {"detail": "Busy"})
+
+    monkeypatch.setattr(main_module, "SECRET_KEY", "")
+
+    async def run():
+        monkeypatch.setattr(main_module, "auth_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        main_module.token_cache.clear()
+        errors = main_module.auth_hop_stats["errors"]
+
+        for _ in range(2):
+            with pytest.raises(Exception) as exc:
+                await verify_token("Bearer flaky")
+            assert exc.value.status_code == 503
+        assert main_module.auth_hop_stats["errors"] == errors + 2
+
+        # Neither failure was remembered as a rejected token
+        assert await verify_token("Bearer flaky") == "carol"
+
+    asyncio.run(run())
+
+def test_revocation_check_is_not_cached(monkeypatch):
+    revoked = False
+
+    def handler(request):
+        if revoked:
+            return httpx.Response(401, json={"detail": "Invalid"})
+        return httpx.Response(200, json={"username": "dave"})
+
+    monkeypatch.setattr(main_module, "AUTH_REVOCATION_CHECK", True)
+    token = create_token("dave")
+
+    async def run():
+        nonlocal revoked
+        monkeypatch.setattr(main_module, "auth_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        main_module.token_cache.clear()
+        assert await verify_token(f"Bearer {token}") == "dave"
+        # Logged out: the next request sees it, not AUTH_CACHE_TTL later
+        revoked = True
+        with pytest.raises(Exception) as exc:
+            await verify_token(f"Bearer {token}")
+        assert exc.value.status_code == 401
+
+    asyncio.run(run())
+
+def test_verify_token_checks_signature_locally(monkeypatch):
+    async def fail_fetch(token):
+        raise AssertionError("auth service should not be called")
+
+    monkeypatch.setattr(main_module, "fetch_username", fail_fetch)
+    token = create_token("bob")
+    assert asyncio.run(verify_token(f"Bearer {token}")) == "bob"
+
+    with pytest.raises(Exception) as exc:
+        asyncio.run(verify_token(f"Bearer {token[:-2]}xx"))
+    assert exc.value.status_code == 401
+
+def test_analyze_serves_repeats_from_cache():
+    mock_result = AnalysisOutput(is_optimal=False, issues=["slow"], suggestions=[])
+    payload = {"code": "def cached(): return 1"}
+
+    with patch_chain("analysis") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(return_value=mock_result)
+        first = client.post("/analyze", json=payload)
+        second = client.post("/analyze", json=payload)
+        assert first.json() == second.json()
+        assert mock_chain.ainvoke.await_count == 1
+
+        # Cache-Control: no-cache forces a fresh call
+        client.post("/analyze", json=payload, headers={"Cache-Control": "no-cache"})
+        assert mock_chain.ainvoke.await_count == 2
+
+def test_analyze_shares_cache_across_cosmetic_edits():
+    mock_result = AnalysisOutput(is_optimal=True, issues=[], suggestions=[])
+    before = main_module.fingerprint_stats["normalization_only_hits"]
+
+    with patch_chain("analysis") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(return_value=mock_result)
+        client.post("/analyze", json={"code": "def shared(a):\n    return a * 2\n"})
+        client.post("/analyze", json={"code": "def shared(a):\n    '''Doubles a.'''\n    return a*2  # twice\n"})
+        assert mock_chain.ainvoke.await_count == 1
+
+    assert main_module.fingerprint_stats["normalization_only_hits"] == before + 1
+
+def test_incremental_analysis_only_reanalyzes_changed_units():
+    async def fake_analysis(inputs, config=None):
+        return AnalysisOutput(is_optimal="slow" not in inputs["code"], issues=["slow"] if "slow" in inputs["code"] else [], suggestions=[])
+
+    module = "def inc_a():\n    return 1\n\ndef inc_b():\n    return 2\n"
+    edited = "def inc_a():\n    return 1\n\ndef inc_b():\n    return 'slow'\n"
+
+    with patch_chain("analysis") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(side_effect=fake_analysis)
+        response = client.post("/analyze", json={"code": module, "incremental": True})
+        assert [unit["name"] for unit in response.json()["units"]] == ["inc_a", "inc_b"]
+        assert mock_chain.ainvoke.await_count == 2
+
+        response = client.post("/analyze", json={"code": edited, "incremental": True})
+        assert mock_chain.ainvoke.await_count == 3
+        assert response.json()["is_optimal"] is False
+        assert response.json()["issues"] == ["inc_b: slow"]
+
+def test_incremental_analysis_chunks_large_units():
+    seen = []
+
+    async def fake_analysis(inputs, config=None):
+        seen.append(inputs["code"])
+        return AnalysisOutput(is_optimal=True, issues=[], suggestions=[])
+
+    body = "".join(f"    value_{i} = {i}\n" for i in range(40))
+    module = f"def inc_small():\n    return 1\n\ndef inc_large():\n{body}"
+
+    with patch_chain("analysis") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(side_effect=fake_analysis)
+        response = client.post("/analyze", json={"code": module, "incremental": True, "max_chunk_tokens": 60})
+    assert [unit["name"] for unit in response.json()["units"]] == ["inc_small", "inc_large"]
+    assert response.json()["chunks"] == len(seen) > 2
+    assert all(main_module.estimate_tokens(code) <= 60 for code in seen)
+
+def test_analyze_large_input_is_map_reduced():
+    async def fake_analysis(inputs, config=None):
+        return AnalysisOutput(is_optimal=True, issues=["Missing docstrings"], suggestions=[])
+
+    code = "".join(f"def big_{i}():\n    return {i}\n\n" for i in range(20))
+
+    with patch_chain("analysis") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(side_effect=fake_analysis)
+        response = client.post("/analyze", json={"code": code, "max_chunk_tokens": 40})
+        body = response.json()
+        assert body["chunks"] > 1
+        assert mock_chain.ainvoke.await_count == body["chunks"]
+        assert body["issues"] == ["Missing docstrings"]
+
+def pipeline_mocks(is_optimal, events):
+    async def fake_analysis(inputs, config=None):
+        events.append("analysis:start")
+        await asyncio.sleep(0.02)
+        events.append("analysis:end")
+        return AnalysisOutput(is_optimal=is_optimal, issues=[], suggestions=[])
+
+    async def fake_generation(inputs, config=None):
+        events.append("generation:start")
+        # Outlasts the analysis, so a speculative run can be cancelled before it ends
+        await asyncio.sleep(0.1)
+        events.append("generation:end")
+        return parsers.TestGeneration(test_code="def test_spec(): pass")
+
+    async def fake_explanation(inputs, config=None):
+        return parsers.TestExplanation(explanation="It checks nothing.")
+
+    return fake_analysis, fake_generation, fake_explanation
+
+def test_speculative_pipeline_overlaps_stages():
+    events = []
+    fake_analysis, fake_generation, fake_explanation = pipeline_mocks(True, events)
+
+    with patch_chain("analysis") as analysis, \
+         patch_chain("test_generation") as generation, \
+         patch_chain("explanation") as explanation:
+        analysis.ainvoke = AsyncMock(side_effect=fake_analysis)
+        generation.ainvoke = AsyncMock(side_effect=fake_generation)
+        explanation.ainvoke = AsyncMock(side_effect=fake_explanation)
+        response = client.post(
+            "/full_pipeline",
+            json={"code": "def speculate(): return 1", "speculative": True},
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    body = response.json()
+    assert body["test_code"] == "def test_spec(): pass"
+    assert body["explanation"] == "It checks nothing."
+    assert set(body["timings"]) == {"analysis", "test_generation", "explanation", "total"}
+    # Test generation started before the analysis finished
+    assert events.index("generation:start") < events.index("analysis:end")
+
+def test_speculative_pipeline_cancels_generation_for_non_optimal_code():
+    events = []
+    fake_analysis, fake_generation, _ = pipeline_mocks(False, events)
+    before = main_module.pipeline_stats["speculative_cancelled"]
+
+    with patch_chain("analysis") as analysis, \
+         patch_chain("test_generation") as generation:
+        analysis.ainvoke = AsyncMock(side_effect=fake_analysis)
+        generation.ainvoke = AsyncMock(side_effect=fake_generation)
+        response = client.post(
+            "/full_pipeline/stream",
+            json={"code": "def cancelled(): return 1", "speculative": True},
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    stages = [json.loads(line)["stage"] for line in response.text.splitlines()]
+    assert stages == ["analysis"]
+    assert "generation:end" not in events
+    assert main_module.pipeline_stats["speculative_cancelled"] == before + 1
+
+def sse_tokens(text):
+    events = text.strip().split("\n\n")
+    tokens = [json.loads(event[len("data: "):])["token"] for event in events if event.startswith("data: ")]
+    return tokens, events[-1]
+
+def test_chat_stream_saves_history_once():
+    fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content="streamed reply here")]))
+    streaming_chain = RunnableWithMessageHistory(
+        chat_prompt | fake_llm,
+        get_session_history,
+        input_messages_key="input",
+        history_messages_key="history"
+    )
+
+    with patch_chain("chat", streaming_chain):
+        response = client.post("/chat/stream", json={"message": "Stream please"})
+
+    tokens, last = sse_tokens(response.text)
+    assert len(tokens) > 1
+    assert "".join(tokens) == "streamed reply here"
+    assert last.startswith("event: done")
+    assert [m["content"] for m in get_user_history("testuser")][-2:] == ["Stream please", "streamed reply here"]
+    assert main_module.stream_stats["chat"]["streams"] >= 1
+
+def raw_stream(*pieces):
+    # Stands in for the explanation_stream chain: the model's raw output, chunk by chunk
+    async def fake_astream(inputs, config=None):
+        for piece in pieces:
+            yield AIMessageChunk(content=piece)
+    return fake_astream
+
+def test_explain_test_stream_yields_deltas():
+    with patch_chain("explanation_stream") as mock_chain:
+        mock_chain.astream = raw_stream('{"explanation": "This', ' test', ' passes"}')
+        response = client.post("/explain_test/stream", json={"test_code": "def test_stream(): pass"})
+
+    tokens, last = sse_tokens(response.text)
+    assert tokens == ["This", " test", " passes"]
+    assert last.startswith("event: done")
+
+def test_explain_test_stream_parses_fenced_output_and_caches_it():
+    test_code = "def test_fenced(): pass"
+    with patch_chain("explanation_stream") as mock_chain:
+        mock_chain.astream = raw_stream("```json\n", '{"explanation": "Fenced', ' answer"}', "\n```")
+        response = client.post("/explain_test/stream", json={"test_code": test_code})
+
+    tokens, last = sse_tokens(response.text)
+    assert "".join(tokens) == "Fenced answer"
+    assert last.startswith("event: done")
+    with patch_chain("explanation") as mock_chain:
+        assert client.post("/explain_test", json={"test_code": test_code}).json()["explanation"] == "Fenced answer"
+        mock_chain.ainvoke.assert_not_called()
+
+def test_explain_test_stream_does_not_cache_unparseable_output(monkeypatch):
+    monkeypatch.setattr(chains_module, "OUTPUT_REPAIR_RETRY", False)
+    inputs = {"test_code": "def test_prose(): pass"}
+    with patch_chain("explanation_stream") as mock_chain:
+        mock_chain.astream = raw_stream("This test ", "checks nothing useful.")
+        response = client.post("/explain_test/stream", json=inputs)
+
+    tokens, last = sse_tokens(response.text)
+    assert tokens == []
+    assert last.startswith("event: error")
+    assert main_module.lookup_result("explanation", inputs, parsers.TestExplanation)[1] is None
+
+def test_explain_test_stream_asks_the_llm_to_fix_unparseable_output(monkeypatch):
+    monkeypatch.setattr(chains_module, "_llm", FakeListChatModel(responses=['{"explanation": "Fixed by retry"}']))
+    with patch_chain("explanation_stream") as mock_chain:
+        mock_chain.astream = raw_stream("Sure! The test ", "checks nothing useful.")
+        response = client.post("/explain_test/stream", json={"test_code": "def test_retry(): pass"})
+
+    tokens, last = sse_tokens(response.text)
+    assert tokens == ["Fixed by retry"]
+    assert last.startswith("event: done")
+
+def test_batch_streams_each_item():
+    async def fake_invoke(inputs, config=None):
+        if "boom" in inputs["code"]:
+            raise ValueError("bad output")
+        return AnalysisOutput(is_optimal=True, issues=[], suggestions=[])
+
+    items = [{"id": "a.py", "code": "a_batch = 1"}, {"id": "b.py", "code": "boom = 1"}]
+    with patch_chain("analysis") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(side_effect=fake_invoke)
+        lines = [json.loads(line) for line in client.post("/batch", json={"items": items}).text.splitlines()]
+        assert {line["id"]: "result" in line for line in lines} == {"a.py": True, "b.py": False}
+
+        # The successful item is now served from the cache
+        lines = [json.loads(line) for line in client.post("/batch", json={"items": items[:1]}).text.splitlines()]
+        assert lines == [{"index": 0, "id": "a.py", "cached": True,
+                          "result": {"is_optimal": True, "issues": [], "suggestions": []}}]
+
+def test_batch_shares_the_chain_semaphore():
+    running = peak = 0
+
+    async def fake_invoke(inputs, config=None):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return AnalysisOutput(is_optimal=True, issues=[], suggestions=[])
+
+    items = [{"id": f"{i}.py", "code": f"batch_semaphore_{i} = 1"} for i in range(6)]
+    with patch_chain("analysis") as mock_chain, patch.object(main_module, "chain_semaphore", asyncio.Semaphore(2)):
+        mock_chain.ainvoke = AsyncMock(side_effect=fake_invoke)
+        lines = client.post("/batch", json={"items": items, "max_concurrency": 4}).text.splitlines()
+    assert len(lines) == 6
+    assert peak == 2
+
+def test_history_pagination_and_stream():
+    history = get_session_history("testuser")
+    history.clear()
+    for i in range(5):
+        history.add_message(HumanMessage(content=f"page message {i}"))
+
+    first = client.get("/history", params={"limit": 2}).json()
+    assert [m["content"] for m in first["messages"]] == ["page message 3", "page message 4"]
+
+    second = client.get("/history", params={"limit": 2, "before": first["next_before"]}).json()
+    assert [m["content"] for m in second["messages"]] == ["page message 1", "page message 2"]
+
+    last = client.get("/history", params={"limit": 2, "before": second["next_before"]}).json()
+    assert [m["content"] for m in last["messages"]] == ["page message 0"]
+    assert last["next_before"] is None
+
+    lines = [json.loads(line) for line in client.get("/history/stream").text.splitlines()]
+    assert [m["content"] for m in lines] == [f"page message {i}" for i in range(5)]
+
+def test_chat_and_history_stream_use_the_session_store_on_the_loop(monkeypatch):
+    history = get_session_history("testuser")
+    history.clear()
+    for i in range(30):
+        history.add_messages([HumanMessage(content=f"question {i} " + "word " * 40), AIMessage(content=f"answer {i}")])
+
+    off_loop = []
+    get = memory_module.store.get
+
+    def checked_get(session_id):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            off_loop.append(session_id)
+        return get(session_id)
+
+    monkeypatch.setattr(memory_module.store, "get", checked_get)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://main") as async_client:
+            return await asyncio.gather(*[
+                request
+                for i in range(4)
+                for request in (async_client.post("/chat", json={"message": f"Hi {i}"}),
+                                async_client.get("/history/stream"))
+            ])
+
+    chat_chain = chains_module.build_chat_chain(FakeListChatModel(responses=["Sure."]))
+    summary_chain = chains_module.build_summary_chain(FakeListChatModel(responses=["Earlier turns."]))
+    with patch_chain("chat", chat_chain), patch_chain("summary", summary_chain):
+        responses = asyncio.run(run())
+
+    assert [response.status_code for response in responses] == [200] * 8
+    assert all(line for response in responses[1::2] for line in response.text.splitlines())
+    assert off_loop == []
+
+def test_metrics_endpoint():
+    with patch_chain("analysis") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(return_value=AnalysisOutput(is_optimal=True, issues=[], suggestions=[]))
+        client.post("/analyze", json={"code": "print('metrics')"}, headers={"Cache-Control": "no-cache"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'http_request_seconds_count{method="POST",route="/analyze",status="200"}' in text
+    assert 'cache_lookups_total{cache="result",result="bypass"}' in text
+    assert "# TYPE output_repairs_total counter" in text
+
+def test_concurrent_identical_requests_share_one_chain_run():
+    async def slow_analysis(inputs, config=None):
+        await asyncio.sleep(0.05)
+        return AnalysisOutput(is_optimal=True, issues=[], suggestions=[])
+
+    payload = {"code": "def exercise(values):\n    return sorted(values)\n"}
+    before = main_module.in_flight.stats.get("analysis", {}).get("coalesced", 0)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://main") as async_client:
+            return await asyncio.gather(*[
+                async_client.post("/analyze", json=payload, headers={"Cache-Control": "no-cache"}) for _ in range(5)
+            ])
+
+    with patch_chain("analysis") as mock_chain:
+        mock_chain.ainvoke = AsyncMock(side_effect=slow_analysis)
+        responses = asyncio.run(run())
+
+    assert [response.status_code for response in responses] == [200] * 5
+    assert mock_chain.ainvoke.await_count == 1
+    assert main_module.in_flight.stats["analysis"]["coalesced"] == before + 4
+    assert client.get("/stats").json()["coalescing"]["upstream_calls_saved"] >= 4
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import time
+
+from src.api.authentication.user_store import UserStore
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+WORKER = """
+import sys
+from src.api.authentication.user_store import UserStore
+
+path, worker = sys.argv[1], sys.argv[2]
+users = UserStore(path)
+for i in range(50):
+    users.create(f"user-{i}", f"hash-{worker}")
+    users.create(f"own-{worker}-{i}", "hash")
+"""
+
+def test_reads_are_cached_and_misses_are_not(tmp_path):
+    path = str(tmp_path / "users.sqlite")
+    users = UserStore(path)
+    other_worker = UserStore(path)
+    assert users.get("alice") is None
+
+    assert other_worker.create("alice", "hash")
+    # A miss is never cached, so the signup on the other worker is seen at once
+    assert users.get("alice") == "hash"
+    assert users.get("alice") == "hash"
+    assert users.cache.stats()["hits"] == 1
+
+def test_duplicate_usernames_are_rejected(tmp_path):
+    users = UserStore(str(tmp_path / "users.sqlite"))
+    assert users.create("bob", "first")
+    assert not users.create("bob", "second")
+    assert users.get("bob") == "first"
+    assert len(users) == 1
+
+def test_revocations_are_shared_and_expire(tmp_path, monkeypatch):
+    path = str(tmp_path / "users.sqlite")
+    users = UserStore(path)
+    other_worker = UserStore(path)
+    now = time.time()
+
+    users.revoke("old", now + 10)
+    users.revoke("new", now + 100)
+    assert other_worker.is_revoked("old") and other_worker.is_revoked("new")
+    assert not other_worker.is_revoked("never")
+
+    # Revoking after "old" has expired drops its row
+    monkeypatch.setattr(time, "time", lambda: now + 50)
+    other_worker.revoke("newer", now + 200)
+    assert not users.is_revoked("old")
+    assert users.is_revoked("new") and users.is_revoked("newer")
+
+def test_concurrent_worker_processes_share_users(tmp_path):
+    path = str(tmp_path / "users.sqlite")
+    UserStore(path)  # create the schema before the workers race for it
+    workers = 4
+    processes = [
+        subprocess.Popen([sys.executable, "-c", WORKER, path, str(worker)], cwd=ROOT)
+        for worker in range(workers)
+    ]
+    assert all(process.wait(timeout=60) == 0 for process in processes)
+
+    users = UserStore(path)
+    # Every worker tried to create user-*; exactly one of them won each name
+    assert len(users) == 50 + workers * 50
+    assert users.get("user-0") in {f"hash-{worker}" for worker in range(workers)}
+    assert all(users.get(f"own-{worker}-49") == "hash" for worker in range(workers))
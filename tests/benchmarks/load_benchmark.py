@@ -0,0 +1,293 @@
+"""
+Load benchmark for the auth and assistant services, both run in-process
+against the fake LLM (LLM_PROVIDER=fake). Drives a mix of analyze, pipeline,
+chat and history requests and writes latency percentiles, throughput and
+peak RSS per endpoint to a JSON file.
+
+    python tests/benchmarks/load_benchmark.py --requests 400 --concurrency 16 --output bench.json
+    python tests/benchmarks/load_benchmark.py --output new.json --baseline bench.json
+    python tests/benchmarks/load_benchmark.py --tracing-overhead --output tracing.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# Relative share of each endpoint in the mixed traffic
+DEFAULT_MIX = "analyze=4,pipeline=2,chat=3,history=1"
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a non-empty list.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def current_rss_mb():
+    # Resident set size right now (Linux); falls back to the peak elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+def configure(args):
+    """
+    Environment for both services; must be set before they are imported.
+    """
+    os.environ.update({
+        "LLM_PROVIDER": "fake",
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.llm_tokens_per_second),
+        "AUTH_SECRET_KEY": os.environ.get("AUTH_SECRET_KEY") or "benchmark-secret",
+        # Every request also asks the auth service whether the token was revoked
+        "AUTH_REVOCATION_CHECK": "true" if args.auth_hop else "false",
+        "USERS_DB_PATH": ":memory:",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "RESULT_CACHE_PATH": "",
+        "HISTORY_BACKEND": "memory",
+        "MAX_CONCURRENT_CHAINS": str(args.max_chains),
+        "TRACING": "true" if args.tracing else "false",
+        "TRACE_SAMPLE_RATE": str(args.trace_sample_rate),
+        "TRACE_PATH": args.trace_path or os.path.join(tempfile.mkdtemp(), "traces.jsonl"),
+    })
+    sys.path.insert(0, ROOT)
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}  # endpoint -> [seconds]
+        self.errors = {}
+        self.rss = {}  # endpoint -> highest RSS seen when one of its requests finished
+
+    def record(self, endpoint, seconds, ok):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        self.rss[endpoint] = max(self.rss.get(endpoint, 0.0), current_rss_mb())
+
+    def summary(self, wall_seconds):
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput": len(latencies) / wall_seconds,
+                "mean_ms": 1000 * sum(latencies) / len(latencies),
+                "p50_ms": 1000 * percentile(latencies, 50),
+                "p95_ms": 1000 * percentile(latencies, 95),
+                "p99_ms": 1000 * percentile(latencies, 99),
+                "peak_rss_mb": self.rss[endpoint],
+            }
+        return endpoints
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+def request_for(endpoint, index, args):
+    """
+    (method, path, json body) of the index-th request to an endpoint. Inputs
+    repeat every --distinct-inputs requests, so the result cache sees some hits.
+    """
+    variant = index % args.distinct_inputs
+    code = f"def f_{variant}(values):\n    return [v * {variant} for v in values if v]\n"
+    if endpoint == "analyze":
+        return "POST", "/analyze", {"code": code}
+    if endpoint == "pipeline":
+        return "POST", "/full_pipeline", {"code": code}
+    if endpoint == "chat":
+        return "POST", "/chat", {"message": f"How do I speed up f_{variant}?"}
+    if endpoint == "history":
+        return "GET", "/history?limit=20", None
+    raise ValueError(f"unknown endpoint {endpoint}")
+
+async def run(args):
+    import httpx
+    import src.api.assistant.main as assistant
+    import src.api.authentication.auth as auth
+
+    recorder = Recorder()
+    auth_transport = httpx.ASGITransport(app=auth.app)
+    async with auth.app.router.lifespan_context(auth.app), \
+            assistant.app.router.lifespan_context(assistant.app), \
+            httpx.AsyncClient(transport=auth_transport, base_url="http://auth") as auth_client, \
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=assistant.app), base_url="http://main",
+                              timeout=None) as client:
+        # The assistant reaches the auth service in-process too
+        assistant.auth_client = httpx.AsyncClient(transport=auth_transport, base_url="http://auth")
+
+        async def timed(endpoint, send):
+            start = time.perf_counter()
+            try:
+                response = await send()
+                ok = response.status_code == 200
+            except Exception:
+                response, ok = None, False
+            recorder.record(endpoint, time.perf_counter() - start, ok)
+            return response
+
+        # One account per concurrent client
+        tokens = []
+        for user in range(args.concurrency):
+            credentials = {"username": f"bench{user}", "password": "pw"}
+            await timed("signup", lambda: auth_client.post("/signup", json=credentials))
+            response = await timed("login", lambda: auth_client.post("/login", json=credentials))
+            tokens.append(response.json()["access_token"])
+
+        weights = parse_mix(args.mix)
+        rng = random.Random(args.seed)
+        plan = rng.choices(list(weights), weights=list(weights.values()), k=args.requests)
+        queue = asyncio.Queue()
+        for index, endpoint in enumerate(plan):
+            queue.put_nowait((index, endpoint))
+
+        async def worker(token):
+            headers = {"Authorization": f"Bearer {token}"}
+            while not queue.empty():
+                index, endpoint = queue.get_nowait()
+                method, path, body = request_for(endpoint, index, args)
+                await timed(endpoint, lambda: client.request(method, path, json=body, headers=headers))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(token) for token in tokens])
+        wall_seconds = time.perf_counter() - start
+        stats = (await client.get("/stats")).json()
+        await assistant.auth_client.aclose()
+        assistant.auth_client = None
+
+    traffic = {name: value for name, value in recorder.summary(wall_seconds).items() if name in weights}
+    return {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "baseline", "tracing_overhead", "trace_path")},
+        "wall_seconds": wall_seconds,
+        "throughput": sum(endpoint["requests"] for endpoint in traffic.values()) / wall_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "endpoints": recorder.summary(wall_seconds),
+        "stats": stats,
+    }
+
+def regressions(result, baseline, tolerance):
+    """
+    Endpoints whose p95 latency grew, or throughput fell, by more than tolerance.
+    """
+    found = []
+    for name, current in result["endpoints"].items():
+        previous = baseline["endpoints"].get(name)
+        if previous is None:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            found.append(f"{name}: p95 {previous['p95_ms']:.1f} -> {current['p95_ms']:.1f} ms")
+        if current["throughput"] < previous["throughput"] * (1 - tolerance):
+            found.append(f"{name}: throughput {previous['throughput']:.1f} -> {current['throughput']:.1f}/s")
+    return found
+
+def tracing_overhead(argv, output):
+    """
+    Runs the same traffic with tracing off and on, each in its own process
+    (tracing is configured at import), and writes both results together with
+    the relative change in throughput and per-endpoint p95.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("off", "on"):
+            path = os.path.join(directory, f"{mode}.json")
+            flags = ["--tracing"] if mode == "on" else []
+            completed = subprocess.run(
+                [sys.executable, __file__, *argv, *flags, "--output", path],
+                capture_output=True, text=True,
+            )
+            if completed.returncode != 0:
+                sys.stderr.write(completed.stderr)
+                return None
+            with open(path) as f:
+                results[mode] = json.load(f)
+    off, on = results["off"], results["on"]
+    overhead = {
+        "throughput_change": on["throughput"] / off["throughput"] - 1,
+        "p95_change": {
+            name: on["endpoints"][name]["p95_ms"] / endpoint["p95_ms"] - 1
+            for name, endpoint in off["endpoints"].items() if name in on["endpoints"] and endpoint["p95_ms"] > 0
+        },
+    }
+    result = {"off": off, "on": on, "overhead": overhead}
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="In-process load benchmark for the auth and assistant services")
+    parser.add_argument("--requests", type=int, default=400, help="Requests in the mixed traffic")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients, each with its own account")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. analyze=4,chat=1")
+    parser.add_argument("--distinct-inputs", type=int, default=50, help="Distinct code inputs before they repeat")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Fake LLM seconds to first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=2000, help="Fake LLM token rate")
+    parser.add_argument("--max-chains", type=int, default=8, help="MAX_CONCURRENT_CHAINS for the assistant")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--no-auth-hop", dest="auth_hop", action="store_false",
+                        help="Verify tokens locally only, without asking the auth service")
+    parser.add_argument("--tracing", action="store_true", help="Enable sampled tracing (TRACING=true)")
+    parser.add_argument("--trace-sample-rate", type=float, default=0.01, help="TRACE_SAMPLE_RATE with --tracing")
+    parser.add_argument("--trace-path", help="Where traces go with --tracing (default: a temporary file)")
+    parser.add_argument("--tracing-overhead", action="store_true",
+                        help="Run with tracing off and on in separate processes and report the difference")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Earlier results to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative change against the baseline")
+    args = parser.parse_args(argv)
+
+    if args.tracing_overhead:
+        passed = [arg for arg in (sys.argv[1:] if argv is None else argv) if arg != "--tracing-overhead"]
+        # --output and --baseline apply to the combined result, not to each run
+        for flag in ("--output", "--baseline"):
+            while flag in passed:
+                index = passed.index(flag)
+                del passed[index:index + 2]
+        result = tracing_overhead(passed, args.output)
+        if result is None:
+            return 1
+        overhead = result["overhead"]
+        print(f"tracing on vs off: throughput {overhead['throughput_change']:+.1%}")
+        for name, change in overhead["p95_change"].items():
+            print(f"  {name:10} p95 {change:+.1%}")
+        return 0
+
+    configure(args)
+    result = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{result['throughput']:.1f} req/s over {result['wall_seconds']:.2f} s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    for name, endpoint in result["endpoints"].items():
+        print(f"  {name:10} n={endpoint['requests']:4} err={endpoint['errors']} "
+              f"p50={endpoint['p50_ms']:.1f} p95={endpoint['p95_ms']:.1f} p99={endpoint['p99_ms']:.1f} ms")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
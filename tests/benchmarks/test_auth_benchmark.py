@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+from passlib.context import CryptContext
+
+import src.api.authentication.auth as auth_module
+from src.api.authentication.auth import app
+from src.api.authentication.user_store import UserStore
+
+ROUNDS = 10
+LOGINS = 16
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+@pytest.fixture
+def bcrypt_context(monkeypatch):
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=ROUNDS)
+    monkeypatch.setattr(auth_module, "pwd_context", context)
+    return context
+
+async def login_storm():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post("/signup", json={"username": "stormuser", "password": "pw"})
+        token = (await client.post("/login", json={"username": "stormuser", "password": "pw"})).json()["access_token"]
+
+        me_latencies = []
+        done = asyncio.Event()
+
+        async def probe_me():
+            # Latency is measured from when the probe was due, so time spent
+            # waiting for a blocked event loop counts against /me
+            due = start
+            while not done.is_set():
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                response = await client.get("/me", params={"token": token})
+                me_latencies.append(time.perf_counter() - due)
+                assert response.status_code == 200
+                due += 0.005
+
+        start = time.perf_counter()
+        logins = asyncio.gather(*[
+            client.post("/login", json={"username": "stormuser", "password": "pw"})
+            for _ in range(LOGINS)
+        ])
+        probe = asyncio.create_task(probe_me())
+        responses = await logins
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe
+
+    assert all(r.status_code == 200 for r in responses)
+    return LOGINS / elapsed, me_latencies
+
+def test_me_stays_responsive_during_login_storm(bcrypt_context):
+    start = time.perf_counter()
+    bcrypt_context.hash("pw")
+    single_hash = time.perf_counter() - start
+
+    throughput, me_latencies = asyncio.run(login_storm())
+    me_p50 = statistics.median(me_latencies)
+    print(
+        f"\nlogin throughput: {throughput:.1f}/s, "
+        f"/me p50: {me_p50 * 1000:.1f} ms, max: {max(me_latencies) * 1000:.1f} ms, "
+        f"single hash: {single_hash * 1000:.1f} ms"
+    )
+
+    # Inline hashing would hold every /me behind at least one bcrypt run
+    assert me_p50 < single_hash / 2
+
+WORKER = """
+import asyncio, json, sys, time
+import httpx
+from src.api.authentication.auth import app
+
+phase, worker, count = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+
+async def run():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        start = time.perf_counter()
+        if phase == "signup":
+            requests = [client.post("/signup", json={"username": f"w{worker}-{i}", "password": "pw"}) for i in range(count)]
+        else:
+            # Log in as users another worker signed up
+            other = (worker + 1) % int(sys.argv[4])
+            requests = [client.post("/login", json={"username": f"w{other}-{i}", "password": "pw"}) for i in range(count)]
+        responses = await asyncio.gather(*requests)
+        elapsed = time.perf_counter() - start
+    print(json.dumps({"ok": sum(r.status_code == 200 for r in responses), "seconds": elapsed}))
+
+asyncio.run(run())
+"""
+
+def run_workers(phase, workers, count, env):
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, phase, str(worker), str(count), str(workers)],
+            cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        )
+        for worker in range(workers)
+    ]
+    start = time.perf_counter()
+    outputs = [process.communicate(timeout=120) for process in processes]
+    elapsed = time.perf_counter() - start
+    for process, (_, stderr) in zip(processes, outputs):
+        assert process.returncode == 0, stderr
+    results = [json.loads(stdout) for stdout, _ in outputs]
+    return sum(result["ok"] for result in results), elapsed
+
+def test_signup_and_login_across_worker_processes(tmp_path):
+    workers, count = 4, 10
+    path = str(tmp_path / "users.sqlite")
+    UserStore(path)  # create the schema before the workers race for it
+    env = {
+        **os.environ,
+        "USERS_DB_PATH": path,
+        "BCRYPT_ROUNDS": str(ROUNDS),
+        "HASH_WORKERS": "2",
+    }
+
+    signups, signup_seconds = run_workers("signup", workers, count, env)
+    logins, login_seconds = run_workers("login", workers, count, env)
+    print(
+        f"\n{workers} workers: signup {signups / signup_seconds:.1f}/s, "
+        f"login {logins / login_seconds:.1f}/s (including process start-up)"
+    )
+
+    # Every account is visible to, and can log in on, every other worker
+    assert signups == workers * count
+    assert logins == workers * count
@@ -0,0 +1,87 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+from src.core.chains import _budgeted_history
+from src.core.splitting import estimate_tokens
+from src.memory import memory
+from src.memory.retrieval import retrieval_stats
+from src.prompts.prompts import chat_prompt
+
+TURNS = 200
+BUDGET = 600
+
+def test_prompt_tokens_stay_flat_over_long_conversation(monkeypatch):
+    monkeypatch.setattr(memory, "HISTORY_TOKEN_BUDGET", BUDGET)
+    prompt_tokens = []
+
+    async def fake_llm(prompt_value):
+        prompt_tokens.append(sum(estimate_tokens(str(m.content)) for m in prompt_value.to_messages()))
+        return AIMessage(content="Here is a detailed answer " + "about Python " * 20)
+
+    async def fake_summarize(summary, messages):
+        return f"{len(messages)} more messages about Python. " + "detail " * 40
+
+    chain = RunnableWithMessageHistory(
+        RunnablePassthrough.assign(history=_budgeted_history) | chat_prompt | RunnableLambda(fake_llm),
+        memory.get_session_history,
+        input_messages_key="input",
+        history_messages_key="history"
+    )
+    config = {"configurable": {"session_id": "benchmark-session"}}
+
+    async def converse():
+        for turn in range(TURNS):
+            await chain.ainvoke({"input": f"Turn {turn}: how do I write " + "better code " * 10}, config=config)
+            # Done in the background by the API; awaited here to keep the run deterministic
+            await memory.update_summary("benchmark-session", fake_summarize)
+
+    asyncio.run(converse())
+
+    untrimmed = sum(estimate_tokens(str(m.content)) for m in memory.get_session_history("benchmark-session").messages)
+    late = prompt_tokens[TURNS // 4:]
+    print(f"\nprompt tokens: turn 1 {prompt_tokens[0]}, turn {TURNS} {prompt_tokens[-1]}, "
+          f"max after warm-up {max(late)}; full history would be {untrimmed}")
+
+    # Bounded by the budget plus the system prompt and the new question
+    assert max(prompt_tokens) <= BUDGET + 100
+    assert max(late) - min(late) <= BUDGET // 2
+    assert untrimmed > 10 * max(prompt_tokens)
+
+def test_retrieval_recalls_early_turns_quickly(monkeypatch):
+    monkeypatch.setattr(memory, "CHAT_MEMORY_MODE", "retrieval")
+    topics = [f"topic{turn}" for turn in range(TURNS)]
+    prompts = []
+
+    async def fake_llm(prompt_value):
+        prompts.append(prompt_value.to_messages())
+        return AIMessage(content="Here is a detailed answer " + "about Python " * 20)
+
+    chain = RunnableWithMessageHistory(
+        RunnablePassthrough.assign(history=_budgeted_history) | chat_prompt | RunnableLambda(fake_llm),
+        memory.get_session_history,
+        input_messages_key="input",
+        history_messages_key="history"
+    )
+    config = {"configurable": {"session_id": "retrieval-benchmark-session"}}
+    searches = retrieval_stats["searches"]
+    seconds = retrieval_stats["total_seconds"]
+
+    async def converse():
+        for topic in topics:
+            await chain.ainvoke({"input": f"How do I use {topic} with " + "better code " * 10}, config=config)
+        await chain.ainvoke({"input": f"Remind me what you said about {topics[3]}"}, config=config)
+
+    asyncio.run(converse())
+
+    average = (retrieval_stats["total_seconds"] - seconds) / (retrieval_stats["searches"] - searches)
+    tokens = [sum(estimate_tokens(str(m.content)) for m in prompt) for prompt in prompts]
+    print(f"\nretrieval: avg {average * 1000:.2f} ms per search over {TURNS} turns, "
+          f"max prompt tokens {max(tokens)}")
+
+    # The turn about topic3 is long gone from the recent window but is retrieved
+    assert any(f"use {topics[3]} with" in str(m.content) for m in prompts[-1])
+    assert max(tokens) <= 1000
+    assert average < 0.01
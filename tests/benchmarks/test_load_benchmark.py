@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+SCRIPT = os.path.join(ROOT, "tests", "benchmarks", "load_benchmark.py")
+
+def run_benchmark(*args):
+    # A separate process: both services read their settings at import
+    return subprocess.run(
+        [sys.executable, SCRIPT, "--requests", "60", "--concurrency", "4", "--llm-latency", "0.01", *args],
+        cwd=ROOT, capture_output=True, text=True, timeout=300,
+    )
+
+def test_mixed_traffic_benchmark_writes_comparable_results(tmp_path):
+    output = tmp_path / "bench.json"
+    completed = run_benchmark("--output", str(output))
+    assert completed.returncode == 0, completed.stderr
+    print("\n" + completed.stdout)
+
+    result = json.loads(output.read_text())
+    assert set(result["endpoints"]) == {"analyze", "pipeline", "chat", "history", "signup", "login"}
+    assert sum(result["endpoints"][name]["requests"] for name in ("analyze", "pipeline", "chat", "history")) == 60
+    for endpoint in result["endpoints"].values():
+        assert endpoint["errors"] == 0
+        assert endpoint["p50_ms"] <= endpoint["p95_ms"] <= endpoint["p99_ms"]
+        assert endpoint["peak_rss_mb"] > 0
+    assert result["throughput"] > 0 and result["peak_rss_mb"] > 0
+    # The auth service was asked about revocation in-process
+    assert result["stats"]["auth"]["hop"]["calls"] > 0
+
+    # A baseline that was much faster is reported as a regression
+    baseline = json.loads(output.read_text())
+    for endpoint in baseline["endpoints"].values():
+        endpoint["p95_ms"] /= 10
+    baseline_path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps(baseline))
+    completed = run_benchmark("--output", str(tmp_path / "next.json"), "--baseline", str(baseline_path))
+    assert completed.returncode == 1
+    assert "REGRESSION" in completed.stdout
+
+def test_tracing_overhead_runs_both_modes(tmp_path):
+    output = tmp_path / "tracing.json"
+    completed = run_benchmark("--tracing-overhead", "--trace-sample-rate", "0.5", "--output", str(output))
+    assert completed.returncode == 0, completed.stderr
+    print("\n" + completed.stdout)
+
+    result = json.loads(output.read_text())
+    assert result["off"]["stats"]["tracing"]["enabled"] is False
+    tracing = result["on"]["stats"]["tracing"]
+    assert tracing["enabled"] is True and tracing["sampled"] > 0
+    assert "analyze" in result["overhead"]["p95_change"]
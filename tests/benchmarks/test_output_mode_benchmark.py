@@ -0,0 +1,51 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+import src.core.chains as chains_module
+from src.core.splitting import estimate_tokens
+
+RUNS = 20
+# Stands in for prompt processing time, which grows with input tokens
+SECONDS_PER_PROMPT_TOKEN = 0.00005
+
+CODE = '''
+def moving_average(values, window):
+    result = []
+    for i in range(len(values) - window + 1):
+        result.append(sum(values[i:i + window]) / window)
+    return result
+'''
+
+async def prefill_llm(prompt_value):
+    tokens = sum(estimate_tokens(str(m.content)) for m in prompt_value.to_messages())
+    await asyncio.sleep(tokens * SECONDS_PER_PROMPT_TOKEN)
+    return AIMessage(content='{"is_optimal": false, "issues": ["O(n*w)"], "suggestions": ["Use a running sum"]}')
+
+def run_mode(monkeypatch, mode):
+    monkeypatch.setattr(chains_module, "OUTPUT_MODE", mode)
+    monkeypatch.setattr(chains_module, "_llm", RunnableLambda(prefill_llm))
+    monkeypatch.setattr(chains_module, "registry", {})
+    monkeypatch.setattr(chains_module, "chain_stats", {})
+
+    async def run():
+        chain = chains_module.get_chain("analysis")
+        for _ in range(RUNS):
+            await chain.ainvoke({"code": CODE})
+
+    asyncio.run(run())
+    stats = chains_module.chain_stats["analysis"]
+    return stats["prompt_tokens"] / stats["runs"], stats["total_seconds"] / stats["runs"]
+
+def test_compact_output_mode_cuts_prompt_tokens(monkeypatch):
+    full_tokens, full_seconds = run_mode(monkeypatch, "full")
+    compact_tokens, compact_seconds = run_mode(monkeypatch, "compact")
+    print(
+        f"\nanalysis prompt: full {full_tokens:.0f} tokens / {full_seconds * 1000:.1f} ms, "
+        f"compact {compact_tokens:.0f} tokens / {compact_seconds * 1000:.1f} ms "
+        f"({1 - compact_tokens / full_tokens:.0%} fewer tokens)"
+    )
+
+    assert compact_tokens < 0.6 * full_tokens
+    assert compact_seconds < full_seconds
@@ -0,0 +1,62 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+# Seconds from a fresh interpreter to the main service accepting requests
+BOOT_TIME_TARGET = float(os.getenv("BOOT_TIME_TARGET", "3"))
+
+BOOT = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import src.api.assistant.main as main
+imported = time.perf_counter()
+
+async def boot():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(boot())
+# Snapshot right after startup, before a fake LLM is put in place
+groq_imported = "langchain_groq" in sys.modules
+import src.core.chains as chains
+built = len(chains.registry)
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+chains._llm = FakeListChatModel(responses=["{}"])
+first = time.perf_counter()
+chains.get_chain("analysis")
+first_chain = time.perf_counter() - first
+warm = time.perf_counter()
+chains.warm_up()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "boot_seconds": ready - start,
+    "first_chain_seconds": first_chain,
+    "warm_up_seconds": time.perf_counter() - warm,
+    "groq_imported_at_boot": groq_imported,
+    "chains_built_at_boot": built,
+}))
+"""
+
+def run_boot():
+    env = {**os.environ, "GROQ_API_KEY": ""}
+    output = subprocess.run(
+        [sys.executable, "-c", BOOT], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert output.returncode == 0, output.stderr
+    return json.loads(output.stdout)
+
+def test_main_service_boots_without_building_chains():
+    result = run_boot()
+    print(
+        f"\nimport {result['import_seconds']:.2f} s, boot {result['boot_seconds']:.2f} s "
+        f"(target {BOOT_TIME_TARGET:.1f} s), first chain {result['first_chain_seconds'] * 1000:.1f} ms, "
+        f"warm-up of the rest {result['warm_up_seconds'] * 1000:.1f} ms"
+    )
+
+    # No API key, no LLM client and no chains are needed to start serving
+    assert not result["groq_imported_at_boot"]
+    assert result["chains_built_at_boot"] == 0
+    assert result["boot_seconds"] < BOOT_TIME_TARGET
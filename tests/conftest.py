@@ -8,12 +8,6 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 import sys
 from unittest.mock import MagicMock
 
-# Mock module langchain_groq if not installed
-try:
-    import langchain_groq
-except ImportError:
-    sys.modules["langchain_groq"] = MagicMock()
-
 # Mock passlib if not installed (for auth tests running in main container)
 try:
     import passlib
@@ -23,7 +17,10 @@ except ImportError:
 
 # Set environment variables for testing BEFORE importing any modules
 os.environ["GROQ_API_KEY"] = "dummy_key"
+os.environ["AUTH_SECRET_KEY"] = "test-secret"
 os.environ["AUTH_SERVICE_URL"] = "http://test-auth-service"
+# Each test run starts with no accounts
+os.environ["USERS_DB_PATH"] = ":memory:"
 os.environ["MAIN_SERVICE_URL"] = "http://test-main-service"
 
 @pytest.fixture
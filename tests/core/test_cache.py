@@ -0,0 +1,65 @@
+import time
+from src.core.cache import MISSING, DiskCache, ResultCache, TTLCache
+
+def test_ttl_cache_hit_and_miss():
+    cache = TTLCache(max_size=2, ttl=60)
+    assert cache.get("a") is MISSING
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hit_rate"] == 0.5
+
+def test_ttl_cache_caches_none():
+    cache = TTLCache()
+    cache.set("bad", None)
+    assert cache.get("bad") is None
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert len(cache) == 2
+
+def test_ttl_cache_expiry_and_invalidation():
+    cache = TTLCache(ttl=60)
+    cache.set("short", 1, ttl=0.01)
+    cache.set("long", 2)
+    time.sleep(0.02)
+    assert cache.get("short") is MISSING
+    cache.invalidate("long")
+    assert cache.get("long") is MISSING
+
+def test_disk_cache_persists_and_prunes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = DiskCache(path, max_size=2)
+    cache.set("a", {"x": 1}, ttl=60)
+    cache.set("b", {"x": 2}, ttl=60)
+    cache.set("c", {"x": 3}, ttl=60)
+    cache.set("old", {"x": 4}, ttl=-1)
+
+    reopened = DiskCache(path, max_size=2)
+    assert reopened.get("a") == {"x": 1}
+    assert reopened.get("old") is MISSING
+    reopened.prune()
+    assert len(reopened) == 2
+    assert reopened.get("a") is MISSING
+
+def test_result_cache_tiers(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    key = ResultCache.make_key("analysis", "model", "1", {"code": "x = 1"})
+    assert key != ResultCache.make_key("analysis", "model", "2", {"code": "x = 1"})
+
+    ResultCache(path=path).set(key, {"is_optimal": True})
+
+    # A fresh process only has the disk tier; the hit is promoted to memory
+    cache = ResultCache(path=path)
+    assert cache.get(key) == {"is_optimal": True}
+    assert cache.get(key) == {"is_optimal": True}
+    assert cache.get("other") is MISSING
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
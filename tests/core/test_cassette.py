@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import src.core.chains as chains_module
+from src.core.cassette import CassetteChatModel, CassetteMiss
+from src.core.fake_llm import FakeChatModel
+
+@pytest.mark.parametrize("mode", ["full", "native"])
+def test_replays_what_was_recorded_for_every_chain(tmp_path, monkeypatch, mode):
+    monkeypatch.setattr(chains_module, "OUTPUT_MODE", mode)
+    recorder = CassetteChatModel(path=str(tmp_path), model=FakeChatModel(latency=0, tokens_per_second=0))
+    player = CassetteChatModel(path=str(tmp_path))
+    config = {"configurable": {"session_id": f"cassette-{mode}"}}
+    runs = [
+        ("analysis", {"code": "x = 1"}),
+        ("test_generation", {"code": "def f(): pass"}),
+        ("explanation", {"test_code": "def test_f(): pass"}),
+        ("summary", {"summary": "", "messages": "human: hi"}),
+    ]
+    for name, inputs in runs:
+        recorded = chains_module.CHAIN_BUILDERS[name](recorder).invoke(inputs)
+        assert chains_module.CHAIN_BUILDERS[name](player).invoke(inputs) == recorded
+
+    # The chat prompt includes the session's history, so it is replayed in a fresh session
+    recorded = chains_module.build_chat_chain(recorder).invoke({"input": "hi"}, config=config)
+    replay_config = {"configurable": {"session_id": f"cassette-{mode}-replay"}}
+    assert chains_module.build_chat_chain(player).invoke({"input": "hi"}, config=replay_config).content == recorded.content
+
+def test_replay_streams_and_misses(tmp_path):
+    CassetteChatModel(path=str(tmp_path), model=FakeChatModel(latency=0, tokens_per_second=0)).invoke("recorded")
+    player = CassetteChatModel(path=str(tmp_path))
+
+    async def stream():
+        return [chunk.content async for chunk in player.astream([HumanMessage(content="recorded")])]
+
+    chunks = asyncio.run(stream())
+    assert len(chunks) > 1 and "".join(chunks) == player.invoke("recorded").content
+    with pytest.raises(CassetteMiss):
+        player.invoke("never recorded")
@@ -1,20 +1,143 @@
-from unittest.mock import MagicMock, patch
+
+import asyncio
+from unittest.mock import MagicMock
+
 import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from src.core.fake_llm import FakeChatModel
 from src.core.parsers import CodeAnalysis
+from src.core.repair import repair_stats
+from src.memory import memory
 
 import src.core.chains as chains_module
 
-# Mock the LLM output for analysis chain
 @pytest.fixture
-def mock_llm_response_analysis():
-    return CodeAnalysis(
-        is_optimal=False,
-        issues=["Syntax error"],
-        suggestions=["Fix syntax"]
+def fake_llm(monkeypatch):
+    llm = FakeListChatModel(responses=['{"is_optimal": false, "issues": ["Syntax error"], "suggestions": ["Fix syntax"]}'])
+    monkeypatch.setattr(chains_module, "_llm", llm)
+    monkeypatch.setattr(chains_module, "registry", {})
+    monkeypatch.setattr(chains_module, "build_seconds", {})
+    return llm
+
+def test_analysis_chain_structure(fake_llm):
+    result = chains_module.get_chain("analysis").invoke({"code": "print("})
+    assert result == CodeAnalysis(is_optimal=False, issues=["Syntax error"], suggestions=["Fix syntax"])
+
+def test_chains_are_built_once_on_first_use(fake_llm):
+    assert chains_module.registry == {}
+    chain = chains_module.get_chain("explanation")
+    assert chains_module.get_chain("explanation") is chain
+    assert list(chains_module.build_seconds) == ["explanation"]
+
+def test_warm_up_builds_requested_chains(fake_llm):
+    chains_module.warm_up(["analysis", "chat"])
+    assert set(chains_module.registry) == {"analysis", "chat"}
+    chains_module.warm_up()
+    assert set(chains_module.registry) == set(chains_module.CHAIN_BUILDERS)
+
+def test_llm_is_not_created_at_import(monkeypatch):
+    # A missing key only fails once a chain is needed
+    monkeypatch.setattr(chains_module, "_llm", None)
+    monkeypatch.setattr(chains_module, "registry", {})
+    monkeypatch.delenv("GROQ_API_KEY")
+    with pytest.raises(ValueError):
+        chains_module.get_chain("analysis")
+
+def test_compact_mode_sends_fewer_prompt_tokens(fake_llm, monkeypatch):
+    tokens = {}
+    for mode in ("full", "compact"):
+        monkeypatch.setattr(chains_module, "OUTPUT_MODE", mode)
+        monkeypatch.setattr(chains_module, "registry", {})
+        monkeypatch.setattr(chains_module, "chain_stats", {})
+        fake_llm.i = 0
+        result = chains_module.get_chain("analysis").invoke({"code": "print("})
+        assert result.issues == ["Syntax error"]
+        assert chains_module.chain_stats["analysis"]["runs"] == 1
+        tokens[mode] = chains_module.chain_stats["analysis"]["prompt_tokens"]
+    assert tokens["compact"] < tokens["full"] / 2
+
+def test_native_mode_uses_structured_output(monkeypatch):
+    expected = CodeAnalysis(is_optimal=True, issues=[], suggestions=[])
+    llm = MagicMock()
+    llm.with_structured_output.return_value = RunnableLambda(lambda _: expected)
+    monkeypatch.setattr(chains_module, "OUTPUT_MODE", "native")
+
+    assert chains_module.build_analysis_chain(llm).invoke({"code": "x = 1"}) == expected
+    llm.with_structured_output.assert_called_once_with(CodeAnalysis)
+
+def test_llm_retry_is_the_last_resort(monkeypatch):
+    llm = FakeListChatModel(responses=[
+        "Sorry, I cannot produce JSON for this.",
+        '{"is_optimal": true, "issues": [], "suggestions": []}',
+    ])
+    before = dict(repair_stats)
+
+    result = chains_module.build_analysis_chain(llm).invoke({"code": "x = 1"})
+    assert result.is_optimal is True
+    assert repair_stats["failed"] == before["failed"] + 1
+    assert repair_stats["llm_retry"] == before["llm_retry"] + 1
+
+    # Output that can be repaired locally never reaches the retry
+    llm = FakeListChatModel(responses=['```json\n{"is_optimal": true, "issues": [], "suggestions": [],}\n```'])
+    assert chains_module.build_analysis_chain(llm).invoke({"code": "x = 1"}).is_optimal is True
+    assert repair_stats["llm_retry"] == before["llm_retry"] + 1
+
+@pytest.mark.parametrize("mode", ["full", "native"])
+def test_explanation_stream_chain_output_parses_once_complete(monkeypatch, mode):
+    # Native mode streams the arguments of a tool call instead of message content
+    monkeypatch.setattr(chains_module, "OUTPUT_MODE", mode)
+    llm = FakeChatModel(latency=0, tokens_per_second=0)
+
+    async def run():
+        raw = ""
+        async for chunk in chains_module.build_explanation_stream_chain(llm).astream({"test_code": "def test(): pass"}):
+            raw += chains_module.chunk_text(chunk)
+        return await chains_module.parse_output("explanation", raw)
+
+    assert asyncio.run(run()).explanation
+
+def off_loop_calls(monkeypatch, owner, name):
+    # Records the calls to owner.name made outside a running event loop
+    calls = []
+    original = getattr(owner, name)
+
+    def checked(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(owner, name, checked)
+    return calls
+
+def chat_turn(session_id: str):
+    chain = chains_module.build_chat_chain(FakeListChatModel(responses=["Sure."]))
+    return asyncio.run(chain.ainvoke({"input": "Hi"}, config={"configurable": {"session_id": session_id}}))
+
+def test_chat_history_is_built_on_the_event_loop(monkeypatch):
+    history = memory.get_session_history("loop-chat")
+    for i in range(30):
+        history.add_messages([HumanMessage(content=f"question {i} " + "word " * 40), AIMessage(content=f"answer {i}")])
+    memory.summaries["loop-chat"] = memory.Summary(text="Earlier turns.", covered=10)
+
+    off_loop = off_loop_calls(monkeypatch, memory.store, "get")
+    assert chat_turn("loop-chat").content == "Sure."
+    assert off_loop == []
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_retrieval_index_is_used_on_the_event_loop(monkeypatch, tmp_path, backend):
+    monkeypatch.setattr(memory, "CHAT_MEMORY_MODE", "retrieval")
+    monkeypatch.setattr(memory, "HISTORY_BACKEND", backend)
+    monkeypatch.setattr(memory, "HISTORY_DB_PATH", str(tmp_path / "history.sqlite"))
+    memory.get_session_history("loop-retrieval").add_messages(
+        [HumanMessage(content="How do I deploy with docker?"), AIMessage(content="Use compose.")]
     )
 
-def test_analysis_chain_structure(mock_llm_response_analysis):
-    # Use patch.object on the imported module to avoid AttributeErrors with namespace packages
-    with patch.object(chains_module, "llm") as mock_llm:
-        from src.core.chains import analysis_chain
-        assert analysis_chain is not None
+    off_loop = off_loop_calls(monkeypatch, memory, "_session_index")
+    off_loop += off_loop_calls(monkeypatch, memory.store, "get")
+    assert chat_turn("loop-retrieval").content == "Sure."
+    assert off_loop == []
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import src.core.chains as chains_module
+from src.core.fake_llm import FakeChatModel
+from src.core import parsers
+
+INPUTS = {
+    "analysis": ({"code": "def f(x): return x"}, parsers.CodeAnalysis),
+    "test_generation": ({"code": "def f(x): return x"}, parsers.TestGeneration),
+    "explanation": ({"test_code": "def test_f(): assert f(1) == 1"}, parsers.TestExplanation),
+}
+
+@pytest.mark.parametrize("mode", ["full", "compact", "native"])
+def test_structured_chains_work_in_every_output_mode(monkeypatch, mode):
+    monkeypatch.setattr(chains_module, "OUTPUT_MODE", mode)
+    llm = FakeChatModel(latency=0, tokens_per_second=0)
+    for name, (inputs, model) in INPUTS.items():
+        result = chains_module.CHAIN_BUILDERS[name](llm).invoke(inputs)
+        assert isinstance(result, model)
+        # Same prompt, same answer
+        assert chains_module.CHAIN_BUILDERS[name](llm).invoke(inputs) == result
+
+def test_chat_and_summary_chains_get_text():
+    llm = FakeChatModel(latency=0, tokens_per_second=0, response_words=5)
+    config = {"configurable": {"session_id": "fake-llm-chat"}}
+    reply = chains_module.build_chat_chain(llm).invoke({"input": "Hi"}, config=config)
+    assert len(reply.content.split()) == 5
+    summary = chains_module.build_summary_chain(llm).invoke({"summary": "", "messages": "human: Hi"})
+    assert isinstance(summary, str) and summary
+
+def test_streams_at_the_configured_rate():
+    llm = FakeChatModel(latency=0.05, tokens_per_second=200, response_words=10)
+
+    async def stream():
+        start = time.perf_counter()
+        arrivals = []
+        async for chunk in llm.astream([HumanMessage(content="hello")]):
+            arrivals.append((time.perf_counter() - start, chunk.content))
+        return arrivals
+
+    arrivals = asyncio.run(stream())
+    text = "".join(content for _, content in arrivals)
+    assert len(arrivals) > 5 and len(text.split()) == 10
+    assert arrivals[0][0] >= 0.05
+    assert arrivals[-1][0] >= 0.05 + (len(arrivals) - 1) / 200 * 0.8
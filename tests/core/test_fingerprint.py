@@ -0,0 +1,26 @@
+from src.core.fingerprint import fingerprint_code
+
+def test_fingerprint_ignores_cosmetic_changes():
+    original = 'def add(a, b):\n    return a + b\n'
+    cosmetic = (
+        '# helper\n'
+        'def add(a,b):\n'
+        '    """Adds two numbers."""\n'
+        '\n'
+        '    return a  +  b   # sum\n'
+    )
+    assert fingerprint_code(original) == fingerprint_code(cosmetic)
+
+def test_fingerprint_ignores_quote_style():
+    assert fingerprint_code("x = 'a'")[0] == fingerprint_code('x = "a"')[0]
+
+def test_fingerprint_detects_real_changes():
+    assert fingerprint_code("x = 1")[0] != fingerprint_code("x = 2")[0]
+
+def test_fingerprint_keeps_docstring_only_bodies_valid():
+    fingerprint, parsed = fingerprint_code('def f():\n    """Only a docstring."""\n')
+    assert parsed
+    assert fingerprint == fingerprint_code("def f():\n    pass\n")[0]
+
+def test_fingerprint_falls_back_to_raw_text():
+    assert fingerprint_code("def broken(:") == ("def broken(:", False)
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_core.exceptions import OutputParserException
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from src.core import chains
+from src.core.fake_llm import FakeChatModel
+from src.core.metrics import Histogram, MetricsMiddleware, Registry, metrics
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert list(histogram.cumulative()) == [(0.1, 2), (1.0, 3), (float("inf"), 4)]
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(2.65)
+
+def test_render_prometheus_text():
+    registry = Registry()
+    registry.describe("requests_total", "counter", "Requests")
+    registry.inc("requests_total", {"route": "/a"})
+    registry.inc("requests_total", {"route": "/a"}, 2)
+    registry.observe("stage_seconds", 0.2, {"stage": "llm"})
+    registry.collect(lambda: [("cache_lookups_total", "counter", {"result": "hit"}, 7)])
+
+    text = registry.render()
+    assert "# HELP requests_total Requests\n# TYPE requests_total counter" in text
+    assert 'requests_total{route="/a"} 3' in text
+    assert 'cache_lookups_total{result="hit"} 7' in text
+    assert "# TYPE stage_seconds histogram" in text
+    assert 'stage_seconds_bucket{stage="llm",le="0.1"} 0' in text
+    assert 'stage_seconds_bucket{stage="llm",le="0.25"} 1' in text
+    assert 'stage_seconds_bucket{stage="llm",le="+Inf"} 1' in text
+    assert 'stage_seconds_count{stage="llm"} 1' in text
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.inc("errors_total", {"detail": 'bad "quote"\nline'})
+    assert 'errors_total{detail="bad \\"quote\\"\\nline"} 1' in registry.render()
+
+def test_stage_counts_errors():
+    registry = Registry()
+    with registry.stage("auth"):
+        pass
+    with pytest.raises(ValueError):
+        with registry.stage("auth"):
+            raise ValueError("rejected")
+    assert registry.get("stage_seconds", {"stage": "auth"}) == 2
+    assert registry.get("stage_errors_total", {"stage": "auth"}) == 1
+
+def test_middleware_labels_by_route_template():
+    registry = Registry()
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, registry=registry)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        return {"id": item_id}
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/missing")
+    assert registry.get("http_request_seconds", {"route": "/items/{item_id}", "method": "GET", "status": 200}) == 2
+    assert registry.get("http_request_seconds", {"route": "unmatched", "method": "GET", "status": 404}) == 1
+
+def test_chain_stages_and_tokens(monkeypatch):
+    monkeypatch.setattr(chains, "_llm", FakeChatModel(latency=0, tokens_per_second=0))
+    monkeypatch.setattr(chains, "registry", {})
+    monkeypatch.setattr(chains, "build_seconds", {})
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(metrics, "_histograms", {})
+
+    asyncio.run(chains.get_chain("analysis").ainvoke({"code": "def f(): return 1"}))
+
+    for stage in ("chain", "prompt", "llm", "parse"):
+        assert metrics.get("stage_seconds", {"stage": stage, "chain": "analysis"}) == 1
+    assert metrics.get("llm_prompt_tokens_total", {"chain": "analysis"}) > 0
+    assert metrics.get("llm_completion_tokens_total", {"chain": "analysis"}) > 0
+    assert metrics.get("stage_errors_total", {"stage": "parse", "chain": "analysis"}) == 0
+
+def test_chain_errors_are_counted_by_stage(monkeypatch):
+    # Nothing in the answer can be repaired into JSON
+    monkeypatch.setattr(chains, "_llm", FakeListChatModel(responses=["I would rather not say."]))
+    monkeypatch.setattr(chains, "registry", {})
+    monkeypatch.setattr(chains, "build_seconds", {})
+    monkeypatch.setattr(chains, "OUTPUT_REPAIR_RETRY", False)
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(metrics, "_histograms", {})
+
+    with pytest.raises(OutputParserException):
+        asyncio.run(chains.get_chain("analysis").ainvoke({"code": "def f(): return 1"}))
+
+    assert metrics.get("stage_errors_total", {"stage": "parse", "chain": "analysis"}) == 1
+    assert metrics.get("stage_errors_total", {"stage": "chain", "chain": "analysis"}) == 1
@@ -0,0 +1,53 @@
+import pytest
+
+from src.core import parsers
+from src.core.parsers import CodeAnalysis
+from src.core.repair import balanced_objects, repair_output, repair_stats, strip_fences
+
+def counted(steps):
+    return {step: repair_stats[step] for step in steps}
+
+def test_strip_fences_prefers_json_block():
+    text = "```python\nx = {1: 2}\n```\n```json\n{\"a\": 1}\n```"
+    assert strip_fences(text) == '{"a": 1}'
+    assert strip_fences("no fences") is None
+
+def test_balanced_objects_skip_braces_in_strings():
+    text = 'Result: {"issues": ["use {x}"], "n": {"m": 1}} and {"b": 2}'
+    assert balanced_objects(text) == ['{"issues": ["use {x}"], "n": {"m": 1}}', '{"b": 2}']
+
+def test_repairs_fenced_output_wrapped_in_prose():
+    before = counted(["fences", "extracted"])
+    result = repair_output(
+        'Here you go:\n```json\n{"is_optimal": true, "issues": [], "suggestions": ["a"]}\n```\nDone.', CodeAnalysis
+    )
+    assert result.suggestions == ["a"]
+    assert repair_stats["fences"] == before["fences"] + 1
+
+def test_repairs_python_style_quoting_and_trailing_commas():
+    assert repair_output("{'is_optimal': True, 'issues': [\"it's slow\"], 'suggestions': [],}", CodeAnalysis).issues == ["it's slow"]
+    before = repair_stats["trailing_commas"]
+    assert repair_output('{"is_optimal": false, "issues": ["a",], "suggestions": [],}', CodeAnalysis).issues == ["a"]
+    assert repair_stats["trailing_commas"] == before + 1
+
+def test_repairs_raw_newlines_in_strings():
+    result = repair_output('{"test_code": "def test_x():\n    assert True"}', parsers.TestGeneration)
+    assert result.test_code == "def test_x():\n    assert True"
+
+def test_coerces_field_types():
+    before = repair_stats["coerced"]
+    result = repair_output(
+        '{"is_optimal": "no", "issues": "- too slow\\n- no docstring", "suggestions": null}', CodeAnalysis
+    )
+    assert result == CodeAnalysis(is_optimal=False, issues=["too slow", "no docstring"], suggestions=[])
+    assert repair_stats["coerced"] == before + 1
+
+def test_skips_placeholders_before_the_real_object():
+    result = repair_output('Fill in {fields}: {"is_optimal": true, "issues": [], "suggestions": []}', CodeAnalysis)
+    assert result.is_optimal is True
+
+def test_unrepairable_output_raises():
+    with pytest.raises(ValueError):
+        repair_output("I could not analyze this code.", CodeAnalysis)
+    with pytest.raises(ValueError):
+        repair_output('{"is_optimal": true}', CodeAnalysis)
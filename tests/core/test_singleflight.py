@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from src.core.singleflight import SingleFlight
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        results = await asyncio.gather(*[flight.do("key", work, "analysis") for _ in range(10)])
+        assert results == ["result"] * 10
+        # Finished calls are forgotten: the next one runs again
+        assert await flight.do("key", work, "analysis") == "result"
+
+    asyncio.run(run())
+    assert len(runs) == 2
+    assert flight.stats["analysis"] == {"calls": 2, "coalesced": 9, "cancelled": 0, "abandoned": 0}
+    assert flight.in_flight() == 0
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+
+    async def run():
+        async def work(value):
+            await asyncio.sleep(0.01)
+            return value
+        return await asyncio.gather(flight.do("a", lambda: work("a")), flight.do("b", lambda: work("b")))
+
+    assert asyncio.run(run()) == ["a", "b"]
+    assert flight.stats["default"]["calls"] == 2
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*[flight.do("key", fail) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats["default"]["calls"] == 1
+    assert flight.in_flight() == 0
+
+def test_cancelled_waiter_leaves_call_running_for_others():
+    flight = SingleFlight()
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return "result"
+
+    async def run():
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "result"
+    assert finished == [1]
+    assert flight.stats["default"]["cancelled"] == 1
+    assert flight.stats["default"]["abandoned"] == 0
+
+def test_call_is_cancelled_when_every_waiter_is_gone():
+    flight = SingleFlight()
+    events = []
+
+    async def work():
+        events.append("start")
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+        return "result"
+
+    async def run():
+        waiters = [asyncio.create_task(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        # A new caller does not join the cancelled call
+        assert flight.in_flight() == 0
+        async def quick():
+            return "fresh"
+        return await flight.do("key", quick)
+
+    assert asyncio.run(run()) == "fresh"
+    assert events == ["start", "cancelled"]
+    assert flight.stats["default"]["abandoned"] == 1
+    assert flight.stats["default"]["cancelled"] == 2
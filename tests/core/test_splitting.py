@@ -0,0 +1,87 @@
+from src.core.parsers import CodeAnalysis
+from src.core.splitting import (
+    MODULE_UNIT, chunk_code, estimate_tokens, merge_analyses, reduce_analyses, split_code_units
+)
+
+SOURCE = '''import os
+
+LIMIT = 3
+
+@staticmethod
+def first():
+    return 1
+
+class Second:
+    def method(self):
+        return 2
+'''
+
+def test_split_code_units():
+    units = split_code_units(SOURCE)
+    assert [name for name, _ in units] == [MODULE_UNIT, "first", "Second"]
+    assert units[0][1] == "import os\nLIMIT = 3\n"
+    assert units[1][1].startswith("@staticmethod\ndef first():")
+    assert "def method(self)" in units[2][1]
+
+def test_split_code_units_unparseable():
+    assert split_code_units("def broken(:") == [(MODULE_UNIT, "def broken(:")]
+
+def test_merge_analyses():
+    merged = merge_analyses([
+        ("a", CodeAnalysis(is_optimal=True, issues=[], suggestions=["Add typing"])),
+        ("b", CodeAnalysis(is_optimal=False, issues=["Slow loop", "Slow loop"], suggestions=[])),
+    ])
+    assert merged.is_optimal is False
+    assert merged.issues == ["b: Slow loop"]
+    assert merged.suggestions == ["a: Add typing"]
+
+def test_chunk_code_respects_budget_and_keeps_all_code():
+    source = "".join(f"def f{i}():\n    return {i}\n\n" for i in range(40))
+    chunks = chunk_code(source, max_tokens=50)
+    assert len(chunks) > 1
+    assert "".join(chunks) == source
+    assert all(estimate_tokens(chunk) <= 50 for chunk in chunks)
+    # Functions are never cut in half
+    assert all(chunk.lstrip().startswith("def ") for chunk in chunks)
+
+def test_chunk_code_descends_into_large_classes():
+    methods = "".join(f"    def m{i}(self):\n        return {i}\n\n" for i in range(30))
+    source = f"class Big:\n{methods}"
+    chunks = chunk_code(source, max_tokens=60)
+    assert len(chunks) > 1
+    assert "".join(chunks) == source
+    assert chunks[0].startswith("class Big:")
+
+def test_chunk_code_descends_into_large_else_and_except_clauses():
+    def block(indent):
+        return "".join(f"{indent}value_{i} = compute({i})\n" for i in range(40))
+
+    sources = [
+        f"if flag:\n{block('    ')}elif other:\n{block('    ')}else:\n{block('    ')}",
+        f"try:\n{block('    ')}except ValueError:\n{block('    ')}else:\n{block('    ')}finally:\n{block('    ')}",
+        f"def handler():\n    try:\n{block('        ')}    except Exception:\n{block('        ')}",
+    ]
+    for source in sources:
+        chunks = chunk_code(source, max_tokens=60)
+        assert "".join(chunks) == source
+        assert all(estimate_tokens(chunk) <= 60 for chunk in chunks)
+
+def test_chunk_code_splits_trailing_comments():
+    comments = "".join(f"# note {i}: nothing after this line is a statement\n" for i in range(40))
+    source = f"x = 1\n\n{comments}"
+    chunks = chunk_code(source, max_tokens=60)
+    assert len(chunks) > 1
+    assert "".join(chunks) == source
+    assert all(estimate_tokens(chunk) <= 60 for chunk in chunks)
+
+def test_chunk_code_small_input_is_one_chunk():
+    assert chunk_code("x = 1\n", max_tokens=100) == ["x = 1\n"]
+
+def test_reduce_analyses_deduplicates():
+    reduced = reduce_analyses([
+        CodeAnalysis(is_optimal=True, issues=["Missing docstring"], suggestions=["Use typing"]),
+        CodeAnalysis(is_optimal=False, issues=["missing  docstring", "Slow loop"], suggestions=["Use typing"]),
+    ])
+    assert reduced.is_optimal is False
+    assert reduced.issues == ["Missing docstring", "Slow loop"]
+    assert reduced.suggestions == ["Use typing"]
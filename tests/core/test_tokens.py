@@ -0,0 +1,31 @@
+import pytest
+from src.core.tokens import InvalidToken, create_token, decode_token
+
+def test_token_round_trip():
+    token = create_token("alice", secret="s3cret")
+    claims = decode_token(token, secret="s3cret")
+    assert claims["sub"] == "alice"
+    assert claims["exp"] > claims["iat"]
+
+def test_token_rejects_wrong_secret():
+    token = create_token("alice", secret="s3cret")
+    with pytest.raises(InvalidToken):
+        decode_token(token, secret="other")
+
+def test_token_rejects_tampered_payload():
+    header, _, signature = create_token("alice", secret="s3cret").split(".")
+    forged = create_token("mallory", secret="s3cret").split(".")[1]
+    with pytest.raises(InvalidToken):
+        decode_token(f"{header}.{forged}.{signature}", secret="s3cret")
+
+def test_token_rejects_expired_and_malformed():
+    with pytest.raises(InvalidToken):
+        decode_token(create_token("alice", secret="s3cret", ttl=-1), secret="s3cret")
+    with pytest.raises(InvalidToken):
+        decode_token("alice", secret="s3cret")
+
+def test_token_rejects_non_ascii():
+    header, payload, _ = create_token("alice", secret="s3cret").split(".")
+    for token in ("é.é.é", f"{header}.{payload}.é"):
+        with pytest.raises(InvalidToken):
+            decode_token(token, secret="s3cret")
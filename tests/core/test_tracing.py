@@ -0,0 +1,169 @@
+import json
+import time
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from src.core import chains
+from src.core.fake_llm import FakeChatModel
+from src.core.metrics import Registry
+from src.core.tracing import (
+    BatchExporter, JsonlSink, Sampler, TracingMiddleware, mark_failed, parse_rates, tracing_stats
+)
+
+class ListSink:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, batch):
+        self.batches.append(batch)
+
+    @property
+    def traces(self):
+        return [trace for batch in self.batches for trace in batch]
+
+def test_sampler_rates_per_path_and_keep_rules():
+    assert parse_rates("/chat=0.05, /analyze=1") == {"/chat": 0.05, "/analyze": 1.0}
+    sampler = Sampler(rate=0.0, rates={"/analyze": 1.0}, slow_seconds=1.0, seed=0)
+    assert sampler.sample("/analyze") is True
+    assert sampler.sample("/chat") is False
+
+    assert sampler.keep(sampled=False, error=False, seconds=0.1) is None
+    assert sampler.keep(sampled=True, error=False, seconds=0.1) == "sampled"
+    assert sampler.keep(sampled=False, error=True, seconds=0.1) == "error"
+    assert sampler.keep(sampled=False, error=False, seconds=2.0) == "slow"
+
+def test_sampler_rate_is_respected():
+    sampler = Sampler(rate=0.1, rates={}, seed=1)
+    sampled = sum(sampler.sample("/analyze") for _ in range(10000))
+    assert 800 < sampled < 1200
+
+def test_exporter_batches_by_size_and_time():
+    sink = ListSink()
+    exporter = BatchExporter(sink, batch_size=3, flush_seconds=0.2, queue_size=100)
+    def wait_for(count):
+        deadline = time.monotonic() + 2
+        while len(sink.traces) < count and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    for i in range(3):
+        exporter.submit({"i": i})
+    wait_for(3)
+    exporter.submit({"i": 3})
+    wait_for(4)
+    exporter.close()
+    assert [trace["i"] for trace in sink.traces] == [0, 1, 2, 3]
+    # A full batch went out at once; the remainder on the timer
+    assert [len(batch) for batch in sink.batches] == [3, 1]
+
+def test_exporter_drops_when_queue_is_full():
+    sink = ListSink()
+    exporter = BatchExporter(sink, batch_size=100, flush_seconds=60, queue_size=2)
+    dropped = tracing_stats["dropped"]
+    for i in range(5):
+        exporter.submit({"i": i})
+    exporter.close()
+    assert tracing_stats["dropped"] - dropped == 3
+    assert [trace["i"] for trace in sink.traces] == [0, 1]
+
+def test_jsonl_sink_appends_lines(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    sink = JsonlSink(str(path))
+    sink([{"trace_id": "a"}, {"trace_id": "b"}])
+    sink([{"trace_id": "c"}])
+    assert [json.loads(line)["trace_id"] for line in path.read_text().splitlines()] == ["a", "b", "c"]
+
+def make_app(sampler, registry=None):
+    registry = registry or Registry()
+    sink = ListSink()
+    exporter = BatchExporter(sink, batch_size=1000, flush_seconds=60)
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware, exporter=exporter, sampler=sampler, registry=registry)
+
+    @app.get("/work")
+    async def work():
+        with registry.stage("auth"):
+            pass
+        with registry.stage("llm"):
+            pass
+        return {"ok": True}
+
+    @app.get("/fail")
+    async def fail():
+        with registry.stage("auth"):
+            pass
+        raise HTTPException(status_code=500, detail="boom")
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            yield "first\n"
+            # Too late for a 500: the error goes in the body
+            mark_failed()
+            yield "error\n"
+        return StreamingResponse(lines())
+
+    @app.get("/recovered")
+    async def recovered():
+        try:
+            with registry.stage("llm"):
+                raise ValueError("bad output")
+        except ValueError:
+            return {"ok": True}
+
+    @app.get("/slow")
+    async def slow():
+        time.sleep(0.05)
+        return {"ok": True}
+
+    @app.get("/analyze")
+    async def analyze():
+        return (await chains.get_chain("analysis").ainvoke({"code": "def f(): return 1"})).model_dump()
+
+    return app, exporter, sink
+
+def test_sampled_requests_carry_stage_spans():
+    app, exporter, sink = make_app(Sampler(rate=1.0, rates={}))
+    TestClient(app).get("/work")
+    exporter.close()
+    (trace,) = sink.traces
+    assert trace["path"] == "/work" and trace["status"] == 200 and trace["kept"] == "sampled"
+    assert [span["name"] for span in trace["spans"]] == ["auth", "llm"]
+    assert all(0 <= span["offset"] <= trace["seconds"] for span in trace["spans"])
+
+def test_unsampled_requests_keep_only_errors_and_slow_ones():
+    app, exporter, sink = make_app(Sampler(rate=0.0, rates={}, slow_seconds=0.04))
+    client = TestClient(app, raise_server_exceptions=False)
+    client.get("/work")
+    client.get("/fail")
+    client.get("/slow")
+    exporter.close()
+    kept = {trace["path"]: trace for trace in sink.traces}
+    assert set(kept) == {"/fail", "/slow"}
+    assert kept["/fail"]["kept"] == "error" and kept["/slow"]["kept"] == "slow"
+    # Head sampling said no, so no stage detail was collected
+    assert kept["/fail"]["spans"] == []
+
+def test_in_band_and_stage_errors_are_kept():
+    app, exporter, sink = make_app(Sampler(rate=0.0, rates={}))
+    client = TestClient(app)
+    assert client.get("/stream").status_code == 200
+    assert client.get("/recovered").status_code == 200
+    client.get("/work")
+    exporter.close()
+    kept = {trace["path"]: trace for trace in sink.traces}
+    assert set(kept) == {"/stream", "/recovered"}
+    assert all(trace["kept"] == "error" and trace["status"] == 200 for trace in kept.values())
+
+def test_chain_stages_become_spans(monkeypatch):
+    monkeypatch.setattr(chains, "_llm", FakeChatModel(latency=0, tokens_per_second=0))
+    monkeypatch.setattr(chains, "registry", {})
+    monkeypatch.setattr(chains, "build_seconds", {})
+    app, exporter, sink = make_app(Sampler(rate=1.0, rates={}), registry=chains.metrics)
+    assert TestClient(app).get("/analyze").status_code == 200
+    exporter.close()
+    (trace,) = sink.traces
+    names = [span["name"] for span in trace["spans"]]
+    assert {"prompt", "llm", "parse", "chain"} <= set(names)
+    assert all(span["labels"]["chain"] == "analysis" for span in trace["spans"])
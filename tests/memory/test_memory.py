@@ -0,0 +1,174 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.memory import memory
+
+def fill(session_id, turns, words=40):
+    history = memory.get_session_history(session_id)
+    for i in range(turns):
+        history.add_message(HumanMessage(content=f"question {i} " + "word " * words))
+        history.add_message(AIMessage(content=f"answer {i} " + "word " * words))
+    return history.messages
+
+def test_trim_history_keeps_recent_turns_within_budget():
+    messages = fill("trim-session", 20)
+    trimmed = memory.trim_history(messages, "trim-session", budget=200)
+    assert trimmed == messages[-len(trimmed):]
+    assert sum(memory.estimate_tokens(m.content) for m in trimmed) <= 200
+    assert trimmed[-1].content.startswith("answer 19")
+
+def test_update_summary_folds_old_turns():
+    messages = fill("summary-session", 20)
+    folded = []
+
+    async def fake_summarize(summary, new_messages):
+        folded.extend(new_messages)
+        return "They talked about words."
+
+    asyncio.run(memory.update_summary("summary-session", fake_summarize, budget=200))
+    summary = memory.summaries["summary-session"]
+    assert summary.covered == len(folded) > 0
+    assert folded == messages[:summary.covered]
+
+    trimmed = memory.trim_history(messages, "summary-session", budget=200)
+    assert "They talked about words." in trimmed[0].content
+    assert trimmed[1:] == messages[-(len(trimmed) - 1):]
+
+def test_update_summary_skips_short_sessions():
+    fill("short-session", 1)
+
+    async def fail_summarize(summary, new_messages):
+        raise AssertionError("nothing to summarize")
+
+    asyncio.run(memory.update_summary("short-session", fail_summarize, budget=2000))
+    assert "short-session" not in memory.summaries
+
+def test_session_store_evicts_least_recently_used():
+    store = memory.SessionStore(max_sessions=2)
+    store.get("a")
+    store.get("b")
+    store.get("a")
+    store.get("c")
+    assert "a" in store and "c" in store
+    assert "b" not in store
+    assert store.stats()["evictions"] == 1
+
+def test_session_store_expires_idle_sessions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(memory.time, "monotonic", lambda: now[0])
+    store = memory.SessionStore(idle_ttl=60)
+    store.get("idle").add_message(HumanMessage(content="hello"))
+    now[0] += 61
+    assert store.get("idle").messages == []
+
+def test_session_store_caps_messages_and_bytes():
+    store = memory.SessionStore(max_messages=3, max_bytes=100)
+    history = store.get("capped")
+    for i in range(5):
+        history.add_message(HumanMessage(content=f"message {i}"))
+    assert [m.content for m in history.messages] == ["message 2", "message 3", "message 4"]
+    assert history.dropped == 2
+    assert store.stats()["bytes"] == 3 * len("message 0")
+
+    store.get("big").add_message(HumanMessage(content="x" * 95))
+    # Bounds are enforced on the next access: "capped" was least recently used
+    store.get("big")
+    assert "capped" not in store
+    assert "big" in store
+
+def test_summary_survives_dropped_messages(monkeypatch):
+    monkeypatch.setattr(memory, "store", memory.SessionStore(max_messages=30))
+    fill("dropping-session", 10)
+
+    async def fake_summarize(summary, new_messages):
+        return "Earlier turns."
+
+    asyncio.run(memory.update_summary("dropping-session", fake_summarize, budget=200))
+    covered = memory.summaries["dropping-session"].covered
+    messages = fill("dropping-session", 10)
+    history = memory.get_session_history("dropping-session")
+    assert history.dropped == 10
+
+    trimmed = memory.trim_history(messages, "dropping-session", budget=200)
+    assert trimmed[0].content.endswith("Earlier turns.")
+    assert trimmed[-1] is messages[-1]
+    assert covered > 0
+
+def test_sqlite_backend_is_selected(monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "HISTORY_BACKEND", "sqlite")
+    monkeypatch.setattr(memory, "HISTORY_DB_PATH", str(tmp_path / "history.sqlite"))
+    memory.get_session_history("persisted").add_messages([HumanMessage(content="hi"), AIMessage(content="hello")])
+    assert memory.get_user_history("persisted") == [
+        {"role": "human", "content": "hi"},
+        {"role": "ai", "content": "hello"},
+    ]
+    assert memory.history_stats()["backend"] == "sqlite"
+
+    page, next_before = memory.get_history_page("persisted", 1)
+    assert [m["content"] for m in page] == ["hello"]
+    page, next_before = memory.get_history_page("persisted", 1, next_before)
+    assert [m["content"] for m in page] == ["hi"] and next_before is None
+    assert [m["content"] for m in memory.iter_history("persisted", batch_size=1)] == ["hi", "hello"]
+
+def test_sqlite_summaries_are_stored_in_the_database(monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "HISTORY_BACKEND", "sqlite")
+    monkeypatch.setattr(memory, "HISTORY_DB_PATH", str(tmp_path / "history.sqlite"))
+    messages = fill("sqlite-summary", 20)
+
+    async def fake_summarize(summary, new_messages):
+        return "Stored on disk."
+
+    asyncio.run(memory.update_summary("sqlite-summary", fake_summarize, budget=200))
+    assert "sqlite-summary" not in memory.summaries
+    assert memory.get_summary("sqlite-summary").text == "Stored on disk."
+    assert "Stored on disk." in memory.trim_history(messages, "sqlite-summary", budget=200)[0].content
+
+    memory.get_session_history("sqlite-summary").clear()
+    assert memory.get_summary("sqlite-summary") is None
+
+def test_sqlite_trim_history_does_not_reload_the_tail(monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "HISTORY_BACKEND", "sqlite")
+    monkeypatch.setattr(memory, "HISTORY_DB_PATH", str(tmp_path / "history.sqlite"))
+    monkeypatch.setattr(memory, "MAX_MESSAGES_PER_SESSION", 10)
+    messages = fill("sqlite-trim", 20, words=1)
+    memory.get_history_database(memory.HISTORY_DB_PATH).set_summary("sqlite-trim", "Earlier turns.", covered=35)
+
+    def no_reload(*args):
+        raise AssertionError("the tail is already loaded")
+
+    monkeypatch.setattr(memory.get_history_database(memory.HISTORY_DB_PATH), "tail", no_reload)
+    trimmed = memory.trim_history(messages, "sqlite-trim", budget=2000)
+    # 30 of the 40 messages are not loaded; the summary covers 5 of the loaded 10
+    assert trimmed[1:] == messages[5:]
+
+def test_retrieval_recalls_dropped_turns(monkeypatch):
+    monkeypatch.setattr(memory, "CHAT_MEMORY_MODE", "retrieval")
+    monkeypatch.setattr(memory, "store", memory.SessionStore(max_messages=6))
+    monkeypatch.setattr(memory, "RETRIEVAL_RECENT_MESSAGES", 2)
+    history = memory.get_session_history("retrieval-session")
+    history.add_messages([HumanMessage(content="my cat is called Tom"), AIMessage(content="Nice name")])
+    messages = fill("retrieval-session", 5)
+    assert history.dropped > 0
+
+    retrieved = memory.retrieve_history(messages, "retrieval-session", "what is my cat called?", k=1)
+    assert [m.content for m in retrieved[1:3]] == ["my cat is called Tom", "Nice name"]
+    assert retrieved[-2:] == messages[-2:]
+
+    # Only messages appended since are indexed on the next call
+    history.add_messages([HumanMessage(content="my dog is Rex"), AIMessage(content="Good dog")])
+    retrieved = memory.retrieve_history(history.messages, "retrieval-session", "dog", k=1)
+    assert history.index.next_position == 14
+    assert retrieved == history.messages[-2:]
+
+def test_retrieval_reads_sqlite_incrementally(monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "HISTORY_BACKEND", "sqlite")
+    monkeypatch.setattr(memory, "HISTORY_DB_PATH", str(tmp_path / "history.sqlite"))
+    monkeypatch.setattr(memory, "RETRIEVAL_RECENT_MESSAGES", 2)
+    history = memory.get_session_history("sqlite-retrieval")
+    history.add_messages([HumanMessage(content="deploy with docker compose"), AIMessage(content="ok")])
+    history.add_messages([HumanMessage(content="unrelated"), AIMessage(content="sure")])
+
+    retrieved = memory.retrieve_history(history.messages, "sqlite-retrieval", "docker", k=1)
+    assert [m.content for m in retrieved[1:3]] == ["deploy with docker compose", "ok"]
+    assert memory.indexes["sqlite-retrieval"].next_position == 4
@@ -0,0 +1,38 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.memory.retrieval import BM25Index, SessionIndex, tokenize
+
+def test_tokenize_splits_identifiers_and_drops_stopwords():
+    assert tokenize("How do I call get_user_history?") == ["call", "get_user_history", "get", "user", "history"]
+
+def test_bm25_ranks_rare_terms_higher():
+    index = BM25Index()
+    index.add(0, "python list comprehension")
+    index.add(1, "python decorators and closures")
+    index.add(2, "python python python")
+    assert index.search("decorators", 3)[0][0] == 1
+    assert [doc_id for doc_id, _ in index.search("python closures", 3)][0] == 1
+
+def test_bm25_remove_forgets_document():
+    index = BM25Index()
+    index.add(0, "asyncio semaphore")
+    index.add(1, "sqlite wal")
+    index.remove(0)
+    assert index.search("semaphore", 5) == []
+    assert len(index) == 1 and "semaphore" not in index.postings
+
+def test_session_index_returns_whole_exchanges_before_cutoff():
+    index = SessionIndex()
+    index.add_messages([
+        HumanMessage(content="how do generators work"), AIMessage(content="they yield values lazily"),
+        HumanMessage(content="and generators with send"), AIMessage(content="send resumes them"),
+    ])
+    assert [m.content for m in index.search("generators", 1, before=2)] == [
+        "how do generators work", "they yield values lazily",
+    ]
+
+def test_session_index_caps_messages():
+    index = SessionIndex(max_messages=2)
+    index.add_messages([HumanMessage(content=f"message{i}") for i in range(5)])
+    assert list(index.messages) == [3, 4]
+    assert index.search("message0", 1, before=5) == []
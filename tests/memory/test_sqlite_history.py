@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.memory.sqlite_history import HistoryDatabase, SQLiteChatMessageHistory
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+WORKER = """
+import sys
+from langchain_core.messages import AIMessage, HumanMessage
+from src.memory.sqlite_history import HistoryDatabase, SQLiteChatMessageHistory
+
+path, worker, turns = sys.argv[1], sys.argv[2], int(sys.argv[3])
+database = HistoryDatabase(path)
+for turn in range(turns):
+    for session_id in ("shared", f"own-{worker}"):
+        SQLiteChatMessageHistory(session_id, database, tail_size=10).add_messages([
+            HumanMessage(content=f"{worker}:{turn}:q"),
+            AIMessage(content=f"{worker}:{turn}:a"),
+        ])
+"""
+
+def test_tail_is_loaded_lazily(tmp_path):
+    database = HistoryDatabase(str(tmp_path / "history.sqlite"))
+    history = SQLiteChatMessageHistory("lazy", database, tail_size=3)
+    history.add_messages([HumanMessage(content=str(i)) for i in range(5)])
+    assert history._messages is None
+
+    fresh = SQLiteChatMessageHistory("lazy", database, tail_size=3)
+    assert [m.content for m in fresh.messages] == ["2", "3", "4"]
+    assert fresh.dropped == 2
+
+    fresh.add_message(AIMessage(content="5"))
+    assert [m.content for m in fresh.messages] == ["3", "4", "5"]
+
+    fresh.clear()
+    assert SQLiteChatMessageHistory("lazy", database, tail_size=3).messages == []
+
+def test_concurrent_worker_processes_share_history(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    HistoryDatabase(path)  # create the schema before the workers race for it
+    workers, turns = 4, 25
+    processes = [
+        subprocess.Popen([sys.executable, "-c", WORKER, path, str(worker), str(turns)], cwd=ROOT)
+        for worker in range(workers)
+    ]
+    assert all(process.wait(timeout=60) == 0 for process in processes)
+
+    database = HistoryDatabase(path)
+    assert database.count("shared") == workers * turns * 2
+    for worker in range(workers):
+        own = SQLiteChatMessageHistory(f"own-{worker}", database, tail_size=1000).messages
+        # Each turn's question and answer were committed together and in order
+        assert [m.content for m in own] == [
+            f"{worker}:{turn}:{kind}" for turn in range(turns) for kind in ("q", "a")
+        ]
+    shared = SQLiteChatMessageHistory("shared", database, tail_size=1000).messages
+    for question, answer in zip(shared[::2], shared[1::2]):
+        assert question.content[:-1] == answer.content[:-1]
+
+def test_page_and_after_cursors(tmp_path):
+    database = HistoryDatabase(str(tmp_path / "history.sqlite"))
+    database.append("paged", [HumanMessage(content=str(i)) for i in range(5)])
+    database.append("other", [HumanMessage(content="x")])
+
+    newest = database.page("paged", 2)
+    assert [m.content for _, m in newest] == ["3", "4"]
+    older = database.page("paged", 2, before=newest[0][0])
+    assert [m.content for _, m in older] == ["1", "2"]
+    assert [m.content for _, m in database.after("paged", older[-1][0], 10)] == ["3", "4"]